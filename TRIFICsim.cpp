@@ -215,6 +215,7 @@ float printValues(istream& srimCollisionDataSource, string isotopeName[], float
 	}	
 	
 	// LOOP PRINTS ISOTOPE BY ISOTOPE VALUES; FOR BRAGG PLOTS
+	// (TRIMbatch/bragg.py computes these curves for every isotope at once, with uncertainties)
 	/*
 	printf("\nBragg for %s-%.0f\n\n", isotopeName[*isotopeCountP-1].c_str(), ceil(isotopeMass[*isotopeCountP-1]));
 	for (int i = 1; i < numGrids; i+=2) {
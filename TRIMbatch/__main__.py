@@ -0,0 +1,4 @@
+from .pipeline import main
+
+# python -m TRIMbatch experiment.json runs an experiment spec (see pipeline.py)
+main()
@@ -1,16 +1,39 @@
+import hashlib
+import itertools
+import json
 import os
 import pathlib
 import subprocess
-from . import compoundparse
-from . import ionparse
+from . import catalog
+from . import collisions
+from . import compression
+from . import estimate
+from . import hist
+from . import instrument
+from . import jobqueue
+from . import materials
+from . import pid
+from . import runner
+
+# TRIM's output files for each output profile, as the Diskfiles line of TRIM.IN: Ranges, Backscatt, Transmit, Sputtered, Collisions and the
+# EXYZ energy increment (eV). 'full' is the collision file with recoil cascades that has always been written, 'ions' the collision file
+# without the recoils, and 'lean' only EXYZ.txt, which gives the ion's energy and position every increment eV of energy loss; that is all the
+# PID analysis uses, in a small fraction of the space.
+PROFILES = {
+	'full':	[0,0,0,0,2,0],
+	'ions':	[0,0,0,0,1,0],
+	'lean':	[0,0,0,0,0,'increment']
+	}
 
 class Batch:
-	def __init__(self,saveto,ion,mass,energy,number,angle=0,corr=0,autosave=10000):
+	def __init__(self,saveto,ion,mass,energy,number,angle=0,corr=0,autosave=10000,profile='full',increment=100000):
 		# Batch object must be initialized with an ion and location for the Batch object to write a .IN file to within the TRIMDATA directory created in the cloned TRIFIC dir
 		# (an example location could be 'TRIFIC 11-19-2017' where all batch files and simulation outputs for a single experiment will be stored). To define the ion,
 		# give the symbol (e.g. 'Ga' for Gallium), its mass in amu (e.g. 80 for 80Ga), its energy in keV (e.g. 381600 for 80Ga @ 4.77MeV/u), and the number of ions
 		# to simulate (50 is usually a reasonable number). Other ion parameters such as the Angle, Bragg Correction, and AutoSave Number are set to TRIM defaults
 		# (0, 0, and 10000 respectively) as they do not need to be changed for most simulations.
+		# profile chooses the output TRIM writes (see PROFILES above): 'full' by default, or 'lean' to write only the EXYZ file with a step
+		# every increment eV, which is much faster to save and read when only PID plots are wanted. Both may be changed between files.
 
 		self.saveto = str(saveto)
 		self.ion = ion
@@ -20,16 +43,17 @@ class Batch:
 		self.angle = angle
 		self.corr = corr
 		self.autosave = autosave
+		self.profile = profile
+		self.increment = increment
 
-		self._atoms = ionparse.ionparse()
-		self._compounds = compoundparse.compoundparse()
+		# atom and compound directories are parsed once per process and shared between Batch objects (see materials.py)
+		self._materials = materials.database()
+		self._atoms = self._materials.atoms
+		self._compounds = self._materials.compounds
 
 		###### Check for legitimate inputs ######
-		# ion symbol must be valid; if we can't find the atomic number, quit out; this is a quick and dirty search
-		self._Z1 = 0
-		for atnb, atdata in self._atoms.items():
-			if atdata['Symbol'] == self.ion:
-				self._Z1 = atnb
+		# ion symbol must be valid; if we can't find the atomic number, quit out
+		self._Z1 = self._materials.Z(self.ion)
 		if self._Z1 == 0:
 			raise ValueError('Please enter a valid chemical symbol (H - U)')
 		# check number and autosave are integers
@@ -44,8 +68,10 @@ class Batch:
 		# check numerical arguments are all positive
 		if any(numarg <= 0 for numarg in [mass,energy,number,autosave]):
 			raise ValueError('Only positive values are accepted for ion parameters')
+		self._checkProfile()
 		self._homedir = os.path.expanduser('~')
 		self._fnames = [] # stores file names written using data from this object
+		self._seed = 0 # TRIM's random number seed, only changed when splitting a run into shards
 
 		# create empty dictionary for target layers (not a list so that layers may be defined out of order)
 		self._layers = {}
@@ -69,11 +95,7 @@ class Batch:
 		###### Check for legitimate inputs ######
 		# Check for valid atom/compound name
 		if compound == False:
-			goodatom = False
-			for atnb, atdata in self._atoms.items():
-				if atdata['Symbol'] == lname:
-					goodatom = True
-			if goodatom == False:
+			if self._materials.Z(lname) == 0:
 				raise ValueError('Single atom layer not found')
 		if compound == True:
 			if lname not in self._compounds.keys():
@@ -125,8 +147,8 @@ class Batch:
 						'Pressure': pressure,
 						'Compound': compound
 						}
-	def nextIon(self,ion,mass,energy,number,angle=0,corr=0,autosave=10000):
-		# Given an existing batch object, changes the ion data and writes another .IN file with the same target info
+	def nextIon(self,ion,mass,energy,number,angle=0,corr=0,autosave=10000,shards=1):
+		# Given an existing batch object, changes the ion data and writes another .IN file with the same target info (see makeBatch for shards)
 		self.ion = ion
 		self.mass = mass
 		self.energy = energy
@@ -135,10 +157,7 @@ class Batch:
 		self.corr = corr
 		self.autosave = autosave
 
-		self._Z1 = 0
-		for atnb, atdata in self._atoms.items():
-			if atdata['Symbol'] == self.ion:
-				self._Z1 = atnb
+		self._Z1 = self._materials.Z(self.ion)
 		if self._Z1 == 0:
 			raise ValueError('Please enter a valid chemical symbol (H - U)')
 		# check number and autosave are integers
@@ -154,9 +173,14 @@ class Batch:
 		if any(numarg <= 0 for numarg in [mass,energy,number,autosave]):
 			raise ValueError('Only positive values accepted for ion parameters')
 
-		self.makeBatch()
-	def makeBatch(self):
+		self.makeBatch(shards)
+	def makeBatch(self,shards=1):
 		# Method writes .IN file for TRIM to run in batch mode
+		# Files are named after the ion (mass, symbol, energy) followed by a hash of the file contents, so inputs for the same ion through
+		# different targets never overwrite each other, and an input that has been written (and simulated) before keeps its name.
+		# Giving shards > 1 splits the ions between that many input files, each with its own random number seed, so that one ion species
+		# can be simulated by several TRIM processes at once. The shards are listed in the index under a single file name, which is what
+		# batchFiles() returns; Sim runs the shards and merges their outputs back into one file of that name.
 
 		###### Check target layers are ok ######
 		# make sure that the layering order is sensical ie. layer keys proceed '1' to '# of layers'
@@ -164,34 +188,83 @@ class Batch:
 		for i in range(1,self._nolayers+1):
 			if str(i) not in self._layers.keys():
 				raise ValueError('Missing layers')
-		
-		###### create file to write to ######
-		self._fnames.append(str(self.mass)+self.ion+str(self.energy)+'.txt')
+		if isinstance(shards,int) is False or shards < 1 or shards > self.number:
+			raise ValueError('Number of shards must be a positive integer no larger than the number of ions')
+		self._checkProfile()
+
+		with instrument.stage('makeBatch',Saveto=self.saveto,Ion=str(self.mass)+self.ion,Energy=self.energy,Shards=shards) as record:
+			self._resolveTarget()
 
+			###### write .IN file ######
+			# write ion data and options as input by user below (some are hardcoded)
+			# parameters have been checked during target and ion input methods, so we should end up with a 'good' batch file (can't account for ignorance)
+			targetblock = self._renderTarget()
+			if shards == 1:
+				content = self._renderIon()+targetblock
+				self._fnames.append(batchName(self.ion,self.mass,self.energy,content))
+				contents = {self._fnames[-1]: content}
+				index = {self._fnames[-1]: self._describe()}
+			else:
+				number = self.number
+				contents = {}
+				index = {}
+				try:
+					for k in range(shards):
+						# spread the ions as evenly as possible, seeds are simply the shard numbers
+						self.number = number//shards+(1 if k < number % shards else 0)
+						self._seed = k
+						content = self._renderIon()+targetblock
+						fname = batchName(self.ion,self.mass,self.energy,content)
+						contents[fname] = content
+						index[fname] = dict(self._describe(),Seed=k)
+				finally:
+					self.number = number
+					self._seed = 0
+				self._fnames.append(batchName(self.ion,self.mass,self.energy,''.join(contents.values())))
+				for fname in contents:
+					index[fname]['Shard Of'] = self._fnames[-1]
+				index[self._fnames[-1]] = dict(self._describe(),Shards=list(contents.keys()))
+
+			# create directories if they do not already exist
+			savetodir = os.path.join(self._homedir,'TRIFIC','TRIMDATA',self.saveto)
+			pathlib.Path(os.path.join(savetodir,'IN')).mkdir(parents=True, exist_ok=True)
+			pathlib.Path(os.path.join(savetodir,'OUT')).mkdir(parents=True, exist_ok=True)
+			for fname, content in contents.items():
+				# an existing file with the same name already has exactly this content
+				if not os.path.exists(os.path.join(savetodir,'IN',fname)):
+					with open(os.path.join(savetodir,'IN',fname),'w',newline='') as infile:
+						infile.write(content)
+			if instrument.enabled():
+				record['Files'] = list(contents.keys())
+				record['Outputs'] = instrument.outputs([os.path.join(savetodir,'IN',fname) for fname in contents])
+			_updateIndex(self.saveto,index)
+	def _resolveTarget(self):
 		###### get target parameters ######
-		# get atomic makeup of layers
+		# get atomic makeup of layers, and the density each layer is simulated with ('Layer Density'); the density and pressure given by the
+		# user are left as they are so that the layers can be changed (or swept over) afterwards
 		self._layermakeup = [] # list corresponding to number of atoms in each layer, in order
 		for i in range(1,self._nolayers+1):
-			if self._layers[str(i)]['Compound'] == False:
+			layer = self._layers[str(i)]
+			layer['Layer Density'] = layer['Density']
+			if layer['Compound'] == False:
 				# look up atom in atom dictionary
-				for atnb, atdata in self._atoms.items():
-					if atdata['Symbol'] == self._layers[str(i)]['Name']:
-						self._layers[str(i)]['Atom List'] = [[int(atnb), 1.0]]
-						if self._layers[str(i)]['Density'] == 0:
-							if self._layers[str(i)]['Gas'] == True:
-								self._layers[str(i)]['Density'] = atdata['GasDens']
-							else:
-								self._layers[str(i)]['Density'] = atdata['Density']
+				atdata = self._materials.atom(layer['Name'])
+				layer['Atom List'] = [[self._materials.Z(layer['Name']), 1.0]]
+				if layer['Density'] == 0:
+					if layer['Gas'] == True:
+						layer['Layer Density'] = atdata['GasDens(g/cm3)']
+					else:
+						layer['Layer Density'] = atdata['Density (g/cm3)']
 				self._layermakeup.append(1)
 			else:
 				# look up compound in compound dictionary
-				self._layers[str(i)]['Atom List'] = self._compounds[self._layers[str(i)]['Name']]['Stoich']
-				if self._layers[str(i)]['Density'] == 0:
-					self._layers[str(i)]['Density'] = self._compounds[self._layers[str(i)]['Name']]['Density']
-				self._layermakeup.append(len(self._layers[str(i)]['Atom List']))
-			if self._layers[str(i)]['Pressure'] != 0:
-				self._layers[str(i)]['Density'] *= self._layers[str(i)]['Pressure']/760
-				self._layers[str(i)]['Pressure'] = 0 # set back to 0 so density is not scaled for future ions
+				layer['Atom List'] = self._compounds[layer['Name']]['Stoich']
+				if layer['Density'] == 0:
+					layer['Layer Density'] = self._compounds[layer['Name']]['Density']
+				self._layermakeup.append(len(layer['Atom List']))
+			if layer['Pressure'] != 0:
+				# ideal gas scaling from the density at STP
+				layer['Layer Density'] *= layer['Pressure']/760
 		self._nolayeratoms = sum(self._layermakeup)
 		# compile atomic data for layers
 		self._targetatoms = [] # list of dictionaries for each atom, indexed by position in layers
@@ -204,150 +277,385 @@ class Batch:
 								'Stoich': j[1],
 								'Disp': self._atoms[str(j[0])]['Disp'],
 								'Latt': self._atoms[str(j[0])]['Latt'],
-								'Surf': self._atoms[str(j[0])]['Surf'] 
+								'Surf': self._atoms[str(j[0])]['Surf']
 								})
-		###### write .IN file ######
-		# write ion data and options as input by user below (some are hardcoded)
-		# parameters have been checked during target and ion input methods, so we should end up with a 'good' batch file (can't account for ignorance)
+	def _checkProfile(self):
+		if self.profile not in PROFILES:
+			raise ValueError('Output profile must be one of '+', '.join(PROFILES))
+		if isinstance(self.increment,int) is False or self.increment <= 0:
+			raise ValueError('EXYZ increment must be a positive integer (eV)')
+	def _diskfiles(self):
+		return [self.increment if flag == 'increment' else flag for flag in PROFILES[self.profile]]
+	def _renderIon(self):
+		# ion data and options, up to and including the start of the target description; TRIM wants DOS line endings throughout
+		lines = [
+			'==> SRIM-2013.00 This file controls TRIM Calculations.',
+			'Ion: Z1 ,  M1,  Energy (keV), Angle,Number,Bragg Corr,AutoSave Number.',
+			'{} {} {} {} {} {} {}'.format(self._Z1, self.mass, self.energy, self.angle, self.number, self.corr, self.autosave),
+			'Cascades(1=No;2=Full;3=Sputt;4-5=Ions;6-7=Neutrons), Random Number Seed, Reminders',
+			'{} {} {}'.format(1, self._seed, 0),
+			'Diskfiles (0=no,1=yes): Ranges, Backscatt, Transmit, Sputtered, Collisions(1=Ion;2=Ion+Recoils), Special EXYZ.txt file',
+			'{} {} {} {} {} {}'.format(*self._diskfiles()),
+			'Target material : Number of Elements & Layers',
+			'\"{} ({}) into '.format(self.ion, self.energy)
+			]
+		return '\r\n'.join(lines)
+	def _renderTarget(self):
+		# the rest of the file, which depends only on the target layers
+		names = '+'.join(self._layers[str(i)]['Name'] for i in range(1,self._nolayers+1))
+		lines = [
+			'{}\" {} {}'.format(names, self._nolayeratoms, self._nolayers),
+			'PlotType (0-5); Plot Depths: Xmin, Xmax(Ang.) [=0 0 for Viewing Full Target]',
+			'{} {} {}'.format(5, 0, 0),
+			'Target Elements:    Z   Mass(amu)'
+			]
+		for i in range(len(self._targetatoms)):
+			lines.append('Atom {} = {} =   {} {}'.format(i+1, self._targetatoms[i]['Symbol'], self._targetatoms[i]['Z'], self._targetatoms[i]['Mass']))
+		# layer header
+		lines.append('Layer Layer Name / Width Density '+''.join('{}({}) '.format(atom['Symbol'], atom['Z']) for atom in self._targetatoms))
+		lines.append('Numb. Description (Ang) (g/cm3) '+'Stoich '*len(self._targetatoms))
+		# layer information, this is the clunkiest part
+		printedstoich = 0 # track printing of stoichiometry for each atom in each layer
+		for i in range(1,self._nolayers+1):
+			line = ' {} \"{}\" {} {} '.format(i, self._layers[str(i)]['Name'], self._layers[str(i)]['Width'], self._layers[str(i)]['Layer Density'])
+			line += '0 '*printedstoich
+			for j in range(printedstoich,printedstoich+len(self._layers[str(i)]['Atom List'])):
+				line += '{} '.format(self._targetatoms[j]['Stoich'])
+				printedstoich += 1
+			line += '0 '*(self._nolayeratoms-printedstoich)
+			lines.append(line)
+		# gas details for each layer
+		lines.append('0  Target layer phases (0=Solid, 1=Gas)')
+		lines.append(''.join('1 ' if self._layers[str(i)]['Gas'] == True else '0 ' for i in range(1,self._nolayers+1)))
+		# compound correction for each layer
+		lines.append('Target Compound Corrections (Bragg)')
+		lines.append(''.join('{} '.format(self._layers[str(i)]['Corr']) for i in range(1,self._nolayers+1)))
+		# target atom displacement, lattice binding and surface binding energies
+		lines.append('Individual target atom displacement energies (eV)')
+		lines.append(''.join('{} '.format(atom['Disp']) for atom in self._targetatoms))
+		lines.append('Individual target atom lattice binding energies (eV)')
+		lines.append(''.join('{} '.format(atom['Latt']) for atom in self._targetatoms))
+		lines.append('Individual target atom surface binding energies (eV)')
+		lines.append(''.join('{} '.format(atom['Surf']) for atom in self._targetatoms))
+		lines.append('Stopping Power Version (1=2011, 0=2011)')
+		lines.append(' 0')
+		return '\r\n'.join(lines)+'\r\n'
+	def _describe(self):
+		# details of the current ion and target, as stored in the index of the saveto directory
+		return {
+			'Ion': self.ion,
+			'Mass': self.mass,
+			'Energy': self.energy,
+			'Number': self.number,
+			'Profile': self.profile,
+			'Target': '+'.join(self._layers[str(i)]['Name'] for i in range(1,self._nolayers+1)),
+			'Layers': [{key: val for key, val in self._layers[str(i)].items() if key != 'Atom List'} for i in range(1,self._nolayers+1)]
+			}
+	def sweep(self,ions,energies=None,number=None,pressures=None,widths=None,unit='Ang',pernucleon=False,write=True):
+		# Writes an input file for every combination of the given ions, energies, gas pressures and layer widths, and returns a manifest of them.
+		# ions is a list of (symbol, mass) pairs, e.g. [('Ga',80),('Se',80)]; energies is a list (or range) of energies in keV, or in keV/u
+		# if pernucleon is True, and defaults to the current energy of the object; number defaults to the current number of ions.
+		# pressures and widths are dictionaries keyed by layer number, holding a list of pressures (Torr) or widths (in the given unit) to
+		# use for that layer, e.g. pressures={2: range(60,101,10)}. Layers that aren't swept keep their current parameters.
+		# Each combination of target parameters is rendered once and shared by all of the ions and energies going through it. Files are
+		# named as in makeBatch, added to batchFiles() and recorded in the index. With write=False nothing is written and the manifest
+		# entries hold the file contents instead ('Content').
+		# The manifest is a list with one dictionary per file giving the file name and the ion, energy, number, pressures and widths used.
+		if energies is None:
+			energies = [self.energy]
+		if number is None:
+			number = self.number
+		if pressures is None:
+			pressures = {}
+		if widths is None:
+			widths = {}
+
+		###### Check for legitimate inputs ######
+		for ion, mass in ions:
+			if self._materials.Z(ion) == 0:
+				raise ValueError('Please enter a valid chemical symbol (H - U)')
+			if mass <= 0:
+				raise ValueError('Only positive values accepted for ion parameters')
+		if any(energy <= 0 for energy in energies) or isinstance(number,int) is False or number <= 0:
+			raise ValueError('Only positive values accepted for ion parameters')
+		if unit not in ['Ang','cm','um']:
+			raise ValueError('Unit must be Ang, cm or um')
+		self._checkProfile()
+		for lnumber in list(pressures.keys())+list(widths.keys()):
+			if str(lnumber) not in self._layers.keys():
+				raise ValueError('Swept layer does not exist')
+		for lnumber in pressures.keys():
+			if self._layers[str(lnumber)]['Gas'] == False or self._layers[str(lnumber)]['Density'] != 0:
+				raise ValueError('Pressures may only be swept for gas layers without a user defined density')
+		if any(val <= 0 for vals in list(pressures.values())+list(widths.values()) for val in vals):
+			raise ValueError('Only positive values accepted for target layer parameters')
+		self._nolayers = len(self._layers.keys())
+		for i in range(1,self._nolayers+1):
+			if str(i) not in self._layers.keys():
+				raise ValueError('Missing layers')
+
+		scale = {'Ang': 1, 'um': 10000, 'cm': 100000000}[unit]
+		swept = [('Pressure',lnumber,vals) for lnumber, vals in sorted(pressures.items())]
+		swept += [('Width',lnumber,[val*scale for val in vals]) for lnumber, vals in sorted(widths.items())]
 
-		# create directories if they do not already exist
 		savetodir = os.path.join(self._homedir,'TRIFIC','TRIMDATA',self.saveto)
-		pathlib.Path(os.path.join(savetodir,'IN')).mkdir(parents=True, exist_ok=True)
-		pathlib.Path(os.path.join(savetodir,'OUT')).mkdir(parents=True, exist_ok=True)
-		# write to a file given ion information; will overwrite any existing file with the same name (same ion data)
-		with open(os.path.join(savetodir,'IN',self._fnames[-1]),'w') as infile:
-			print('==> SRIM-2013.00 This file controls TRIM Calculations.', end='\r\n', file=infile)
-			print('Ion: Z1 ,  M1,  Energy (keV), Angle,Number,Bragg Corr,AutoSave Number.', end='\r\n', file=infile)
-			print('{} {} {} {} {} {} {}'.format(self._Z1, self.mass, self.energy, 0, self.number, 0, 10000), end='\r\n', file=infile)
-			print('Cascades(1=No;2=Full;3=Sputt;4-5=Ions;6-7=Neutrons), Random Number Seed, Reminders', end='\r\n', file=infile)
-			print('{} {} {}'.format(1, 0, 0), end='\r\n', file=infile)
-			print('Diskfiles (0=no,1=yes): Ranges, Backscatt, Transmit, Sputtered, Collisions(1=Ion;2=Ion+Recoils), Special EXYZ.txt file', end='\r\n', file=infile)
-			print('{} {} {} {} {} {}'.format(0, 0, 0, 0, 2, 0), end='\r\n', file=infile)
-			print('Target material : Number of Elements & Layers', end='\r\n', file=infile)
-			print('\"{} ({}) into '.format(self.ion, self.energy), end='', file=infile)
-			for i in range(1,self._nolayers+1):
-				if i == self._nolayers:
-					print('{}\" '.format(self._layers[str(i)]['Name']), end='', file=infile)
-				else:
-					print('{}+'.format(self._layers[str(i)]['Name']), end='', file=infile)
-			print('{} {}'.format(self._nolayeratoms, self._nolayers), end='\r\n', file=infile)
-			print('PlotType (0-5); Plot Depths: Xmin, Xmax(Ang.) [=0 0 for Viewing Full Target]', end='\r\n', file=infile)
-			print('{} {} {}'.format(5, 0, 0), end='\r\n', file=infile)
-			print('Target Elements:    Z   Mass(amu)', end='\r\n', file=infile)
-			for i in range(len(self._targetatoms)):
-				print('Atom {} = {} =   {} {}'.format(i+1, self._targetatoms[i]['Symbol'], self._targetatoms[i]['Z'], self._targetatoms[i]['Mass']), end='\r\n', file=infile)
-			# print layer header
-			print('Layer Layer Name / Width Density ', end='', file=infile)
-			for i in range(len(self._targetatoms)):
-				print('{}({}) '.format(self._targetatoms[i]['Symbol'], self._targetatoms[i]['Z']), end='', file=infile)
-			print('', end='\r\n', file=infile)
-			print('Numb. Description (Ang) (g/cm3) ', end='', file=infile)
-			for i in range(len(self._targetatoms)):
-				print('Stoich ', end='', file=infile)
-			print('', end='\r\n', file=infile)
-			# print layer information, this is the clunkiest part
-			printedstoich = 0 # track printing of stoichiometry for each atom in each layer
-			for i in range(1,self._nolayers+1):
-				print(' {} \"{}\" {} {} '.format(i, self._layers[str(i)]['Name'], self._layers[str(i)]['Width'], self._layers[str(i)]['Density']), end='', file=infile)
-				for j in range(printedstoich):
-					print('{} '.format(0), end='', file=infile)
-				for j in range(printedstoich,printedstoich+len(self._layers[str(i)]['Atom List'])):
-					print('{} '.format(self._targetatoms[j]['Stoich']), end='', file=infile)
-					printedstoich += 1
-				for j in range(self._nolayeratoms-printedstoich):
-					print('{} '.format(0), end='', file=infile)
-				print('', end='\r\n', file=infile)
-			# print gas details for each layer
-			print('0  Target layer phases (0=Solid, 1=Gas)', end='\r\n', file=infile)
-			for i in range(1,self._nolayers+1):
-				if self._layers[str(i)]['Gas'] == True:
-					print('1 ', end='', file=infile)
-				else:
-					print('0 ', end='', file=infile)
-			print('', end='\r\n', file=infile)
-			# print compound correction for each layer
-			print('Target Compound Corrections (Bragg)', end='\r\n', file=infile)
-			for i in range(1,self._nolayers+1):
-				print('{} '.format(self._layers[str(i)]['Corr']), end='', file=infile)
-			print('', end='\r\n', file=infile)
-			# print target atom displacement energies
-			print('Individual target atom displacement energies (eV)', end='\r\n', file=infile)
-			for i in range(self._nolayeratoms):
-				print('{} '.format(self._targetatoms[i]['Disp']), end='', file=infile)
-			print('', end='\r\n', file=infile)
-			# print target atom lattice binding energies
-			print('Individual target atom lattice binding energies (eV)', end='\r\n', file=infile)
-			for i in range(self._nolayeratoms):
-				print('{} '.format(self._targetatoms[i]['Latt']), end='', file=infile)
-			print('', end='\r\n', file=infile)
-			# print target atom surface binding energies
-			print('Individual target atom surface binding energies (eV)', end='\r\n', file=infile)
-			for i in range(self._nolayeratoms):
-				print('{} '.format(self._targetatoms[i]['Surf']), end='', file=infile)
-			print('', end='\r\n', file=infile)
-			print('Stopping Power Version (1=2011, 0=2011)', end='\r\n', file=infile)
-			print(' 0', end='\r\n', file=infile)
+		if write:
+			pathlib.Path(os.path.join(savetodir,'IN')).mkdir(parents=True, exist_ok=True)
+			pathlib.Path(os.path.join(savetodir,'OUT')).mkdir(parents=True, exist_ok=True)
+			existing = set(os.listdir(os.path.join(savetodir,'IN')))
+
+		# the ion and layers are changed while rendering and put back afterwards
+		saved = (self.ion, self.mass, self.energy, self.number, self._Z1)
+		savedlayers = {lnumber: dict(layer) for lnumber, layer in self._layers.items()}
+		manifest = []
+		index = {}
+		try:
+			for target in itertools.product(*[vals for key, lnumber, vals in swept]):
+				for (key, lnumber, vals), val in zip(swept,target):
+					self._layers[str(lnumber)][key] = val
+				self._resolveTarget()
+				targetblock = self._renderTarget()
+				layers = self._describe()
+				for (ion, mass), energy in itertools.product(ions,energies):
+					self.ion, self.mass, self.number = ion, mass, number
+					self.energy = energy*mass if pernucleon else energy
+					self._Z1 = self._materials.Z(ion)
+					content = self._renderIon()+targetblock
+					fname = batchName(self.ion,self.mass,self.energy,content)
+					entry = {
+						'File': fname,
+						'Ion': self.ion,
+						'Mass': self.mass,
+						'Energy': self.energy,
+						'Number': self.number,
+						'Pressures': {lnumber: self._layers[str(lnumber)]['Pressure'] for lnumber in pressures.keys()},
+						'Widths': {lnumber: self._layers[str(lnumber)]['Width'] for lnumber in widths.keys()}
+						}
+					if write:
+						if fname not in existing:
+							with open(os.path.join(savetodir,'IN',fname),'w',newline='') as infile:
+								infile.write(content)
+							existing.add(fname)
+						self._fnames.append(fname)
+						index[fname] = dict(layers,Ion=self.ion,Mass=self.mass,Energy=self.energy,Number=self.number)
+					else:
+						entry['Content'] = content
+					manifest.append(entry)
+		finally:
+			self.ion, self.mass, self.energy, self.number, self._Z1 = saved
+			self._layers = savedlayers
+		if write:
+			_updateIndex(self.saveto,index)
+		return manifest
+	def estimate(self,ions=None,geometry=None,scheme=None):
+		# Quick deterministic estimate of the mean energy each ion leaves in the collection regions, without running TRIM (see estimate.py).
+		# ions is a list of (symbol, mass, energy keV) tuples and defaults to the current ion; the target is the layers defined so far.
+		# Returns a dictionary with the regions ('regions') and partition sums ('parts') in MeV for every ion, as PIDData does, along with the
+		# depth (mm) each ion stops at ('Stopping Depth'). Nothing is written, so this can be called as often as needed, e.g. while changing
+		# a gas pressure with addTargetLayer between calls.
+		if ions is None:
+			ions = [(self.ion,self.mass,self.energy)]
+		self._nolayers = len(self._layers.keys())
+		for i in range(1,self._nolayers+1):
+			if str(i) not in self._layers.keys():
+				raise ValueError('Missing layers')
+		if any(mass <= 0 or energy <= 0 for ion, mass, energy in ions):
+			raise ValueError('Only positive values accepted for ion parameters')
+		self._resolveTarget()
+		layers = [self._layers[str(i)] for i in range(1,self._nolayers+1)]
+		return estimate.estimate(ions,layers,self._materials,geometry,scheme)
+	def enqueue(self,force=False,retries=0,queue=None,compress=None):
+		# Queues the files written with this object for worker processes to simulate, on this machine or any other sharing TRIMDATA,
+		# instead of simulating them here with Sim (see jobqueue.py). Returns the number of jobs queued.
+		return jobqueue.enqueue(self.saveto,self._fnames,force,retries,queue,compress)
 	def batchFiles(self):
 		return self._fnames
 		
-def Sim(saveto,fs):
+def Sim(saveto,fs,workers=1,force=False,timeout=None,retries=0,progress=True,interval=30,persistent=False,compress=None,live=None):
+	# Simulates the given input files with TRIM and saves the collision outputs to the OUT directory of saveto.
+	# workers sets how many TRIM processes run at once; each extra worker runs in its own copy of the SRIM install (see runner.py)
+	# and outputs are collected as soon as each simulation finishes.
+	# Input files are named after their contents, so a file whose output the catalog holds as complete (every ion asked for, or stopped
+	# on purpose by a live analysis, see catalog.completed) is skipped unless force is True; any other file is simulated again.
+	# timeout is the longest (in seconds) a single simulation may take before TRIM is killed, and retries the number of times a killed or
+	# failed simulation is tried again. With progress, the state of every job and the last ion it has written is printed every interval seconds.
+	# persistent keeps a single wineserver running for the whole batch instead of wine starting one for every file, which is worth doing
+	# when there are many short simulations (e.g. quick checks with a few tens of ions).
+	# compress ('gzip' or 'zstd') saves the outputs compressed as they are collected, e.g. OUT/<file>.gz; they are still referred to by
+	# their plain names everywhere else and are decompressed as they are read (see compression.py).
+	# live, a live.LiveAnalysis, follows the outputs while TRIM writes them and may stop jobs early once its targets are met (see live.py);
+	# stopped outputs hold fewer ions than their inputs asked for and are catalogued as 'stopped'.
 	homedir = os.path.expanduser('~')
-	os.chdir(os.path.join(homedir,'.wine','drive_c','Program Files (x86)','SRIM-2013'))
 
 	if saveto not in os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA')):
 		raise ValueError('Given directory not found')
+	if isinstance(workers,int) is False or workers < 1:
+		raise ValueError('Number of workers must be a positive integer')
+	if timeout is not None and timeout <= 0:
+		raise ValueError('Timeout must be a positive number of seconds')
+	if isinstance(retries,int) is False or retries < 0:
+		raise ValueError('Number of retries must be a non-negative integer')
+	if compress is not None and compress not in compression.SUFFIXES:
+		raise ValueError('Compression must be one of '+', '.join(compression.SUFFIXES))
+	if compress == 'zstd':
+		# fail now rather than after the first simulation
+		compression._zstandard()
+
+	with instrument.stage('Sim',Saveto=saveto,Files=len(fs),Workers=workers) as record:
+		jobs = []
+		shards = {}
+		with instrument.stage('Sim.scan',Saveto=saveto,Files=len(fs)):
+			index = getIndex(saveto)
+			# the input directory is listed once for the whole batch rather than once for every file
+			infiles = set(os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'IN')))
+			done = set() if force else catalog.completed(saveto,list(fs)+[shard for f in fs for shard in index.get(f,{}).get('Shards',[])])
+			for f in fs:
+				if f in done:
+					print(f,'already simulated, skipping')
+				elif 'Shards' in index.get(f,{}):
+					# shard outputs are kept out of OUT until they have been merged
+					pathlib.Path(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'SHARDS')).mkdir(parents=True, exist_ok=True)
+					shards[f] = index[f]['Shards']
+					for shard in shards[f]:
+						tocopy = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'IN',shard)
+						pasteto = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'SHARDS',shard)
+						if shard not in infiles:
+							print(shard,'not found in given directory')
+						elif shard not in done:
+							jobs.append((tocopy,pasteto))
+				elif f not in infiles:
+					print(f,'not found in given directory')
+				else:
+					tocopy = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'IN',f)
+					pasteto = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT',f)
+					jobs.append((tocopy,pasteto))
+
+		record['Jobs'] = len(jobs)
+		pastes = {os.path.basename(tocopy): pasteto for tocopy, pasteto in jobs}
+		runtimes = {}
+		stopped = set()
+		if live is not None:
+			live.expect([tocopy for tocopy, pasteto in jobs])
+
+		def report(name,state,ions,total,elapsed):
+			# keeps the catalog up to date as each job starts and finishes, then reports progress as asked
+			if state == 'started':
+				catalog.recordStart(saveto,name)
+			elif state in ('done','stopped'):
+				runtimes[name] = elapsed
+				if state == 'stopped':
+					stopped.add(name)
+				catalog.recordOutput(saveto,name,compression.resolve(pastes[name]),elapsed,state,ions)
+			if progress:
+				runner.printProgress(name,state,ions,total,elapsed)
 
-	for f in fs:
-		if f not in os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'IN')):
-			print(f,'not found in given directory')
-		else:
-        		filetosim = f
-        		tocopy = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'IN',filetosim)
-        		topaste = os.path.join(homedir,'.wine','drive_c','Program Files (x86)','SRIM-2013','TRIM.IN')
-        		subprocess.call(['cp',tocopy,topaste])
-        		subprocess.call(['wine','TRIM.exe'])
-        		copyto = os.path.join(homedir,'.wine','drive_c','Program Files (x86)','SRIM-2013','SRIM Outputs','COLLISON.txt')
-       			pasteto = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT',filetosim)
-        		subprocess.call(['cp',copyto,pasteto])
+		results = runner.runJobs(jobs,min(workers,max(len(jobs),1)),timeout=timeout,retries=retries,
+			progress=report,interval=interval,persistent=persistent,compress=compress,
+			monitor=live.monitor if live is not None else None,poll=live.poll if live is not None else 2)
+		record['Failed'] = sum(err is not None for job, err in results)
+		for job, err in results:
+			if err is not None:
+				print(os.path.basename(job[0]),'failed:',err)
+				catalog.recordFailure(saveto,os.path.basename(job[0]),err)
 
-def PIDPlot(saveto,fs,Xrange=0,Yrange=0,Xbins=50,Ybins=50):
-	# Creates PID plots (using existing code) given a list of file names and a location where to look for them.
+		# merge the outputs of sharded files into one, with the ions numbered on from one shard to the next
+		for f, fshards in shards.items():
+			outputs = [compression.resolve(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'SHARDS',shard)) for shard in fshards]
+			if all(os.path.exists(output) for output in outputs):
+				pasteto = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT',f)
+				saved = pasteto+compression.SUFFIXES[compress] if compress is not None else pasteto
+				with instrument.stage('Sim.merge',Saveto=saveto,File=f,Shards=len(fshards)) as merge:
+					ions = collisions.mergeCollisions(outputs,saved)
+					merge['Outputs'] = instrument.outputs([saved])
+				compression.remove(pasteto,keep=saved)
+				for output in outputs:
+					os.remove(output)
+				# the run time of a sharded file is the total over its shards
+				catalog.recordOutput(saveto,f,saved,
+					sum(runtimes[shard] for shard in fshards) if all(shard in runtimes for shard in fshards) else None,
+					'stopped' if any(shard in stopped for shard in fshards) else 'done',ions)
+			else:
+				print(f,'not merged, as not all of its shards were simulated')
+		if instrument.enabled():
+			record['Outputs'] = instrument.outputs([compression.resolve(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT',f)) for f in fs])
+
+def PIDPlot(saveto,fs,Xrange=0,Yrange=0,Xbins=50,Ybins=50,geometry=None,scheme=None,headless=False,png=False):
+	# Creates PID plots given a list of file names and a location where to look for them.
+	# The collision files are read and binned once in Python (see pid.py), and the partition sums are piped to the csv2h2 plotter.
 	# Takes up to 4 additional arguments to be passed to the plotter (args are checked to disallow potential shell insertion).
-	# grids arg should be '12', '13', or '23' depending on how the anode signals in TRIFIC are collected.
 	# bins arg determines how many bins exist in the x and y axes of the histogram. 50-100 is often a reasonable default.
 	# Setting Xrange (Yrange) forces the x-axis (y-axis) range of the plot. 0 (default) lets the plotter pick a reasonable value given the range of the data.
+	# geometry and scheme may be given to change the grid layout and partitioning from the defaults in pid.py; one plot is made for every
+	# pair of partitions, so the default 3-3-4 scheme gives the usual '12', '13' and '23' plots.
+	# With headless, the histograms are made with NumPy instead of ROOT (see hist.py): nothing is displayed and the function returns them
+	# straight away, after saving them to TRIMDATA/<saveto>/PID (and as PNG images with png).
 	homedir = os.path.expanduser('~')
 	if saveto not in os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA')):
 		raise ValueError('Given directory not found')
-	elif any(f not in os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT')) for f in fs):
+	outfiles = set(compression.listOutputs(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT')))
+	if any(f not in outfiles for f in fs):
 		raise ValueError('File not found in given directory')
 	elif any(isinstance(kwarg,int) is False for kwarg in [Xbins,Ybins,Xrange,Yrange]):
 		raise ValueError('Plotter arguments (bins, ranges) must be integers')
-	os.chdir(os.path.join(homedir,'TRIFIC'))
-	toplot = []
-	for f in fs:
-		toplot.append(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT',f))
-	tocall12 = './TRIFICsim 12 '
-	tocall13 = './TRIFICsim 13 '
-	tocall23 = './TRIFICsim 23 '
-	for f in toplot:
-		tocall12 = tocall12+f+' '
-		tocall13 = tocall13+f+' '
-		tocall23 = tocall23+f+' '
-	tocall12 = tocall12+'| ./csv2h2 -nx '+str(Xbins)+' -ny '+str(Ybins)+' -rx '+str(Xrange)+' -ry '+str(Yrange)+' -gn 12'
-	tocall13 = tocall13+'| ./csv2h2 -nx '+str(Xbins)+' -ny '+str(Ybins)+' -rx '+str(Xrange)+' -ry '+str(Yrange)+' -gn 13'
-	tocall23 = tocall23+'| ./csv2h2 -nx '+str(Xbins)+' -ny '+str(Ybins)+' -rx '+str(Xrange)+' -ry '+str(Yrange)+' -gn 23'
-	subprocess.Popen(tocall12,shell=True)
-	subprocess.Popen(tocall13,shell=True)
-	subprocess.Popen(tocall23,shell=True)
-	
+	with instrument.stage('PIDPlot',Saveto=saveto,Files=list(fs),Headless=headless):
+		if headless:
+			return hist.PIDHist(saveto,fs,Xrange,Yrange,Xbins,Ybins,geometry,scheme,png=png)
+		parts = pid.PIDData(saveto,fs,geometry,scheme)['parts']
+		plotters = []
+		for i in range(parts.shape[1]):
+			for j in range(i+1,parts.shape[1]):
+				tocall = [os.path.join(homedir,'TRIFIC','csv2h2'),'-nx',str(Xbins),'-ny',str(Ybins),'-rx',str(Xrange),'-ry',str(Yrange),'-gn',str(i+1)+str(j+1)]
+				plotter = subprocess.Popen(tocall,cwd=os.path.join(homedir,'TRIFIC'),stdin=subprocess.PIPE,universal_newlines=True)
+				plotter.stdin.write(''.join('{:4.2f}, {:4.2f}\n'.format(x,y) for x, y in parts[:,[i,j]]))
+				plotter.stdin.close()
+				plotters.append(plotter)
+
 	# block and then kill histograms if user did not close them properly
 	input("Press Enter to quit...")
-	subprocess.run("killall csv2h2",shell=True)
+	for plotter in plotters:
+		if plotter.poll() is None:
+			plotter.kill()
 
-def getFiles(saveto):
+def getFiles(saveto,details=False):
 	# returns names of files in existing simulation directory for ease of plotting already simulated ions
+	# With details, returns a dictionary keyed by file name holding each output's catalog entry instead (ion, target, run time, size and
+	# so on, see catalog.py); outputs missing from the catalog are added to it from the directory's index first.
 	homedir = os.path.expanduser('~')
-	if saveto not in os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA')):
-		raise ValueError('Given directory not found')
-	return os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT'))
+	with instrument.stage('getFiles',Saveto=saveto,Details=details) as record:
+		if saveto not in os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA')):
+			raise ValueError('Given directory not found')
+		# compressed outputs are listed under their plain names, which is how every other function takes them
+		files = compression.listOutputs(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT'))
+		record['Files'] = len(files)
+		if details:
+			runs = {run['File']: run for run in catalog.query(saveto=saveto) if run['Status'] in ('done','stopped')}
+			if any(f not in runs for f in files):
+				catalog.sync(saveto)
+				runs = {run['File']: run for run in catalog.query(saveto=saveto) if run['Status'] in ('done','stopped')}
+			return {f: runs.get(f,{}) for f in files}
+	return files
+
+def batchName(ion,mass,energy,content):
+	# file name for an input: the ion's mass, symbol and energy for people, and a hash of the file contents to tell apart different inputs
+	return str(mass)+ion+str(energy)+'-'+hashlib.sha1(content.encode()).hexdigest()[:12]+'.txt'
+
+def getIndex(saveto):
+	# returns the index of input files written to a simulation directory, keyed by file name; each entry holds the ion and target details
+	# The index is kept as one JSON entry per line, and only ever appended to, so adding a file doesn't mean rewriting the whole index.
+	homedir = os.path.expanduser('~')
+	indexpath = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'index.jsonl')
+	index = {}
+	if os.path.exists(indexpath):
+		with open(indexpath) as f:
+			for line in f:
+				if line.strip():
+					entry = json.loads(line)
+					index[entry.pop('File')] = entry
+	return index
+
+def _updateIndex(saveto,entries):
+	homedir = os.path.expanduser('~')
+	indexpath = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'index.jsonl')
+	with open(indexpath,'a') as f:
+		f.write(''.join(json.dumps(dict(entry,File=fname),sort_keys=True)+'\n' for fname, entry in entries.items()))
+	catalog.recordInputs(saveto,entries)
@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from . import batch
+from . import bragg
+from . import collisions
+from . import compression
+from . import compoundparse
+from . import hist
+from . import ionparse
+from . import materials
+from . import pid
+from . import store
+from . import synthetic
+
+# Times the hot paths of the interface on synthetic data, so that changes can be checked for speed-ups and regressions:
+#	python -m TRIMbatch.benchmark --sizes 100 1000 10000 100000 --out benchmark.json
+# Everything runs in a throwaway home directory holding a synthetic SRIM Data directory and synthetic collision files (see synthetic.py),
+# so neither wine nor SRIM is needed and nothing in the real TRIMDATA directory is touched. Results are written as JSON: the versions of
+# Python and NumPy it ran with, then for every stage (and every file size, for the stages that read collisions) the best and mean wall
+# time over the repeats and, where it makes sense, a rate.
+# If a TRIFICsim compiled from TRIFICsim.cpp (see make.sh) is found, the synthetic files are also checked against it: see trificsimCheck.
+
+ISOTOPES = [('Se',80,452000),('Kr',80,437600),('Rb',80,429600),('Sr',80,414400)]
+
+def _time(func,repeat):
+	# runs func repeat times and returns the best and mean wall times (s) and the value of the last call
+	times = []
+	for i in range(repeat):
+		start = time.perf_counter()
+		value = func()
+		times.append(time.perf_counter()-start)
+	return {'Best': min(times), 'Mean': sum(times)/len(times)}, value
+
+def _parse(path):
+	n = 0
+	for chunk in collisions.reader(path):
+		n += len(chunk['ion'])
+	return n
+
+def _bin(chunks):
+	return [pid.binCollisions(chunk) for chunk in chunks]
+
+def _read(directory):
+	n = 0
+	for chunk in store.CollisionStore(directory):
+		n += len(chunk['ion'])
+	return n
+
+def _histogram(parts):
+	return [hist.histogram2d(parts[:,i],parts[:,j]) for i in range(parts.shape[1]) for j in range(i+1,parts.shape[1])]
+
+def materialStages(datadir,repeat):
+	results = {}
+	results['ionparse'], atoms = _time(lambda: ionparse.ionparse(datadir),repeat)
+	results['compoundparse'], compounds = _time(lambda: compoundparse.compoundparse(datadir),repeat)
+	# the first load fills the cache, so time the loads that follow it
+	materials.load(datadir)
+	results['materials.load (cached)'], loaded = _time(lambda: materials.load(datadir),repeat)
+	return results
+
+def inputStages(saveto,files,repeat):
+	# input file rendering; every repeat writes new files, since makeBatch skips an input that already exists
+	results = {}
+	b = batch.Batch(saveto,'Se',80,452000,1000)
+	b.addTargetLayer(1,'Mylar',width=2,unit='um',gas=False)
+	b.addTargetLayer(2,'Carbon Dioxide',width=50,unit='cm',pressure=120,gas=True)
+	offset = [0]
+	def nextIons():
+		for k in range(files):
+			b.nextIon('Se',80,400000+offset[0]+k,1000)
+		offset[0] += files
+	results['Batch.nextIon'], value = _time(nextIons,repeat)
+	results['Batch.nextIon']['Files'] = files
+	results['Batch.nextIon']['Rate'] = files/results['Batch.nextIon']['Best']
+	energies = list(range(300000,300000+files))
+	results['Batch.sweep (no write)'], manifest = _time(lambda: b.sweep([('Se',80)],energies,write=False),repeat)
+	results['Batch.sweep (no write)']['Files'] = files
+	results['Batch.sweep (no write)']['Rate'] = files/results['Batch.sweep (no write)']['Best']
+	return results
+
+def collisionStages(workdir,ions,isotopes,ncollisions,repeat):
+	# Stages that read collisions, for a file of ions ions shared between the isotopes
+	results = {}
+	path = os.path.join(workdir,'COLLISON-'+str(ions)+'.txt')
+	perisotope = max(1,ions//len(isotopes))
+	start = time.perf_counter()
+	synthetic.writeCollisions(path,isotopes,perisotope,ncollisions)
+	results['Generate'] = {'Seconds': time.perf_counter()-start, 'Bytes': os.path.getsize(path)}
+
+	results['CollisionReader'], n = _time(lambda: _parse(path),repeat)
+	results['CollisionReader']['Collisions'] = n
+	results['CollisionReader']['Rate'] = n/results['CollisionReader']['Best']
+	results['CollisionReader']['MB/s'] = os.path.getsize(path)/1e6/results['CollisionReader']['Best']
+
+	# the same file saved compressed by Sim(...,compress='gzip'), read as a stream
+	start = time.perf_counter()
+	compressed = compression.compressFile(path,path,'gzip')
+	results['gzip'] = {'Seconds': time.perf_counter()-start, 'Bytes': os.path.getsize(compressed), 'Ratio': os.path.getsize(path)/os.path.getsize(compressed)}
+	results['CollisionReader (gzip)'], value = _time(lambda: _parse(compressed),repeat)
+	results['CollisionReader (gzip)']['Rate'] = n/results['CollisionReader (gzip)']['Best']
+	results['CollisionReader (gzip)']['Compressed MB/s'] = os.path.getsize(compressed)/1e6/results['CollisionReader (gzip)']['Best']
+	os.remove(compressed)
+
+	chunks = list(collisions.CollisionReader(path))
+	results['binCollisions'], binned = _time(lambda: _bin(chunks),repeat)
+	results['binCollisions']['Rate'] = n/results['binCollisions']['Best']
+	del chunks
+
+	directory = os.path.join(workdir,'COLUMNS-'+str(ions))
+	results['store.convert'], value = _time(lambda: store.convert(path,directory),repeat)
+	results['store.convert']['Rate'] = n/results['store.convert']['Best']
+	results['CollisionStore read'], value = _time(lambda: _read(directory),repeat)
+	results['CollisionStore read']['Rate'] = n/results['CollisionStore read']['Best']
+
+	data = pid.collectionRegions([store.CollisionStore(directory)])
+	parts = pid.partitionSums(data['regions'])
+	results['histogram2d'], value = _time(lambda: _histogram(parts),repeat)
+	results['histogram2d']['Ions'] = len(parts)
+	results['histogram2d']['Rate'] = len(parts)/results['histogram2d']['Best']
+
+	grids = bragg.signalGrids(data['regions'])
+	results['bragg.curves'], value = _time(lambda: bragg.curves(grids,data['isotope']),repeat)
+	results['bragg.curves']['Rate'] = len(grids)/results['bragg.curves']['Best']
+
+	os.remove(path)
+
+	# the same ions saved with the lean output profile, with one EXYZ step for every collision of the collision file
+	path = os.path.join(workdir,'EXYZ-'+str(ions)+'.txt')
+	synthetic.writeEXYZ(path,isotopes,perisotope,ncollisions)
+	results['EXYZReader'], n = _time(lambda: _parse(path),repeat)
+	results['EXYZReader']['Steps'] = n
+	results['EXYZReader']['Rate'] = n/results['EXYZReader']['Best']
+	results['EXYZReader']['MB/s'] = os.path.getsize(path)/1e6/results['EXYZReader']['Best']
+	os.remove(path)
+	return results
+
+def trificsimCheck(workdir,binary,ions=200,ncollisions=50):
+	# Runs TRIFICsim on a small synthetic file and compares the 3-3-4 partition sums it prints with those of pid.py, which checks both that
+	# the synthetic files are laid out as processSRIMData expects and that pid.py sums them as it does. TRIFICsim holds fewer than 10000
+	# ions and prints one isotope per file, so the file is a small one of a single isotope. It prints two decimals, so sums that agree to
+	# within 0.01 MeV are taken to agree.
+	path = os.path.join(workdir,'TRIFICsim.txt')
+	synthetic.writeCollisions(path,ISOTOPES[:1],ions,ncollisions)
+	parts = pid.partitionSums(pid.collectionRegions(path)['regions'])
+	result = {'Ions': ions, 'Rows': {}, 'Max Difference': 0.0}
+	for pair in ('12','13','23'):
+		printed = subprocess.run([binary,pair,path],stdout=subprocess.PIPE,universal_newlines=True,check=True).stdout
+		rows = np.array([[float(value) for value in line.split(',')] for line in printed.splitlines() if ',' in line]).reshape(-1,2)
+		result['Rows'][pair] = len(rows)
+		if len(rows) != len(parts):
+			result['Max Difference'] = None
+		elif result['Max Difference'] is not None:
+			expected = parts[:,[int(pair[0])-1,int(pair[1])-1]]
+			result['Max Difference'] = max(result['Max Difference'],float(np.abs(rows-expected).max()))
+	result['Agree'] = result['Max Difference'] is not None and result['Max Difference'] <= 0.01
+	os.remove(path)
+	return result
+
+def run(sizes=(100,1000,10000,100000),isotopes=3,collisions=50,repeat=3,files=100,trificsim=None):
+	# Runs every stage and returns the results. sizes are the numbers of ions per collision file (shared between isotopes isotopes),
+	# collisions the number of collisions per ion, and files the number of input files rendered when timing the input stages.
+	# trificsim is the TRIFICsim program to check the synthetic files against, if any.
+	if isotopes < 1 or isotopes > len(ISOTOPES):
+		raise ValueError('Number of isotopes must be between 1 and '+str(len(ISOTOPES)))
+	results = {
+		'Python': platform.python_version(),
+		'NumPy': np.__version__,
+		'Platform': platform.platform(),
+		'Settings': {'Sizes': list(sizes), 'Isotopes': isotopes, 'Collisions': collisions, 'Repeat': repeat, 'Files': files},
+		'Stages': {}
+		}
+	home = os.environ.get('HOME')
+	with tempfile.TemporaryDirectory() as tmphome:
+		# everything the interface reads or writes lives under the home directory, so pointing HOME elsewhere keeps the benchmark in a sandbox
+		os.environ['HOME'] = tmphome
+		materials._database = None
+		try:
+			datadir = os.path.join(tmphome,'.wine','drive_c','Program Files (x86)','SRIM-2013','Data')
+			synthetic.writeDatabase(datadir)
+			results['Stages']['Materials'] = materialStages(datadir,repeat)
+			results['Stages']['Inputs'] = inputStages('benchmark',files,repeat)
+			workdir = os.path.join(tmphome,'collisions')
+			os.makedirs(workdir)
+			results['Stages']['Collisions'] = {}
+			for ions in sizes:
+				print('Timing {} ions'.format(ions),file=sys.stderr)
+				results['Stages']['Collisions'][str(ions)] = collisionStages(workdir,ions,ISOTOPES[:isotopes],collisions,repeat)
+			if trificsim is not None:
+				results['TRIFICsim'] = trificsimCheck(workdir,trificsim,ncollisions=collisions)
+				if not results['TRIFICsim']['Agree']:
+					print('TRIFICsim and pid.py disagree on the synthetic file:',results['TRIFICsim'],file=sys.stderr)
+		finally:
+			materials._database = None
+			if home is None:
+				del os.environ['HOME']
+			else:
+				os.environ['HOME'] = home
+	return results
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Time the TRIMbatch hot paths on synthetic data (no wine or SRIM needed)')
+	parser.add_argument('--sizes',type=int,nargs='+',default=[100,1000,10000,100000],help='ions per collision file (e.g. add 1000000 for a long run)')
+	parser.add_argument('--isotopes',type=int,default=3,help='isotopes per collision file')
+	parser.add_argument('--collisions',type=int,default=50,help='collisions per ion')
+	parser.add_argument('--repeat',type=int,default=3,help='times each stage is run')
+	parser.add_argument('--files',type=int,default=100,help='input files rendered when timing makeBatch')
+	parser.add_argument('--out',default='benchmark.json',help='JSON file to write the results to')
+	parser.add_argument('--trificsim',default='./TRIFICsim',help='compiled TRIFICsim to check the synthetic files against, if it exists')
+	args = parser.parse_args(argv)
+	results = run(args.sizes,args.isotopes,args.collisions,args.repeat,args.files,args.trificsim if os.path.isfile(args.trificsim) else None)
+	with open(args.out,'w') as f:
+		json.dump(results,f,indent=1)
+	print('Results written to '+args.out,file=sys.stderr)
+
+if __name__ == '__main__':
+	main()
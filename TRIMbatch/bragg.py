@@ -0,0 +1,114 @@
+import os
+import numpy as np
+from . import catalog
+from . import compression
+from . import pid
+from . import scan
+from . import store
+
+# Bragg curves: the mean energy each isotope leaves along TRIFIC, grid by grid, as printed by the commented out half of TRIFICsim's
+# printValues. The collisions are binned as for PID plots (see pid.py) and every isotope's curve, along with its spread and the
+# uncertainty of the mean, comes out of one pass over the binned ions, however many isotopes and outputs (from any number of simulation
+# directories) are stacked together. Isotopes are matched by name and mass, so the same isotope simulated in several files or
+# directories gives a single curve.
+#
+# The uncertainty of a mean is the standard error, its standard deviation over the square root of the number of ions. With bootstrap,
+# the ions of every isotope are also resampled that many times and the spread of the resampled means is given alongside, which doesn't
+# rely on the energies being normally distributed (ions that stop inside TRIFIC make the last grids of a curve anything but).
+
+def signalGrids(regions):
+	# Sums the collection regions of every ion into signal grids (grid k collects regions 2k-1 and 2k); returns an (ions x grids) array
+	ngrids = (regions.shape[1]-2)//2
+	return regions[:,1:2*ngrids+1].reshape(len(regions),ngrids,2).sum(axis=2)
+
+def depths(ncolumns,grids=True,geometry=None):
+	# distance from the window (mm) of the middle of every signal grid, or of every collection region when grids is False
+	geo = pid._geometry(geometry)
+	if grids:
+		return geo['Window To Wires']+geo['Spacing']*(2*np.arange(1,ncolumns+1)-1)
+	return geo['Window To Wires']+geo['Spacing']*(np.arange(ncolumns)-0.5)
+
+def curves(values,isotope,nisotopes=None,bootstrap=0,seed=None):
+	# Bragg curves from per-ion energies: values is an (ions x grids) array (see signalGrids) and isotope the isotope index of every ion.
+	# Returns a dictionary of arrays with one row per isotope: the number of 'Ions', and the 'Mean', 'Width' (standard deviation) and
+	# 'Uncertainty' (standard error of the mean) of the energy in every grid; with bootstrap, 'Bootstrap' holds the standard deviation of
+	# the means of that many resamples of each isotope's ions (drawn from a generator seeded with seed).
+	if isinstance(bootstrap,int) is False or bootstrap < 0:
+		raise ValueError('Number of bootstrap resamples must be a non-negative integer')
+	isotope = np.asarray(isotope,dtype=np.int64)
+	if nisotopes is None:
+		nisotopes = int(isotope.max())+1 if len(isotope) else 0
+	ncolumns = values.shape[1]
+	# the sums and sums of squares of every isotope and grid at once, each as a single bincount over (isotope, grid) pairs
+	cells = (isotope[:,None]*ncolumns+np.arange(ncolumns)).ravel()
+	count = np.bincount(isotope,minlength=nisotopes).astype(np.float64)
+	total = np.bincount(cells,weights=values.ravel(),minlength=nisotopes*ncolumns).reshape(nisotopes,ncolumns)
+	squares = np.bincount(cells,weights=(values**2).ravel(),minlength=nisotopes*ncolumns).reshape(nisotopes,ncolumns)
+	n = np.maximum(count,1)[:,None]
+	mean = total/n
+	variance = np.maximum(squares-total*mean,0)/np.maximum(count-1,1)[:,None]
+	result = {'Ions': count.astype(np.int64), 'Mean': mean, 'Width': np.sqrt(variance), 'Uncertainty': np.sqrt(variance/n)}
+	if bootstrap:
+		rng = np.random.default_rng(seed)
+		spread = np.zeros((nisotopes,ncolumns))
+		order = np.argsort(isotope,kind='stable')
+		bounds = np.concatenate([[0],np.cumsum(count.astype(np.int64))])
+		for k in range(nisotopes):
+			these = values[order[bounds[k]:bounds[k+1]]]
+			if len(these) < 2:
+				continue
+			# Each resample is a multinomial count of how often every ion is drawn, so a block of resamples is one matrix product.
+			# Blocks are kept to about ten million counts.
+			means = []
+			block = max(1,10000000//len(these))
+			for first in range(0,bootstrap,block):
+				draws = rng.multinomial(len(these),np.full(len(these),1/len(these)),size=min(block,bootstrap-first))
+				means.append(draws @ these/len(these))
+			spread[k] = np.concatenate(means).std(axis=0,ddof=1) if bootstrap > 1 else 0
+		result['Bootstrap'] = spread
+	return result
+
+def braggSources(sources,geometry=None,grids=True,bootstrap=0,seed=None,chunksize=262144):
+	# Bragg curves of every isotope in collision data: sources is a collision file, a CollisionStore, or a list of either (see
+	# pid.collectionRegions). With grids, curves are per signal grid, otherwise per collection region (regions 0 and Grids+1 included).
+	# Returns the dictionary of curves() with the 'Isotopes' (labelled e.g. '80Kr', in order of the rows) and the 'Depth' (mm) of every
+	# grid added.
+	if not isinstance(sources,list):
+		sources = [sources]
+	data = pid.collectionRegions(sources,geometry,chunksize)
+	labels = []
+	index = []
+	for isotope in data['Isotopes']:
+		label = scan._label(isotope)
+		if label not in labels:
+			labels.append(label)
+		index.append(labels.index(label))
+	isotope = np.array(index,dtype=np.int64)[data['isotope']] if len(data['isotope']) else np.zeros(0,dtype=np.int64)
+	values = signalGrids(data['regions']) if grids else data['regions']
+	result = curves(values,isotope,len(labels),bootstrap,seed)
+	result['Isotopes'] = labels
+	result['Depth'] = depths(values.shape[1],grids,geometry)
+	return result
+
+def Bragg(runs,geometry=None,grids=True,bootstrap=0,seed=None,cache=True):
+	# Bragg curves of the outputs of one or more simulation directories stacked together. runs maps each directory to its list of
+	# outputs, e.g. {'80Torr': fs80, '80Torr-b': more80}, or is a list of (directory, outputs) pairs. The rest is as for braggSources.
+	# With cache, outputs are read from their columnar stores (see store.py) as PIDData does.
+	homedir = os.path.expanduser('~')
+	if isinstance(runs,dict):
+		runs = list(runs.items())
+	sources = []
+	for saveto, fs in runs:
+		if saveto not in os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA')):
+			raise ValueError('Given directory not found')
+		outfiles = compression.listOutputs(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT'))
+		if any(f not in outfiles for f in fs):
+			raise ValueError('File not found in given directory')
+		if cache:
+			sources.extend(store.cached(saveto,f) for f in fs)
+		else:
+			sources.extend(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT',f) for f in fs)
+	result = braggSources(sources,geometry,grids,bootstrap,seed)
+	for saveto, fs in runs:
+		catalog.recordAnalysis(saveto,fs)
+	return result
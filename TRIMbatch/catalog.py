@@ -0,0 +1,264 @@
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from . import collisions
+from . import compression
+from . import materials
+
+# A catalog of every input written and every output simulated, across all simulation directories, kept in TRIMDATA/catalog.sqlite so
+# that finding runs doesn't mean listing directories and parsing file names. Batch adds inputs as it writes them, Sim marks them
+# running, done or failed as it goes, and the analysis functions note when an output was last used. Two tables:
+#	runs	one row per input file (shards included): the ion (symbol, Z, mass amu, energy keV, number), output profile, target name
+#		and fingerprint, 'Shard Of' for shards, the status ('written', 'running', 'done', 'stopped' or 'failed'), the times it was
+#		written, started and finished, the simulation time (s), input and output sizes (bytes), the number of ions in the output, the
+#		error of a failed run and the time it was last analysed. Stopped runs were ended early by a live analysis (see live.py) and
+#		hold fewer ions than asked for
+#	layers	one row per target layer of every input: layer number, name, width (Angstrom), density simulated with (g/cm3), pressure
+#		(Torr, 0 if none was given) and whether it is a gas
+# The fingerprint is a short hash of the layers as simulated, so runs through exactly the same target share one. The catalog only
+# mirrors what is on disk (the index.jsonl files and the OUT directories); sync() brings it up to date with them, e.g. for directories
+# simulated before the catalog existed or after it has been deleted.
+
+# column of the runs table, the key it is given in the dictionaries returned by query(), and its SQL type
+RUNS = [
+	('saveto',	'Saveto',	'TEXT NOT NULL'),
+	('file',	'File',		'TEXT NOT NULL'),
+	('ion',		'Ion',		'TEXT'),
+	('z',		'Z',		'INTEGER'),
+	('mass',	'Mass',		'REAL'),
+	('energy',	'Energy',	'REAL'),
+	('number',	'Number',	'INTEGER'),
+	('profile',	'Profile',	'TEXT'),
+	('target',	'Target',	'TEXT'),
+	('fingerprint',	'Fingerprint',	'TEXT'),
+	('shard_of',	'Shard Of',	'TEXT'),
+	('status',	'Status',	'TEXT'),
+	('written',	'Written',	'REAL'),
+	('started',	'Started',	'REAL'),
+	('finished',	'Finished',	'REAL'),
+	('runtime',	'Runtime',	'REAL'),
+	('input_size',	'Input Size',	'INTEGER'),
+	('output_size',	'Output Size',	'INTEGER'),
+	('ions',	'Ions',		'INTEGER'),
+	('error',	'Error',	'TEXT'),
+	('analysed',	'Analysed',	'REAL')
+	]
+
+LAYERS = [
+	('saveto',	'Saveto',	'TEXT NOT NULL'),
+	('file',	'File',		'TEXT NOT NULL'),
+	('layer',	'Layer',	'INTEGER NOT NULL'),
+	('name',	'Name',		'TEXT'),
+	('width',	'Width',	'REAL'),
+	('density',	'Density',	'REAL'),
+	('pressure',	'Pressure',	'REAL'),
+	('gas',		'Gas',		'INTEGER')
+	]
+
+_SCHEMA = [
+	'CREATE TABLE IF NOT EXISTS runs ('+', '.join(column+' '+sqltype for column, key, sqltype in RUNS)+', PRIMARY KEY (saveto, file))',
+	'CREATE TABLE IF NOT EXISTS layers ('+', '.join(column+' '+sqltype for column, key, sqltype in LAYERS)+', PRIMARY KEY (saveto, file, layer))',
+	'CREATE INDEX IF NOT EXISTS runs_ion ON runs (ion, mass, status)',
+	'CREATE INDEX IF NOT EXISTS runs_fingerprint ON runs (fingerprint)',
+	'CREATE INDEX IF NOT EXISTS layers_name ON layers (name, pressure)'
+	]
+
+def catalogPath():
+	homedir = os.path.expanduser('~')
+	return os.path.join(homedir,'TRIFIC','TRIMDATA','catalog.sqlite')
+
+def connect(path=None):
+	# Opens the catalog (default TRIMDATA/catalog.sqlite), making it if needed, for queries query() can't express:
+	# with contextlib.closing(catalog.connect()) as db: db.execute('SELECT ...')
+	if path is None:
+		path = catalogPath()
+	os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+	# several scripts may update the catalog at once, so wait for a lock rather than failing straight away
+	db = sqlite3.connect(path,timeout=60)
+	with db:
+		for statement in _SCHEMA:
+			db.execute(statement)
+		# a catalog made before a column was added to RUNS gets it added, empty
+		columns = {row[1] for row in db.execute('PRAGMA table_info(runs)')}
+		for column, key, sqltype in RUNS:
+			if column not in columns:
+				db.execute('ALTER TABLE runs ADD COLUMN '+column+' '+sqltype)
+	return db
+
+def _write(func,*args):
+	# The catalog is a copy of what is on disk and can always be rebuilt, so failing to update it must never stop a simulation
+	try:
+		with contextlib.closing(connect()) as db, db:
+			func(db,*args)
+	except (OSError, sqlite3.Error) as err:
+		print('Catalog not updated:',err)
+
+def fingerprint(layers):
+	# short hash of a target as simulated: the name, width, density, phase and correction of each layer in order
+	simulated = [[layer['Name'],layer['Width'],layer.get('Layer Density',layer['Density']),layer['Gas'],layer['Corr']] for layer in layers]
+	return hashlib.sha1(json.dumps(simulated).encode()).hexdigest()[:12]
+
+def _atomicNumber(ion):
+	try:
+		return materials.database().Z(ion) or None
+	except OSError:
+		return None
+
+def _size(path):
+	try:
+		return os.path.getsize(path)
+	except OSError:
+		return None
+
+def _insertInputs(db,saveto,entries,written):
+	homedir = os.path.expanduser('~')
+	for fname, entry in entries.items():
+		layers = entry.get('Layers',[])
+		row = {
+			'saveto': saveto,
+			'file': fname,
+			'ion': entry.get('Ion'),
+			'z': _atomicNumber(entry['Ion']) if 'Ion' in entry else None,
+			'mass': entry.get('Mass'),
+			'energy': entry.get('Energy'),
+			'number': entry.get('Number'),
+			'profile': entry.get('Profile','full'),
+			'target': entry.get('Target'),
+			'fingerprint': fingerprint(layers),
+			'shard_of': entry.get('Shard Of'),
+			'status': 'written',
+			'written': written,
+			'input_size': _size(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'IN',fname))
+			}
+		# an input that is already catalogued has the same content (the name is its hash), so its status and times are kept
+		db.execute('INSERT OR IGNORE INTO runs ('+', '.join(row)+') VALUES ('+', '.join('?'*len(row))+')',list(row.values()))
+		db.executemany('INSERT OR IGNORE INTO layers VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+			[(saveto,fname,i+1,layer['Name'],layer['Width'],layer.get('Layer Density',layer['Density']),layer['Pressure'],int(layer['Gas']))
+			for i, layer in enumerate(layers)])
+
+def recordInputs(saveto,entries):
+	# adds input files to the catalog; entries are keyed by file name and laid out as in the index (see batch.getIndex)
+	_write(_insertInputs,saveto,entries,time.time())
+
+def _update(db,saveto,files,values):
+	db.executemany('UPDATE runs SET '+', '.join(column+' = ?' for column in values)+' WHERE saveto = ? AND file = ?',
+		[list(values.values())+[saveto,fname] for fname in files])
+
+def update(saveto,files,**values):
+	# sets columns of the runs table (e.g. status='done') for the given files of a simulation directory
+	_write(_update,saveto,list(files),values)
+
+def recordStart(saveto,fname):
+	update(saveto,[fname],status='running',started=time.time(),finished=None,runtime=None,error=None)
+
+def recordOutput(saveto,fname,path,runtime=None,status='done',ions=None):
+	update(saveto,[fname],status=status,finished=time.time(),runtime=runtime,output_size=_size(compression.resolve(path)),ions=ions,error=None)
+
+def recordFailure(saveto,fname,error):
+	update(saveto,[fname],status='failed',finished=time.time(),error=str(error))
+
+def recordAnalysis(saveto,fs):
+	update(saveto,fs,analysed=time.time())
+
+def query(saveto=None,ion=None,mass=None,energy=None,status=None,profile=None,fingerprint=None,layer=None,pressure=None,width=None,shards=False):
+	# Returns the catalogued runs matching every condition given, as a list of dictionaries keyed as in RUNS with the target's 'Layers'
+	# added (keyed as in LAYERS). layer, pressure (Torr) and width (Angstrom) select runs with a target layer of that name, pressure and
+	# width, e.g. every completed Rb run through 80 Torr CF4 is query(ion='Rb',status='done',layer='CF4',pressure=80). Shards are left
+	# out unless shards is True, since their outputs are merged into the file they are a shard of.
+	conditions = []
+	params = []
+	for column, value in [('saveto',saveto),('ion',ion),('mass',mass),('energy',energy),('status',status),('profile',profile),('fingerprint',fingerprint)]:
+		if value is not None:
+			conditions.append('runs.'+column+' = ?')
+			params.append(value)
+	if not shards:
+		conditions.append('runs.shard_of IS NULL')
+	if layer is not None or pressure is not None or width is not None:
+		match = []
+		for column, value in [('name',layer),('pressure',pressure),('width',width)]:
+			if value is not None:
+				match.append('layers.'+column+' = ?')
+				params.append(value)
+		conditions.append('EXISTS (SELECT 1 FROM layers WHERE layers.saveto = runs.saveto AND layers.file = runs.file AND '+' AND '.join(match)+')')
+	where = ' WHERE '+' AND '.join(conditions) if conditions else ''
+	with contextlib.closing(connect()) as db:
+		runs = [dict(zip([key for column, key, sqltype in RUNS],row)) for row in
+			db.execute('SELECT '+', '.join('runs.'+column for column, key, sqltype in RUNS)+' FROM runs'+where+' ORDER BY runs.saveto, runs.file',params)]
+		# the layers of all the runs found are fetched in one go rather than one query per run
+		layers = {}
+		for row in db.execute('SELECT '+', '.join('layers.'+column for column, key, sqltype in LAYERS)+' FROM layers JOIN runs ON '
+			'layers.saveto = runs.saveto AND layers.file = runs.file'+where+' ORDER BY layers.saveto, layers.file, layers.layer',params):
+			layers.setdefault((row[0],row[1]),[]).append(dict(zip([key for column, key, sqltype in LAYERS[2:]],row[2:])))
+	for run in runs:
+		run['Layers'] = layers.get((run['Saveto'],run['File']),[])
+	return runs
+
+def _sync(db,saveto,index):
+	homedir = os.path.expanduser('~')
+	indir = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'IN')
+	outdir = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT')
+	known = {row[0]: row[1] for row in db.execute('SELECT file, status FROM runs WHERE saveto = ?',[saveto])}
+	missing = {fname: entry for fname, entry in index.items() if fname not in known}
+	_insertInputs(db,saveto,missing,None)
+	for fname in missing:
+		if os.path.isfile(os.path.join(indir,fname)):
+			_update(db,saveto,[fname],{'written': os.path.getmtime(os.path.join(indir,fname))})
+	outfiles = set(compression.listOutputs(outdir)) if os.path.isdir(outdir) else set()
+	for fname in index:
+		if known.get(fname) not in ('done','stopped') and fname in outfiles:
+			path = compression.resolve(os.path.join(outdir,fname))
+			_update(db,saveto,[fname],{'status': 'done', 'finished': os.path.getmtime(path), 'output_size': os.path.getsize(path),
+				'ions': collisions.lastIon(path)})
+		elif known.get(fname) not in ('done','stopped') and index[fname].get('Shard Of') in outfiles:
+			# shards that were merged have done their job too
+			_update(db,saveto,[fname],{'status': 'done'})
+		elif known.get(fname) in ('done','stopped') and fname not in outfiles and index[fname].get('Shard Of') not in outfiles:
+			# the output has been deleted since
+			_update(db,saveto,[fname],{'status': 'written', 'output_size': None, 'ions': None})
+
+def sync(saveto=None):
+	# Brings the catalog entries of a simulation directory (or of every directory in TRIMDATA) up to date with its index and outputs, e.g.
+	# for directories simulated before the catalog existed, outputs copied in by hand or after the catalog has been deleted. What is
+	# already catalogued is kept; times and sizes of runs found this way come from the files, and how long they took isn't known.
+	# Returns the directories synced.
+	from . import batch
+	homedir = os.path.expanduser('~')
+	datadir = os.path.join(homedir,'TRIFIC','TRIMDATA')
+	if saveto is None:
+		saves = [d for d in sorted(os.listdir(datadir)) if os.path.isfile(os.path.join(datadir,d,'index.jsonl'))]
+	elif os.path.isdir(os.path.join(datadir,saveto)):
+		saves = [saveto]
+	else:
+		raise ValueError('Given directory not found')
+	with contextlib.closing(connect()) as db, db:
+		for save in saves:
+			_sync(db,save,batch.getIndex(save))
+	return saves
+
+def completed(saveto,fs):
+	# The files among fs (inputs or shards of simulation directory saveto) whose outputs are complete, so that they needn't be simulated
+	# again: catalogued as 'done' with as many ions as their inputs ask for, or as 'stopped' (cut short on purpose by a live analysis),
+	# with the output still on disk. Outputs missing from the catalog are added to it first (see sync), and runs catalogued before ion
+	# counts were kept have theirs counted from the output.
+	from . import batch
+	homedir = os.path.expanduser('~')
+	savetodir = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto)
+	fs = set(fs)
+	done = set()
+	with contextlib.closing(connect()) as db, db:
+		_sync(db,saveto,batch.getIndex(saveto))
+		for fname, status, number, ions, shard in db.execute('SELECT file, status, number, ions, shard_of FROM runs WHERE saveto = ?',[saveto]).fetchall():
+			if fname not in fs or status not in ('done','stopped'):
+				continue
+			path = compression.resolve(os.path.join(savetodir,'SHARDS' if shard else 'OUT',fname))
+			if not os.path.exists(path):
+				continue
+			if ions is None:
+				ions = collisions.lastIon(path)
+				_update(db,saveto,[fname],{'ions': ions})
+			if status == 'stopped' or ions == number:
+				done.add(fname)
+	return done
@@ -0,0 +1,387 @@
+import io
+import json
+import os
+import numpy as np
+from . import compression
+
+# Streaming reader for TRIM collision files (COLLISON.txt, saved by Sim to TRIMDATA/<saveto>/OUT).
+# This replaces the reading half of processSRIMData in TRIFICsim.cpp. Files are read in blocks of lines that NumPy parses a block at a time,
+# and the collisions are handed back in chunks of NumPy arrays, so memory use depends only on the chunk size and not on how many ions or
+# isotopes a file holds.
+# The much smaller EXYZ.txt files TRIM writes with the lean output profile (see Batch) are read by EXYZReader into the same chunks, and
+# reader() picks the right one for a file. Outputs saved compressed (see compression.py) are decompressed as they are read.
+#
+# A chunk is a dictionary of equal length arrays with one entry per collision:
+#	'isotope'	index into CollisionReader.isotopes of the isotope the ion belongs to
+#	'ion'		ion number within that isotope, as numbered by TRIM
+#	'energy'	ion energy at the collision (keV)
+#	'x'		collision depth (Angstrom)
+#	'z'		vertical position of the collision (Angstrom)
+# Collisions of one ion are never split between two chunks, so each chunk can be analysed on its own.
+
+COLUMNS = ('isotope','ion','energy','x','z')
+
+def _isotope():
+	return {'Name': '', 'Mass': 0.0, 'Energy': 0.0}
+
+def _numbers(text):
+	# Converts an (n x width) array of bytes holding one number per row into floats, by viewing each row as a string for NumPy to convert.
+	return np.ascontiguousarray(text).view('S%d' % text.shape[1]).ravel().astype(np.float64)
+
+class CollisionReader:
+	def __init__(self,paths,chunksize=262144):
+		# paths may be a single file or a list of files, which are read one after the other like the arguments to TRIFICsim.
+		# chunksize is the number of collisions after which a chunk is handed back (at the end of the ion being read).
+		if isinstance(paths,str):
+			paths = [paths]
+		self.paths = list(paths)
+		self.chunksize = chunksize
+		# isotope name, mass (amu) and initial energy (keV) taken from the file headers, in the order they are found
+		self.isotopes = []
+	def __iter__(self):
+		return self.chunks()
+	def chunks(self):
+		self.isotopes = []
+		buffered = []
+		nbuffered = 0
+		for path in self.paths:
+			with compression.openOutput(path) as f:
+				while True:
+					# blocks are read up to the end of a line, so that no line is split between two of them
+					block = f.read(1<<22)
+					if not block:
+						break
+					if not block.endswith(b'\n'):
+						block += f.readline()
+					chunk = self._parse(block,path)
+					if chunk is None:
+						continue
+					buffered.append(chunk)
+					nbuffered += len(chunk['ion'])
+					if nbuffered >= self.chunksize:
+						# hand back a chunk at the first ion to start once it holds chunksize collisions, and keep the rest (whose last ion may
+						# carry on in the next block) for later
+						chunk = {col: np.concatenate([c[col] for c in buffered]) for col in COLUMNS}
+						first = 0
+						for start in np.flatnonzero(ionStarts(chunk)):
+							if start-first >= self.chunksize:
+								yield {col: chunk[col][first:start] for col in COLUMNS}
+								first = start
+						buffered = [{col: chunk[col][first:] for col in COLUMNS}]
+						nbuffered = len(buffered[0]['ion'])
+		if nbuffered:
+			yield {col: np.concatenate([c[col] for c in buffered]) for col in COLUMNS}
+	def _parse(self,block,path):
+		# Parses a block of whole lines at once and returns its collisions as a chunk, or None if it has none.
+		# Collision lines begin with a column separator followed by the zero padded ion number, so they are picked out by testing the second
+		# byte of every line in one go. TRIM writes fixed width columns, so the lines sharing the same column layout (all of them, unless the
+		# ion numbers grow a digit part way through) are taken as the rows of a 2D array of bytes and each field converted by _numbers.
+		# The padding lets fixed offsets into a short last line be read without going past the end of the block.
+		padded = np.frombuffer(block+bytes(16),dtype=np.uint8)
+		ends = np.flatnonzero(padded[:len(block)] == 10)
+		if len(ends) == 0 or ends[-1] != len(block)-1:
+			ends = np.append(ends,len(block))
+		starts = np.concatenate([[0],ends[:-1]+1])
+		lengths = ends-starts
+		remaining = np.flatnonzero((lengths > 1) & (padded[starts+1]-48 < 10))
+		rows = []
+		values = []
+		while len(remaining):
+			# The layout of the first line left (the offsets of the separators before the ion number, energy, depth, lateral and vertical
+			# positions, and of the one after the vertical position) is found in Python and then checked against every other line at once.
+			line = block[starts[remaining[0]]:ends[remaining[0]]]
+			layout = [0]
+			while len(layout) < 6:
+				found = line.find(line[0:1],layout[-1]+1)
+				if found < 0:
+					break
+				layout.append(found)
+			if len(layout) < 6:
+				remaining = remaining[1:]
+				continue
+			begin = starts[remaining]
+			same = lengths[remaining] > layout[5]
+			for offset in layout:
+				same[same] &= padded[begin[same]+offset] == line[0]
+			these = remaining[same]
+			remaining = remaining[~same]
+			if min(np.diff(layout)) < 2:
+				continue
+			# the lines as rows of a 2D array, taken from a view of the block without building an index for every byte
+			text = np.lib.stride_tricks.sliding_window_view(padded,layout[5])[starts[these]]
+			ion = np.zeros(len(these),dtype=np.int64)
+			numbers = np.ones(len(these),dtype=bool)
+			for c in range(1,layout[1]):
+				digits = text[:,c]-48
+				numbers &= digits < 10
+				ion = ion*10+digits
+			if not numbers.all():
+				these = these[numbers]
+				text = text[numbers]
+				ion = ion[numbers]
+			if len(these) == 0:
+				continue
+			columns = [ion.astype(np.int32)]
+			try:
+				for field in (1,2,4):
+					columns.append(_numbers(text[:,layout[field]+1:layout[field+1]]))
+			except ValueError:
+				raise ValueError('Unexpected line in collision file '+path)
+			rows.append(these)
+			values.append(columns)
+		lines = np.concatenate(rows) if rows else np.zeros(0,dtype=np.int64)
+		order = np.argsort(lines,kind='stable')
+		lines = lines[order]
+		# isotope details are given in the header, with the same columns processSRIMData reads them from; there are only a few header lines,
+		# so they are read one by one
+		headers = np.flatnonzero((lengths >= 30) & (padded[starts+6] == ord('I')) & (padded[starts+7] == ord('o')) & (padded[starts+8] == ord('n')))
+		headers = headers[~np.isin(headers,lines)]
+		names = [i for i in headers if block[starts[i]+6:starts[i]+14] == b'Ion Name']
+		if not self.isotopes and len(lines) and (not names or lines[0] < names[0]):
+			self.isotopes.append(_isotope())
+		base = len(self.isotopes)-1
+		for i in headers:
+			line = block[starts[i]:ends[i]+1]
+			if line[6:14] == b'Ion Name':
+				self.isotopes.append(_isotope())
+				self.isotopes[-1]['Name'] = line[23:25].decode('latin-1').strip()
+			elif line[6:14] == b'Ion Mass' and self.isotopes:
+				self.isotopes[-1]['Mass'] = float(line[22:29])
+			elif line[6:16] == b'Ion Energy' and self.isotopes:
+				self.isotopes[-1]['Energy'] = float(line[18:29])
+		if len(lines) == 0:
+			return None
+		return {
+			'isotope':	(base+np.searchsorted(names,lines)).astype(np.int32),
+			'ion':		np.concatenate([v[0] for v in values])[order],
+			'energy':	np.concatenate([v[1] for v in values])[order],
+			'x':		np.concatenate([v[2] for v in values])[order],
+			'z':		np.concatenate([v[3] for v in values])[order]
+			}
+
+class EXYZReader:
+	def __init__(self,paths,chunksize=262144,isotopes=None):
+		# Reader for TRIM's special EXYZ.txt output, which gives the ion's energy and position every time it has lost a fixed amount of
+		# energy (the increment on the Diskfiles line of TRIM.IN). Chunks are in the same format as those of CollisionReader, with one entry
+		# per EXYZ step in place of one per collision, so they can be binned in exactly the same way.
+		# EXYZ files say nothing about the isotope, so its name, mass and energy are taken from isotopes (a list with one dictionary per
+		# path) or else from the input file with the same name in the IN directory next to the file (as saved by Sim).
+		if isinstance(paths,str):
+			paths = [paths]
+		self.paths = list(paths)
+		self.chunksize = chunksize
+		self.given = isotopes
+		self.isotopes = []
+	def __iter__(self):
+		return self.chunks()
+	def chunks(self):
+		self.isotopes = []
+		buffered = []
+		nbuffered = 0
+		for k, path in enumerate(self.paths):
+			if self.given is not None:
+				self.isotopes.append(dict(self.given[k]))
+			else:
+				self.isotopes.append(_savedIsotope(path))
+			with compression.openOutput(path) as f:
+				while True:
+					lines = f.readlines(1<<22)
+					if not lines:
+						break
+					# data lines are the only ones starting with a digit (the zero padded ion number); the columns are separated by spaces,
+					# so a whole block of lines can go through NumPy's (compiled) text parser in one call
+					data = [line for line in lines if line[:1].isdigit()]
+					if not data:
+						continue
+					try:
+						values = np.loadtxt(io.BytesIO(b''.join(data)),ndmin=2)
+					except ValueError:
+						raise ValueError('Unexpected line in EXYZ file '+path)
+					chunk = {
+						'isotope':	np.full(len(data),len(self.isotopes)-1,dtype=np.int32),
+						'ion':		values[:,0].astype(np.int32),
+						'energy':	values[:,1].astype(np.float64),
+						'x':		values[:,2].astype(np.float64),
+						'z':		values[:,4].astype(np.float64)
+						}
+					buffered.append(chunk)
+					nbuffered += len(data)
+					if nbuffered >= self.chunksize:
+						# hand back everything but the last ion, which may carry on in the next lines
+						chunk = {col: np.concatenate([c[col] for c in buffered]) for col in COLUMNS}
+						last = np.flatnonzero(ionStarts(chunk))[-1]
+						if last > 0:
+							yield {col: chunk[col][:last] for col in COLUMNS}
+							chunk = {col: chunk[col][last:] for col in COLUMNS}
+						buffered = [chunk]
+						nbuffered = len(chunk['ion'])
+		if nbuffered:
+			yield {col: np.concatenate([c[col] for c in buffered]) for col in COLUMNS}
+
+def inputIsotope(infile):
+	# name, mass and energy of the ion of a TRIM input file (TRIM.IN format), or blank details if the file can't be read
+	isotope = _isotope()
+	try:
+		with open(infile,newline='') as f:
+			lines = f.read().split('\r\n')
+		values = lines[2].split()
+		isotope['Mass'] = float(values[1])
+		isotope['Energy'] = float(values[2])
+		isotope['Name'] = lines[8].strip('"').split()[0]
+	except (OSError, IndexError, ValueError):
+		pass
+	return isotope
+
+def _savedIsotope(path):
+	# isotope details for an output saved by Sim, from its input file or, for the merged output of shards (which has no input file of its
+	# own), from the index of the simulation directory
+	savetodir = os.path.dirname(os.path.dirname(os.path.abspath(path)))
+	fname = compression.plainName(os.path.basename(path))
+	isotope = inputIsotope(os.path.join(savetodir,'IN',fname))
+	if isotope['Name'] == '' and os.path.exists(os.path.join(savetodir,'index.jsonl')):
+		with open(os.path.join(savetodir,'index.jsonl')) as f:
+			for line in f:
+				if fname in line:
+					entry = json.loads(line)
+					if entry.get('File') == fname:
+						isotope = {'Name': entry['Ion'], 'Mass': float(entry['Mass']), 'Energy': float(entry['Energy'])}
+	return isotope
+
+def fileFormat(path):
+	# 'EXYZ' for a TRIM EXYZ.txt file and 'COLLISON' for a collision file, told apart by the box drawing column separators of the latter
+	try:
+		with compression.openOutput(path) as f:
+			head = f.read(65536)
+	except OSError:
+		return 'COLLISON'
+	if head and b'\xb3' not in head:
+		return 'EXYZ'
+	return 'COLLISON'
+
+def reader(paths,chunksize=262144):
+	# returns the right reader for a file (or list of files of the same kind)
+	first = paths if isinstance(paths,str) else (list(paths)+[None])[0]
+	if first is not None and fileFormat(first) == 'EXYZ':
+		return EXYZReader(paths,chunksize=chunksize)
+	return CollisionReader(paths,chunksize=chunksize)
+
+def _chunk(isotopes,ions,energies,xs,zs):
+	return {
+		'isotope':	np.array(isotopes,dtype=np.int32),
+		'ion':		np.array(ions).astype(np.int32),
+		'energy':	np.array(energies).astype(np.float64),
+		'x':		np.array(xs).astype(np.float64),
+		'z':		np.array(zs).astype(np.float64)
+		}
+
+def ionStarts(chunk):
+	# returns a boolean array that is True for the first collision of every ion in a chunk
+	starts = np.ones(len(chunk['ion']),dtype=bool)
+	starts[1:] = (chunk['ion'][1:] != chunk['ion'][:-1]) | (chunk['isotope'][1:] != chunk['isotope'][:-1])
+	return starts
+
+def energyLoss(chunk):
+	# Energy lost by the ion at each collision (keV), taken as the drop in ion energy since its previous collision.
+	# The first collision of each ion has nothing to compare with and is given no loss.
+	loss = np.zeros(len(chunk['energy']))
+	loss[1:] = chunk['energy'][:-1]-chunk['energy'][1:]
+	loss[ionStarts(chunk)] = 0
+	return loss
+
+def readCollisions(paths):
+	# Reads whole files (collision or EXYZ) into a single chunk; convenient for small files, use CollisionReader for large ones.
+	source = reader(paths)
+	chunks = list(source)
+	if not chunks:
+		return {col: np.zeros(0,dtype=np.int32 if col in ('isotope','ion') else np.float64) for col in COLUMNS}, source.isotopes
+	return {col: np.concatenate([c[col] for c in chunks]) for col in COLUMNS}, source.isotopes
+
+def lastIon(path,tail=65536):
+	# Returns the ion number of the last collision written to a file, or 0 if there is none yet; only the end of a plain file is read,
+	# so this is cheap enough to call on a file TRIM is still writing.
+	try:
+		if compression.method(compression.resolve(path)) is None:
+			with open(compression.resolve(path),'rb') as f:
+				f.seek(0,2)
+				f.seek(max(f.tell()-tail,0))
+				lines = f.read().split(b'\n')
+		else:
+			# a compressed file can't be read from the end, so it is streamed through keeping only the last block
+			last = b''
+			with compression.openOutput(path) as f:
+				for block in iter(lambda: f.read(1<<20), b''):
+					last = last[-tail:]+block
+			lines = last[-tail:].split(b'\n')
+	except OSError:
+		return 0
+	# the last line may be incomplete
+	for line in reversed(lines[:-1]):
+		ion = _ionNumber(line)
+		if ion is not None:
+			return ion
+	return 0
+
+def _ionNumber(line):
+	# the ion number of a collision or EXYZ data line, or None for any other line
+	if line[:1].isdigit():
+		# EXYZ line
+		return int(line.split()[0])
+	if line[1:2].isdigit():
+		fields = line.split(line[0:1],6)
+		if len(fields) > 5 and fields[1].isdigit():
+			return int(fields[1])
+	return None
+
+def dropLastIon(path):
+	# Cuts a plain collision or EXYZ file that TRIM was stopped part way through back to its last complete ion, by removing everything
+	# from the first line of the last ion on (the last ion can't be told apart from one cut short). Returns the last ion left, or 0.
+	start = None
+	last = None
+	kept = 0
+	offset = 0
+	with open(path,'rb') as f:
+		for line in f:
+			ion = _ionNumber(line)
+			if ion is not None and ion != last:
+				start = offset
+				kept = last or 0
+				last = ion
+			offset += len(line)
+	if start is not None:
+		os.truncate(path,start)
+	return kept
+
+def mergeCollisions(paths,pasteto):
+	# Joins collision files from the shards of one simulation into a single file at pasteto, as if TRIM had simulated all of the ions in one go.
+	# The header is taken from the first file only, and ions are renumbered so that each file's ions follow on from the last ion of the previous one.
+	# Ion numbers keep TRIM's five digit field, which grows when there are more than 99999 ions.
+	# The merged file is compressed if pasteto ends in a compression suffix, and shards may be compressed or not.
+	# Returns the number of ions in the merged file.
+	offset = 0
+	compressed = compression.method(pasteto)
+	with (compression.FrameWriter(pasteto+'.partial',compressed) if compressed else open(pasteto+'.partial','wb')) as out:
+		for k, path in enumerate(paths):
+			inheader = True
+			last = 0
+			with compression.openOutput(path) as f:
+				for line in f:
+					if line[:1].isdigit():
+						# EXYZ lines give the ion number in seven digits, followed by spaces
+						fields = line.split(b' ',1)
+						inheader = False
+						last = int(fields[0])
+						out.write(b'%07d ' % (last+offset)+fields[1])
+						continue
+					if line[1:2].isdigit():
+						sep = line[0:1]
+						fields = line.split(sep,2)
+						if len(fields) > 2 and fields[1].isdigit():
+							inheader = False
+							last = int(fields[1])
+							out.write(sep+b'%05d' % (last+offset)+sep+fields[2])
+							continue
+					if k == 0 or inheader == False:
+						out.write(line)
+			offset += last
+	os.replace(pasteto+'.partial',pasteto)
+	return offset
@@ -1,11 +1,13 @@
 import os
 import re
 
-def compoundparse():
-	homedir = os.path.expanduser('~')
-	os.chdir(os.path.join(homedir,'.wine','drive_c','Program Files (x86)','SRIM-2013','Data'))
+def compoundparse(datadir=None):
+	# datadir defaults to the Data directory of the SRIM install in the wine C: drive
+	if datadir is None:
+		homedir = os.path.expanduser('~')
+		datadir = os.path.join(homedir,'.wine','drive_c','Program Files (x86)','SRIM-2013','Data')
 
-	f = open("Compound.dat","r",encoding='iso-8859-1')
+	f = open(os.path.join(datadir,"Compound.dat"),"r",encoding='iso-8859-1')
 	f.readline()
 	f.readline()
 	# initialize a dictionary, keys will be compound names
@@ -0,0 +1,118 @@
+import gzip
+import io
+import os
+
+# Compressed TRIM outputs. Collision files are fixed width text that compresses five to ten times, so Sim can save outputs compressed
+# (Sim(...,compress='gzip') or 'zstd') as it collects them, e.g. OUT/80Ga472800-36622e16109a.txt.gz. Everything else keeps using the
+# plain name (80Ga472800-36622e16109a.txt): resolve() finds whichever file is on disk, and openOutput() hands back a stream that is
+# decompressed as it is read, so outputs are never expanded on disk and a reader only ever holds a few MB of a file in memory.
+#
+# Compressed files are written as a series of independent gzip members (or zstd frames), one for every FRAME bytes of text. Any gzip or
+# zstd tool reads them as one file, files can be joined by simply concatenating them, and a damaged block only loses that block.
+# gzip needs nothing beyond Python itself; zstd reads and writes about three times faster at a similar size but needs the zstandard
+# package, which is only imported when a zstd file is used.
+
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+FRAME = 1<<22
+LEVELS = {'gzip': 6, 'zstd': 3}
+
+def _zstandard():
+	try:
+		import zstandard
+	except ImportError:
+		raise ImportError('the zstandard package is needed to read or write zstd compressed outputs (or use gzip)')
+	return zstandard
+
+def method(path):
+	# the compression of a file from its name, or None for a plain file
+	for name, suffix in SUFFIXES.items():
+		if path.endswith(suffix):
+			return name
+	return None
+
+def plainName(name):
+	# the name of an output without any compression suffix
+	compressed = method(name)
+	return name[:-len(SUFFIXES[compressed])] if compressed else name
+
+def resolve(path):
+	# The file on disk for the plain path of an output: the path itself if it exists, otherwise its compressed version. Paths that don't
+	# exist in any form are returned as they are.
+	if os.path.exists(path):
+		return path
+	for suffix in SUFFIXES.values():
+		if os.path.exists(path+suffix):
+			return path+suffix
+	return path
+
+def exists(path):
+	return os.path.exists(resolve(path))
+
+def remove(path,keep=None):
+	# removes every form of the output at plain path except keep
+	for candidate in [path]+[path+suffix for suffix in SUFFIXES.values()]:
+		if candidate != keep and os.path.exists(candidate):
+			os.remove(candidate)
+
+def listOutputs(directory):
+	# plain names of the outputs in a directory, however they are stored
+	return sorted({plainName(name) for name in os.listdir(directory) if not name.endswith('.partial')})
+
+def openOutput(path,buffering=1<<20):
+	# Opens an output (given by its plain path or its actual one) for reading in binary, decompressing as it is read
+	path = resolve(path)
+	compressed = method(path)
+	if compressed == 'gzip':
+		return io.BufferedReader(gzip.GzipFile(path,'rb'),buffer_size=buffering)
+	if compressed == 'zstd':
+		f = open(path,'rb')
+		return io.BufferedReader(_zstandard().ZstdDecompressor().stream_reader(f,read_across_frames=True,closefd=True),buffer_size=buffering)
+	return open(path,'rb',buffering=buffering)
+
+class FrameWriter:
+	# File-like object writing text compressed in independent frames of FRAME bytes (see above), for with statements
+	def __init__(self,path,compressed,level=None):
+		self.f = open(path,'wb')
+		self.compressed = compressed
+		self.level = LEVELS[compressed] if level is None else level
+		if compressed == 'zstd':
+			self.compressor = _zstandard().ZstdCompressor(level=self.level)
+		self.buffer = []
+		self.size = 0
+	def write(self,data):
+		self.buffer.append(data)
+		self.size += len(data)
+		if self.size >= FRAME:
+			self._frame()
+	def _frame(self):
+		data = b''.join(self.buffer)
+		if data:
+			self.f.write(gzip.compress(data,self.level) if self.compressed == 'gzip' else self.compressor.compress(data))
+		self.buffer = []
+		self.size = 0
+	def close(self):
+		self._frame()
+		self.f.close()
+	def __enter__(self):
+		return self
+	def __exit__(self,*args):
+		self.close()
+
+def openWriter(path):
+	# Opens a file for writing in binary, compressed if its name ends in a compression suffix
+	compressed = method(path)
+	if compressed is None:
+		return open(path,'wb')
+	return FrameWriter(path,compressed)
+
+def compressFile(source,dest,compressed,level=None):
+	# Compresses source to dest (which gets the suffix of the compression) and returns its path; dest is written under a temporary name
+	# and renamed into place when complete
+	if compressed not in SUFFIXES:
+		raise ValueError('Compression must be one of '+', '.join(SUFFIXES))
+	dest = plainName(dest)+SUFFIXES[compressed]
+	with open(source,'rb') as f, FrameWriter(dest+'.partial',compressed,level) as out:
+		for block in iter(lambda: f.read(FRAME), b''):
+			out.write(block)
+	os.replace(dest+'.partial',dest)
+	return dest
@@ -0,0 +1,149 @@
+import numpy as np
+from . import pid
+
+# Deterministic estimate of the energy an ion leaves in each TRIFIC collection region, for when the mean is all that is needed (e.g. beam
+# tuning) and a full TRIM run would take too long. Ions are slowed down along the beam axis through the target layers of a Batch object
+# with no straggling, scattering or recoils (the continuous slowing down approximation), so the result is the energy loss of a typical ion
+# rather than a distribution.
+#
+# Stopping powers are per target atom, in eV/(1e15 atoms/cm2) as in SRIM, and compounds are the atom fraction weighted sum of their
+# elements (Bragg's rule). The electronic part joins the Bethe formula, with an effective ion charge (Ziegler's fit for helium), to
+# velocity proportional (Lindhard-Scharff) stopping at low velocity; there are no shell or Barkas corrections. The nuclear part is the
+# ZBL universal stopping.
+#
+# How good this is, as checked when it was written:
+#	protons in water	stopping within 5% of NIST PSTAR from 80 keV to 100 MeV (10% low at 10 keV); ranges within 5% at 1-100 MeV
+#	alphas			5.5 MeV alphas go 40.9 mm in air against 41 mm; 10 MeV alphas in water stop 5% short of NIST ASTAR
+#	heavy ions		stopping in silicon within 2-7% of the LBNL 10 and 4.5 MeV/u cocktail LETs (Ar to Xe, from SRIM), except
+#				4.5 MeV/u Xe, which is 10% low
+# Nothing has been checked for heavy ions below about 1 MeV/u, where the effective charge and the join to low velocity stopping decide
+# the answer, i.e. the last part of the range of every ion that stops in TRIFIC. Expect errors of 20% or more there, so stopping depths
+# and the energy left in the last grids an ion reaches are the least reliable numbers given. Confirm with TRIM before relying on them.
+
+MEC2 = 0.51099895e6	# electron rest energy (eV)
+AMU = 931494.10242	# atomic mass unit (keV)
+K = 0.307075		# 4 pi N_A r_e^2 m_e c^2 (MeV cm2/mol)
+
+def _excitation(Z2):
+	# mean excitation energy (eV), from Bloch's rule with the usual correction for light elements
+	Z2 = np.asarray(Z2,dtype=float)
+	return np.where(Z2 < 13,12*Z2+7,9.76*Z2+58.8*Z2**-0.19)
+
+def _chargeFraction(Z1,beta2,energy,M1):
+	# Effective charge of the ion as a fraction of Z1: Ziegler's fit for helium, and for every other ion the fraction of its electrons
+	# moving slower than it does, 1-exp(-v/(v0 Z1^2/3)) with v0 the Bohr velocity
+	if Z1 == 2:
+		b = np.log(np.maximum(energy/M1,1))
+		return np.sqrt(1-np.exp(-np.minimum(0.7446+0.1429*b+0.01562*b**2-0.00267*b**3+1.325e-6*b**8,50)))
+	return 1-np.exp(-137.036*np.sqrt(beta2)*Z1**(-2/3))
+
+def _bethe(Z1,M1,Z2,energy):
+	# Bethe electronic stopping with the ion's effective charge, in eV/(1e15 atoms/cm2), and the ion's beta^2. The logarithm is taken of
+	# one plus its usual argument, which makes no difference at high velocity and keeps it positive at low velocity, where the
+	# Lindhard-Scharff stopping takes over.
+	gamma = 1+energy/(M1*AMU)
+	beta2 = 1-1/gamma**2
+	zeff = Z1*_chargeFraction(Z1,beta2,energy,M1)
+	log = np.maximum(np.log1p(2*MEC2*beta2*gamma**2/_excitation(Z2))-beta2,0)
+	# stopping in MeV cm2/g is K zeff^2 Z2/M2 log/beta^2, and M2/602.214 converts that to eV/(1e15 atoms/cm2)
+	return K*zeff**2*Z2/beta2*log/602.21408, beta2
+
+def _lindhard(Z1,M1,Z2,energy):
+	# Lindhard-Scharff electronic stopping in eV/(1e15 atoms/cm2): 8 pi e^2 a0 Z1^7/6 Z2/(Z1^2/3+Z2^2/3)^3/2 v/v0, with v/v0 = 0.2008 sqrt(keV/amu)
+	return 19.15*0.2008*Z1**(7/6)*Z2/(Z1**(2/3)+Z2**(2/3))**1.5*np.sqrt(energy/M1)
+
+def electronicStopping(Z1,M1,Z2,M2,energy):
+	# Electronic stopping of ion (Z1, M1 amu) in element (Z2, M2 amu) at energy keV (an array), in eV/(1e15 atoms/cm2). At high velocity
+	# this is the Bethe stopping and at low velocity the Lindhard-Scharff stopping, whichever is smaller, joined smoothly through the
+	# stopping maximum as (S_LS^-3 + S_Bethe^-3)^-1/3.
+	energy = np.maximum(np.asarray(energy,dtype=float),1e-9)
+	low = _lindhard(Z1,M1,Z2,energy)
+	high = np.maximum(_bethe(Z1,M1,Z2,energy)[0],1e-30)
+	return (low**-3+high**-3)**(-1/3)
+
+def nuclearStopping(Z1,M1,Z2,M2,energy):
+	# ZBL universal nuclear stopping, in eV/(1e15 atoms/cm2)
+	energy = np.asarray(energy,dtype=float)
+	screen = Z1**0.23+Z2**0.23
+	eps = 32.53*M2*energy/(Z1*Z2*(M1+M2)*screen)
+	reduced = np.where(eps <= 30,
+		np.log1p(1.1383*eps)/(2*(eps+0.01321*eps**0.21226+0.19593*np.sqrt(eps))),
+		np.log(np.maximum(eps,30))/(2*np.maximum(eps,30)))
+	return 8.462*Z1*Z2*M1*reduced/((M1+M2)*screen)
+
+def layerStopping(Z1,M1,layer,atoms,energy):
+	# Stopping (keV/Angstrom) of the ion in a layer resolved by Batch._resolveTarget(), i.e. with its 'Atom List' and 'Layer Density'
+	energy = np.asarray(energy,dtype=float)
+	stopping = np.zeros_like(energy)
+	weight = 0.0
+	for Z2, fraction in layer['Atom List']:
+		M2 = atoms[str(Z2)]['Natural Weight']
+		weight += fraction*M2
+		stopping += fraction*(electronicStopping(Z1,M1,Z2,M2,energy)+nuclearStopping(Z1,M1,Z2,M2,energy))
+	density = layer['Layer Density']*6.02214076e23/weight	# atoms/cm3
+	return stopping*1e-15*density*1e-11
+
+def _ranges(Z1,M1,layer,atoms,energy,points=400):
+	# range-energy table for a layer: energies (keV) and the distance (Angstrom) an ion of that energy goes before stopping
+	table = np.geomspace(1e-3,1.01*energy,points)
+	inverse = 1/layerStopping(Z1,M1,layer,atoms,table)
+	ranges = np.concatenate([[table[0]*inverse[0]],table[0]*inverse[0]+np.cumsum((inverse[1:]+inverse[:-1])/2*np.diff(table))])
+	return table, ranges
+
+def energies(Z1,M1,energy,layers,atoms,depths):
+	# Energy (keV) of the ion along the beam axis at each depth (Angstrom, from the front of the first layer, increasing), after entering the
+	# target with energy keV. layers is the list of resolved layers in order; an ion that has stopped has no energy left.
+	depths = np.asarray(depths,dtype=float)
+	result = np.zeros_like(depths)
+	front = 0.0
+	for layer in layers:
+		back = front+layer['Width']
+		if energy <= 0:
+			break
+		table, ranges = _ranges(Z1,M1,layer,atoms,energy)
+		remaining = np.interp(energy,table,ranges)
+		inside = (depths >= front) & (depths <= back) if layer is layers[-1] else (depths >= front) & (depths < back)
+		left = remaining-(depths[inside]-front)
+		result[inside] = np.where(left > 0,np.interp(left,ranges,table),0)
+		left = remaining-layer['Width']
+		energy = float(np.interp(left,ranges,table)) if left > 0 else 0.0
+		front = back
+	return result
+
+def regionLosses(Z1,M1,energy,layers,atoms,geometry=None):
+	# Energy (MeV) lost in every collection region (numbered as in pid.py) by one ion. On the beam axis the grid tilt shifts nothing, so
+	# regions 0 and Grids+1 are always empty.
+	geo = pid._geometry(geometry)
+	edges = (geo['Window To Wires']+geo['Spacing']*np.arange(geo['Grids']+1))*1e7
+	at = energies(Z1,M1,energy,layers,atoms,edges)
+	regions = np.zeros(geo['Grids']+2)
+	regions[1:-1] = (at[:-1]-at[1:])/1000
+	return regions
+
+def stoppingDepth(Z1,M1,energy,layers,atoms):
+	# depth (mm) at which the ion stops, or None if it goes through every layer
+	front = 0.0
+	for layer in layers:
+		table, ranges = _ranges(Z1,M1,layer,atoms,energy)
+		remaining = np.interp(energy,table,ranges)
+		if remaining <= layer['Width']:
+			return (front+remaining)*1e-7
+		energy = float(np.interp(remaining-layer['Width'],ranges,table))
+		front += layer['Width']
+	return None
+
+def estimate(ions,layers,materials,geometry=None,scheme=None):
+	# Mean energy losses for a list of (symbol, mass amu, energy keV) ions going through the resolved layers. Returns a dictionary laid out
+	# like pid.PIDData: the ions ('Ions'), the energy lost in each collection region ('regions', ions x Grids+2, MeV), the partition sums
+	# ('parts') and the depth each ion stops at ('Stopping Depth', mm, NaN for ions that get through the target).
+	regions = []
+	depths = []
+	for ion, mass, energy in ions:
+		Z1 = materials.Z(ion)
+		if Z1 == 0:
+			raise ValueError('Please enter a valid chemical symbol (H - U)')
+		regions.append(regionLosses(Z1,mass,energy,layers,materials.atoms,geometry))
+		depth = stoppingDepth(Z1,mass,energy,layers,materials.atoms)
+		depths.append(np.nan if depth is None else depth)
+	regions = np.array(regions).reshape(len(ions),pid._geometry(geometry)['Grids']+2)
+	return {'Ions': list(ions), 'regions': regions, 'parts': pid.partitionSums(regions,scheme), 'Stopping Depth': np.array(depths)}
@@ -0,0 +1,69 @@
+import hashlib
+import os
+import numpy as np
+from . import pid
+
+# Headless PID histograms, computed with NumPy in place of csv2h2 and ROOT. Nothing here opens a window or waits for the user, so plots
+# can be made in batch jobs on machines without a display. Histograms are returned as arrays and saved to compressed .npz files, and
+# optionally drawn to PNG files (this needs matplotlib, which is only imported when a PNG is asked for).
+
+def histogram2d(x,y,Xbins=50,Ybins=50,Xrange=0,Yrange=0):
+	# Fills a 2-D histogram the way csv2h2 does: Xbins (Ybins) bins from 0 to Xrange (Yrange) MeV along x (y). A range of 0 lets the
+	# histogram reach the largest value in the data. Returns the counts (Xbins x Ybins) and the bin edges along x and y.
+	if any(isinstance(arg,int) is False for arg in [Xbins,Ybins,Xrange,Yrange]) or Xbins <= 0 or Ybins <= 0:
+		raise ValueError('Histogram arguments (bins, ranges) must be integers')
+	xmax = Xrange if Xrange > 0 else max(float(np.max(x,initial=0)),1.0)
+	ymax = Yrange if Yrange > 0 else max(float(np.max(y,initial=0)),1.0)
+	counts, xedges, yedges = np.histogram2d(x,y,bins=[Xbins,Ybins],range=[[0,xmax],[0,ymax]])
+	return counts, xedges, yedges
+
+def PIDHist(saveto,fs,Xrange=0,Yrange=0,Xbins=50,Ybins=50,geometry=None,scheme=None,name=None,png=False):
+	# Makes a PID histogram for every pair of partitions (as PIDPlot does) and returns a dictionary keyed by the pair, e.g. '12', holding
+	# the counts and bin edges. Everything is also saved to TRIMDATA/<saveto>/PID/<name>.npz: counts<pair>, xedges<pair> and yedges<pair>
+	# for every pair, along with the partition sums ('parts') and isotope index ('isotope') of every ion. name defaults to the output file
+	# name for a single file, or to a hash of the file names for several. With png, each histogram is also drawn to <name>-<pair>.png.
+	data = pid.PIDData(saveto,fs,geometry,scheme)
+	parts = data['parts']
+	hists = {}
+	for i in range(parts.shape[1]):
+		for j in range(i+1,parts.shape[1]):
+			hists[str(i+1)+str(j+1)] = histogram2d(parts[:,i],parts[:,j],Xbins,Ybins,Xrange,Yrange)
+
+	if name is None:
+		if len(fs) == 1:
+			name = os.path.splitext(fs[0])[0]
+		else:
+			name = 'PID-'+hashlib.sha1('\n'.join(fs).encode()).hexdigest()[:12]
+	homedir = os.path.expanduser('~')
+	piddir = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'PID')
+	os.makedirs(piddir,exist_ok=True)
+	arrays = {'parts': parts, 'isotope': data['isotope']}
+	for pair, (counts, xedges, yedges) in hists.items():
+		arrays['counts'+pair] = counts
+		arrays['xedges'+pair] = xedges
+		arrays['yedges'+pair] = yedges
+	np.savez_compressed(os.path.join(piddir,name+'.npz'),**arrays)
+	if png:
+		for pair, hist in hists.items():
+			drawPNG(hist,pair,os.path.join(piddir,name+'-'+pair+'.png'))
+	return hists
+
+def drawPNG(hist,pair,path):
+	# Draws one histogram to a PNG file, titled like the csv2h2 canvases. Uses matplotlib's Agg canvas directly rather than pyplot, so no
+	# display is needed and the caller's own matplotlib setup is left alone.
+	try:
+		from matplotlib.figure import Figure
+		from matplotlib.backends.backend_agg import FigureCanvasAgg
+		from matplotlib.colors import LogNorm
+	except ImportError:
+		raise ImportError('matplotlib is needed to save PID plots as PNG files (the .npz files are always written)')
+	counts, xedges, yedges = hist
+	fig = Figure(figsize=(7,5))
+	FigureCanvasAgg(fig)
+	ax = fig.add_subplot(1,1,1)
+	mesh = ax.pcolormesh(xedges,yedges,np.ma.masked_equal(counts.T,0),norm=LogNorm(vmin=1,vmax=max(counts.max(),1)))
+	fig.colorbar(mesh,ax=ax)
+	ax.set_title('PID - Part {} v. Part {}'.format(pair[1],pair[0]))
+	ax.set_xlabel('DE - Grids Part {} (MeV)'.format(pair[0]))
+	ax.set_ylabel('DE - Grids Part {} (MeV)'.format(pair[1]))
+	fig.savefig(path)
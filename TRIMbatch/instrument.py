@@ -0,0 +1,179 @@
+import contextlib
+import json
+import os
+import resource
+import socket
+import sys
+import time
+
+# Opt-in timing and resource records for the batch -> simulation -> analysis pipeline, to find out where the time in a campaign goes.
+# Nothing is recorded unless instrumentation is switched on, either with enable() or by setting the TRIMBATCH_INSTRUMENT environment
+# variable to the file to write to (or to 1 for the default, TRIMDATA/instrument.jsonl). Every stage that finishes appends one JSON line:
+#	'Stage'		name of the stage, e.g. 'makeBatch', 'Sim', 'Sim.trim' or 'PIDPlot'
+#	'Start'		time the stage started (seconds since the epoch) and 'Wall' how long it took (s)
+#	'CPU'		CPU time (user+system, s) used by this process during the stage
+#	'Child CPU'	CPU time used by child processes (wine, TRIM, cp, ...) that finished during the stage
+#	'Max RSS'	peak resident memory of this process so far, and 'Child Max RSS' of the largest finished child (kB)
+#	'Read Bytes'	bytes this process read and wrote during the stage (from /proc/self/io, so only on Linux)
+#	'Write Bytes'
+#	'Outputs'	size in bytes of each file the stage produced, where it has any
+# along with the host, process id and whatever details the stage adds (file names, numbers of jobs, ...). Child CPU comes from the
+# kernel's totals for finished children, so when several TRIM jobs run at once a job's figure also holds that of jobs finishing
+# alongside it; the totals over a whole Sim stage are exact. summarize() adds the records up by stage.
+
+_path = None
+
+def defaultPath():
+	homedir = os.path.expanduser('~')
+	return os.path.join(homedir,'TRIFIC','TRIMDATA','instrument.jsonl')
+
+def enable(path=None):
+	# Starts recording to path (default TRIMDATA/instrument.jsonl); records are always appended, never overwritten
+	global _path
+	_path = path if path is not None else defaultPath()
+	return _path
+
+def disable():
+	global _path
+	_path = None
+
+def enabled():
+	return _path is not None
+
+def _fromEnvironment():
+	value = os.environ.get('TRIMBATCH_INSTRUMENT','')
+	if value and value != '0':
+		enable(None if value == '1' else value)
+
+def _io():
+	# bytes read and written by this process, counted at the system call (so cached reads are included)
+	counts = {}
+	try:
+		with open('/proc/self/io') as f:
+			for line in f:
+				key, value = line.split(':')
+				counts[key] = int(value)
+	except (OSError, ValueError):
+		return 0, 0
+	return counts.get('rchar',0), counts.get('wchar',0)
+
+def _usage():
+	own = resource.getrusage(resource.RUSAGE_SELF)
+	children = resource.getrusage(resource.RUSAGE_CHILDREN)
+	return own, children
+
+def _maxrss(usage):
+	# ru_maxrss is in kB on Linux but in bytes on macOS
+	return usage.ru_maxrss//1024 if sys.platform == 'darwin' else usage.ru_maxrss
+
+def outputs(paths):
+	# sizes of the given files, for a stage's 'Outputs' (missing files are left out; give compressed outputs by their actual names)
+	sizes = {}
+	for path in paths:
+		try:
+			sizes[os.path.basename(path)] = os.path.getsize(path)
+		except OSError:
+			pass
+	return sizes
+
+@contextlib.contextmanager
+def stage(name,**details):
+	# Records a stage of the pipeline: with instrument.stage('Sim.trim',File=f) as record: ...
+	# The yielded dictionary is written out with the record, so a stage can add details (e.g. record['Outputs']) as it goes. The record
+	# is written even if the stage raises, with the error in 'Error'. When instrumentation is off this does nothing but yield a dictionary.
+	record = dict(details)
+	if _path is None:
+		yield record
+		return
+	start = time.time()
+	wall = time.perf_counter()
+	own, children = _usage()
+	read, written = _io()
+	try:
+		yield record
+	except BaseException as err:
+		record['Error'] = repr(err)
+		raise
+	finally:
+		wall = time.perf_counter()-wall
+		ownafter, childrenafter = _usage()
+		readafter, writtenafter = _io()
+		record.update({
+			'Stage': name,
+			'Host': socket.gethostname(),
+			'Pid': os.getpid(),
+			'Start': start,
+			'Wall': round(wall,6),
+			'CPU': round(ownafter.ru_utime+ownafter.ru_stime-own.ru_utime-own.ru_stime,6),
+			'Child CPU': round(childrenafter.ru_utime+childrenafter.ru_stime-children.ru_utime-children.ru_stime,6),
+			'Max RSS': _maxrss(ownafter),
+			'Child Max RSS': _maxrss(childrenafter),
+			'Read Bytes': readafter-read,
+			'Write Bytes': writtenafter-written
+			})
+		_write(record)
+
+def _write(record):
+	try:
+		os.makedirs(os.path.dirname(os.path.abspath(_path)),exist_ok=True)
+		# a single write to a file opened for appending, so records from processes running side by side don't interleave
+		with open(_path,'a') as f:
+			f.write(json.dumps(record,sort_keys=True,default=str)+'\n')
+	except OSError:
+		# instrumentation must never stop a simulation
+		pass
+
+def read(path=None):
+	# returns the list of records in path (default: the file being recorded to, or TRIMDATA/instrument.jsonl)
+	if path is None:
+		path = _path if _path is not None else defaultPath()
+	records = []
+	with open(path) as f:
+		for line in f:
+			if line.strip():
+				records.append(json.loads(line))
+	return records
+
+def summarize(records=None,by='Stage'):
+	# Adds up records (a list, or a file as for read()) by stage, or by any other key given as by. For every group returns the number of
+	# records and errors, total, mean and longest wall time, total CPU and child CPU, largest peak memory, total bytes read and written,
+	# and the total number and size of output files.
+	if records is None or isinstance(records,str):
+		records = read(records)
+	summary = {}
+	for record in records:
+		group = summary.setdefault(str(record.get(by)),{
+			'Count': 0, 'Errors': 0, 'Wall': 0.0, 'Max Wall': 0.0, 'CPU': 0.0, 'Child CPU': 0.0, 'Max RSS': 0, 'Child Max RSS': 0,
+			'Read Bytes': 0, 'Write Bytes': 0, 'Outputs': 0, 'Output Bytes': 0
+			})
+		group['Count'] += 1
+		group['Errors'] += 'Error' in record
+		group['Wall'] += record['Wall']
+		group['Max Wall'] = max(group['Max Wall'],record['Wall'])
+		for key in ['CPU','Child CPU','Read Bytes','Write Bytes']:
+			group[key] += record[key]
+		for key in ['Max RSS','Child Max RSS']:
+			group[key] = max(group[key],record[key])
+		group['Outputs'] += len(record.get('Outputs',{}))
+		group['Output Bytes'] += sum(record.get('Outputs',{}).values())
+	for group in summary.values():
+		group['Mean Wall'] = group['Wall']/group['Count']
+	return summary
+
+def printSummary(summary):
+	print('{:<16} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12} {:>12} {:>12}'.format(
+		'Stage','Count','Wall (s)','Mean (s)','CPU (s)','Child (s)','RSS (MB)','Read (MB)','Written (MB)','Output (MB)'))
+	for name, group in sorted(summary.items(),key=lambda item: -item[1]['Wall']):
+		print('{:<16} {:>6} {:>10.2f} {:>10.3f} {:>10.2f} {:>10.2f} {:>10.1f} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+			name,group['Count'],group['Wall'],group['Mean Wall'],group['CPU'],group['Child CPU'],max(group['Max RSS'],group['Child Max RSS'])/1024,
+			group['Read Bytes']/1e6,group['Write Bytes']/1e6,group['Output Bytes']/1e6))
+
+def main(argv=None):
+	# python -m TRIMbatch.instrument [records file] prints the summary of a recording
+	argv = sys.argv[1:] if argv is None else argv
+	printSummary(summarize(argv[0] if argv else None))
+
+_fromEnvironment()
+
+if __name__ == '__main__':
+	main()
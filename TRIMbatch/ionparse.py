@@ -1,8 +1,10 @@
 import os
 
-def ionparse():
-	homedir = os.path.expanduser('~')
-	os.chdir(os.path.join(homedir,'.wine','drive_c','Program Files (x86)','SRIM-2013','Data'))
+def ionparse(datadir=None):
+	# datadir defaults to the Data directory of the SRIM install in the wine C: drive
+	if datadir is None:
+		homedir = os.path.expanduser('~')
+		datadir = os.path.join(homedir,'.wine','drive_c','Program Files (x86)','SRIM-2013','Data')
 
 	# copied binding energies (for calculating target damage) by hand
 	# I couldn't find them in all the TRIM text files :(
@@ -100,7 +102,7 @@ def ionparse():
 		[25,3,2],
 		[25,3,5.42]]
 
-	f = open("ATOMDATA","r")
+	f = open(os.path.join(datadir,"ATOMDATA"),"r")
 	f.readline()
 	f.readline()
 	# initialize a dictionary, keys will be atomic number
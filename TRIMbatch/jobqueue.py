@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from . import catalog
+from . import collisions
+from . import compression
+from . import instrument
+from . import runner
+
+# A job queue kept in a directory, so that one campaign can be simulated by any number of worker processes on any number of machines
+# that share the TRIFIC/TRIMDATA directory (over NFS, say), with no scheduler. Every job is a small JSON file naming an input file and its
+# simulation directory, and moves between four subdirectories of the queue (TRIMDATA/QUEUE by default) as it goes:
+#	pending		waiting for a worker; files are named after the time they were queued, so the oldest are taken first
+#	leased		claimed by a worker, which touches the file every heartbeat seconds while TRIM runs
+#	done		simulated, with the output saved to the OUT (or SHARDS) directory of its simulation directory
+#	failed		failed more times than it was allowed to be retried, with the last error
+# A worker claims a job by renaming it from pending to leased, which only one worker can ever do. A job whose lease hasn't been touched
+# for lease seconds belongs to a worker that died (or a machine that went down) and is put back in pending by the next worker to notice;
+# should the first worker still be alive, it finds its lease gone at the next heartbeat and stops its TRIM. Lease ages are measured
+# against the file server's clock rather than the worker's own, so machines whose clocks disagree don't steal each other's jobs.
+# The merge of a sharded file's outputs is held in the same way, by a file in the merging subdirectory that its worker touches while it
+# merges; should the worker die part way through, the next worker to notice does the merge again.
+#
+# Jobs are queued with enqueue() or Batch.enqueue(), and workers started with:
+#	python -m TRIMbatch.jobqueue work --slots 4
+# on every machine that should take part. python -m TRIMbatch.jobqueue status shows how far a campaign has got.
+
+STATES = ['pending','leased','done','failed']
+
+def queueDir(queue=None):
+	if queue is not None:
+		return queue
+	homedir = os.path.expanduser('~')
+	return os.path.join(homedir,'TRIFIC','TRIMDATA','QUEUE')
+
+def _makeDirs(queue):
+	for state in STATES+['merging']:
+		os.makedirs(os.path.join(queue,state),exist_ok=True)
+
+def _key(saveto,fname):
+	# the same input file is only ever queued once at a time, whatever the time it was queued
+	return hashlib.sha1((saveto+'/'+fname).encode()).hexdigest()[:16]
+
+def _readJob(path):
+	with open(path) as f:
+		return json.load(f)
+
+def _writeJob(path,job):
+	# written under a temporary name and renamed, so a job file is never seen half written
+	tmppath = path+'.'+socket.gethostname()+'.'+str(os.getpid())
+	with open(tmppath,'w') as f:
+		json.dump(job,f,sort_keys=True)
+	os.replace(tmppath,path)
+
+def _jobs(queue,state):
+	return sorted(name for name in os.listdir(os.path.join(queue,state)) if name.endswith('.json'))
+
+def _now(queue):
+	# the time on the machine holding the queue, from the modification time of a file touched there
+	clock = os.path.join(queue,'.clock')
+	with open(clock,'a'):
+		pass
+	os.utime(clock)
+	return os.path.getmtime(clock)
+
+def enqueue(saveto,fs,force=False,retries=0,queue=None,compress=None):
+	# Queues input files fs of simulation directory saveto to be simulated by the workers, as Sim would simulate them: files with a
+	# complete output already (see catalog.completed) are skipped unless force is True, and a sharded file (see Batch.makeBatch) is
+	# queued as its shards, which the worker finishing the last of them merges into the output. A job is tried retries more times after
+	# a failure or a lost worker, and its output is saved compressed with compress ('gzip' or 'zstd') by whichever worker runs it.
+	# Returns the number of jobs queued.
+	from . import batch
+	homedir = os.path.expanduser('~')
+	if saveto not in os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA')):
+		raise ValueError('Given directory not found')
+	if isinstance(retries,int) is False or retries < 0:
+		raise ValueError('Number of retries must be a non-negative integer')
+	if compress is not None and compress not in compression.SUFFIXES:
+		raise ValueError('Compression must be one of '+', '.join(compression.SUFFIXES))
+	queue = queueDir(queue)
+	_makeDirs(queue)
+	index = batch.getIndex(saveto)
+	infiles = set(os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'IN')))
+	queued = {name.split('-',1)[1] for state in ['pending','leased'] for name in _jobs(queue,state)}
+	done = set() if force else catalog.completed(saveto,list(fs)+[shard for f in fs for shard in index.get(f,{}).get('Shards',[])])
+	jobs = []
+	for f in fs:
+		if f in done:
+			print(f,'already simulated, skipping')
+		elif 'Shards' in index.get(f,{}):
+			os.makedirs(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'SHARDS'),exist_ok=True)
+			for shard in index[f]['Shards']:
+				if shard not in infiles:
+					print(shard,'not found in given directory')
+				elif shard not in done:
+					jobs.append({'Saveto': saveto, 'File': shard, 'Shard Of': f, 'Shards': index[f]['Shards']})
+		elif f not in infiles:
+			print(f,'not found in given directory')
+		else:
+			jobs.append({'Saveto': saveto, 'File': f})
+	count = 0
+	for job in jobs:
+		key = _key(saveto,job['File'])+'.json'
+		if key in queued:
+			print(job['File'],'already queued, skipping')
+			continue
+		job.update({'Attempts': 0, 'Retries': retries, 'Compression': compress, 'Queued': time.time()})
+		_writeJob(os.path.join(queue,'pending','{:.6f}-{}'.format(time.time(),key)),job)
+		queued.add(key)
+		count += 1
+	return count
+
+def reap(queue=None,lease=300):
+	# Puts jobs whose lease hasn't been touched for lease seconds back in pending, and returns their names
+	queue = queueDir(queue)
+	now = _now(queue)
+	reaped = []
+	for name in _jobs(queue,'leased'):
+		path = os.path.join(queue,'leased',name)
+		try:
+			if now-os.path.getmtime(path) > lease:
+				os.rename(path,os.path.join(queue,'pending',name))
+				reaped.append(name)
+		except FileNotFoundError:
+			# finished, or reaped by another worker, in the meantime
+			pass
+	return reaped
+
+def claim(queue=None):
+	# Takes the oldest pending job and returns its name and contents, or None if there are none left
+	queue = queueDir(queue)
+	for name in _jobs(queue,'pending'):
+		pending = os.path.join(queue,'pending',name)
+		leased = os.path.join(queue,'leased',name)
+		try:
+			# A rename keeps the modification time, so the job is touched before it is moved: a job that waited longer than the lease
+			# would otherwise look stale to reap() from the moment it is leased
+			os.utime(pending)
+			os.rename(pending,leased)
+		except FileNotFoundError:
+			# another worker got there first
+			continue
+		job = _readJob(leased)
+		if job['Attempts'] > job['Retries']:
+			# every attempt so far has lost its worker
+			job['Error'] = 'lease expired on every attempt'
+			_finish(queue,name,job,'failed')
+			catalog.recordFailure(job['Saveto'],job['File'],job['Error'])
+			continue
+		job.update({'Attempts': job['Attempts']+1, 'Host': socket.gethostname(), 'Pid': os.getpid(), 'Leased': time.time()})
+		_writeJob(leased,job)
+		return name, job
+	return None
+
+def _finish(queue,name,job,state):
+	job['Finished'] = time.time()
+	_move(queue,name,job,state)
+
+def _move(queue,name,job,state):
+	# moves a leased job on to state, and then saves what has happened to it there
+	try:
+		os.rename(os.path.join(queue,'leased',name),os.path.join(queue,state,name))
+	except FileNotFoundError:
+		# the lease was reaped while the job was finishing; it is pending again and will be run once more
+		return
+	_writeJob(os.path.join(queue,state,name),job)
+
+def _release(queue,name,job,error,retry=True):
+	# a failed job goes back in pending if it has retries left (and retry is set), and to failed if not
+	job['Error'] = str(error)
+	if not retry or job['Attempts'] > job['Retries']:
+		_finish(queue,name,job,'failed')
+		catalog.recordFailure(job['Saveto'],job['File'],error)
+		return
+	_move(queue,name,job,'pending')
+
+def _lock(queue,path,owner,lease):
+	# Creates the lock file path holding owner, and returns whether it was created. A lock that hasn't been touched for lease seconds
+	# (by the file server's clock) belongs to a worker that died holding it, and is broken: it is first renamed to a name of this
+	# worker's own, which only one worker can do, so no two workers ever break the same lock and both take it.
+	for attempt in range(2):
+		try:
+			fd = os.open(path,os.O_CREAT|os.O_EXCL|os.O_WRONLY)
+		except FileExistsError:
+			try:
+				if attempt > 0 or _now(queue)-os.path.getmtime(path) <= lease:
+					return False
+				broken = path+'.'+socket.gethostname()+'.'+str(os.getpid())
+				os.rename(path,broken)
+				os.remove(broken)
+			except FileNotFoundError:
+				# released (or broken by another worker) in the meantime
+				pass
+			continue
+		with os.fdopen(fd,'w') as lockfile:
+			json.dump(owner,lockfile,sort_keys=True)
+		return True
+	return False
+
+def _merge(queue,saveto,f,shards,compress=None,lease=300,heartbeat=30,retry=False):
+	# Merges the outputs of a sharded file once all of them are in. Several workers may finish shards at once, so the merge is done by
+	# whichever of them takes the lock (QUEUE/merging/<key>.json) first. The lock is touched every heartbeat seconds until the merge is
+	# done, and says what is being merged, so that a merge whose worker died can be done again (with retry, see staleMerges).
+	homedir = os.path.expanduser('~')
+	outputs = [compression.resolve(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'SHARDS',shard)) for shard in shards]
+	lock = os.path.join(queue,'merging',_key(saveto,f)+'.json')
+	owner = {'Saveto': saveto, 'File': f, 'Shards': shards, 'Compression': compress, 'Host': socket.gethostname(), 'Pid': os.getpid()}
+	if not all(os.path.exists(output) for output in outputs):
+		if retry and _lock(queue,lock,owner,lease):
+			# the worker that died had merged the outputs already, and only its lock was left
+			os.remove(lock)
+		return
+	if not _lock(queue,lock,owner,lease):
+		return
+	done = threading.Event()
+
+	def touch():
+		while not done.wait(heartbeat):
+			try:
+				os.utime(lock)
+			except FileNotFoundError:
+				return
+
+	toucher = threading.Thread(target=touch,daemon=True)
+	toucher.start()
+	try:
+		if all(os.path.exists(output) for output in outputs):
+			pasteto = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT',f)
+			saved = pasteto+compression.SUFFIXES[compress] if compress is not None else pasteto
+			with instrument.stage('Sim.merge',Saveto=saveto,File=f,Shards=len(shards)) as merge:
+				ions = collisions.mergeCollisions(outputs,saved)
+				merge['Outputs'] = instrument.outputs([saved])
+			compression.remove(pasteto,keep=saved)
+			for output in outputs:
+				os.remove(output)
+			catalog.recordOutput(saveto,f,saved,ions=ions)
+	finally:
+		done.set()
+		toucher.join()
+		try:
+			os.remove(lock)
+		except FileNotFoundError:
+			pass
+
+def staleMerges(queue=None,lease=300):
+	# The merges whose lock hasn't been touched for lease seconds, i.e. whose worker died part way through, as the lock contents
+	queue = queueDir(queue)
+	now = _now(queue)
+	stale = []
+	for name in _jobs(queue,'merging'):
+		path = os.path.join(queue,'merging',name)
+		try:
+			if now-os.path.getmtime(path) > lease:
+				stale.append(_readJob(path))
+		except (FileNotFoundError, ValueError):
+			# released in the meantime, or so new that its owner is still writing it
+			pass
+	return stale
+
+def _install(n):
+	# Takes scratch SRIM install n (see runner.py) for this process if no other process on the machine has it, and returns the lock
+	# holding it or None. The lock goes with the process, so the install is free again as soon as a worker exits, however it exits.
+	os.makedirs(os.path.dirname(runner.workerDir(n)),exist_ok=True)
+	f = open(runner.workerDir(n)+'.lock','w')
+	try:
+		fcntl.flock(f,fcntl.LOCK_EX|fcntl.LOCK_NB)
+	except OSError:
+		f.close()
+		return None
+	return f
+
+async def _run(queue,name,job,wdir,timeout,lease,heartbeat,progress,env):
+	homedir = os.path.expanduser('~')
+	saveto, fname = job['Saveto'], job['File']
+	tocopy = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'IN',fname)
+	pasteto = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'SHARDS' if 'Shard Of' in job else 'OUT',fname)
+	leased = os.path.join(queue,'leased',name)
+	catalog.recordStart(saveto,fname)
+	start = time.monotonic()
+	trim = asyncio.ensure_future(runner.runTRIM(wdir,tocopy,pasteto,timeout=timeout,progress=progress,env=env,compress=job.get('Compression')))
+	lost = False
+	while not trim.done():
+		await asyncio.wait([trim],timeout=heartbeat)
+		if not trim.done():
+			try:
+				os.utime(leased)
+			except FileNotFoundError:
+				# the job was reaped, so another worker may be running it already
+				trim.cancel()
+				lost = True
+	try:
+		ions = await trim
+	except asyncio.CancelledError:
+		if not lost:
+			raise
+		print(fname,'lost its lease, abandoned')
+		return
+	except (RuntimeError, TimeoutError, ValueError) as err:
+		print(fname,'failed:',err)
+		# a problem with the input itself (ValueError) would only happen again, so such jobs aren't retried
+		_release(queue,name,job,err,retry=not isinstance(err,ValueError))
+		return
+	catalog.recordOutput(saveto,fname,pasteto,time.monotonic()-start,ions=ions)
+	_finish(queue,name,job,'done')
+	if 'Shard Of' in job:
+		# merged in a thread, so that the event loop carries on touching the leases of the other slots' jobs
+		await asyncio.get_running_loop().run_in_executor(None,_merge,queue,saveto,job['Shard Of'],job['Shards'],job.get('Compression'),lease,heartbeat)
+
+async def work(queue=None,slots=1,lease=300,heartbeat=None,timeout=None,idle=None,poll=10,progress=runner.printProgress,persistent=False):
+	# Runs jobs from the queue until there are none left for idle seconds (or for ever if idle is None), with up to slots TRIM processes
+	# at once, each in its own scratch install. Scratch installs are shared out between worker processes on the same machine, so several
+	# workers may be started side by side. heartbeat (default a tenth of lease) is how often a running job's lease is touched, and poll
+	# how often to look for new jobs when there are none.
+	queue = queueDir(queue)
+	_makeDirs(queue)
+	if heartbeat is None:
+		heartbeat = lease/10
+	if heartbeat >= lease:
+		raise ValueError('Heartbeat must be shorter than the lease')
+	env = None
+	if persistent:
+		runner.startWineserver(max(30,poll))
+		env = dict(os.environ,WINEDEBUG='-all')
+	locks = []
+	n = 0
+	while len(locks) < slots:
+		lock = _install(n)
+		if lock is not None:
+			locks.append((n,lock))
+		n += 1
+	installs = [runner.prepareWorker(n) for n, lock in locks]
+	last = [time.monotonic()]
+
+	async def slot(wdir):
+		while True:
+			reap(queue,lease)
+			for merge in staleMerges(queue,lease):
+				print(merge['File'],'was being merged by a worker that has gone, merging again')
+				await asyncio.get_running_loop().run_in_executor(None,_merge,queue,merge['Saveto'],merge['File'],merge['Shards'],
+					merge.get('Compression'),lease,heartbeat,True)
+			claimed = claim(queue)
+			if claimed is None:
+				if idle is not None and time.monotonic()-last[0] > idle:
+					return
+				await asyncio.sleep(poll)
+				continue
+			name, job = claimed
+			with instrument.stage('Queue.job',Saveto=job['Saveto'],File=job['File'],Attempt=job['Attempts']):
+				await _run(queue,name,job,wdir,timeout,lease,heartbeat,progress,env)
+			last[0] = time.monotonic()
+
+	try:
+		await asyncio.gather(*[slot(wdir) for wdir in installs])
+	finally:
+		for n, lock in locks:
+			lock.close()
+
+def status(queue=None):
+	# the jobs in each state of the queue, as lists of their contents
+	queue = queueDir(queue)
+	_makeDirs(queue)
+	jobs = {}
+	for state in STATES:
+		jobs[state] = []
+		for name in _jobs(queue,state):
+			try:
+				jobs[state].append(dict(_readJob(os.path.join(queue,state,name)),Job=name))
+			except FileNotFoundError:
+				pass
+	return jobs
+
+def printStatus(jobs):
+	print('  '.join('{}: {}'.format(state,len(jobs[state])) for state in STATES))
+	for job in jobs['leased']:
+		print('leased  ',job['Saveto'],job['File'],'on',job.get('Host'),'pid',job.get('Pid'),'attempt',job['Attempts'])
+	for job in jobs['failed']:
+		print('failed  ',job['Saveto'],job['File'],job.get('Error'))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Shared-filesystem job queue for TRIM simulations')
+	parser.add_argument('--queue',default=None,help='queue directory (default TRIMDATA/QUEUE)')
+	commands = parser.add_subparsers(dest='command')
+	worker = commands.add_parser('work',help='run jobs from the queue')
+	worker.add_argument('--slots',type=int,default=1,help='TRIM processes to run at once')
+	worker.add_argument('--lease',type=float,default=300,help='seconds without a heartbeat before a job is given to another worker')
+	worker.add_argument('--heartbeat',type=float,default=None,help='seconds between heartbeats (default lease/10)')
+	worker.add_argument('--timeout',type=float,default=None,help='longest a single simulation may take (s)')
+	worker.add_argument('--idle',type=float,default=None,help='exit after this many seconds without a job (default never)')
+	worker.add_argument('--poll',type=float,default=10,help='seconds between looks for new jobs')
+	worker.add_argument('--persistent',action='store_true',help='keep one wineserver up for all jobs')
+	worker.add_argument('--quiet',action='store_true',help="don't print progress")
+	commands.add_parser('status',help='show the jobs in the queue')
+	reaper = commands.add_parser('reap',help='put jobs of dead workers back in the queue')
+	reaper.add_argument('--lease',type=float,default=300)
+	args = parser.parse_args(argv)
+	if args.command == 'work':
+		if args.slots < 1:
+			raise ValueError('Number of slots must be a positive integer')
+		asyncio.run(work(args.queue,args.slots,args.lease,args.heartbeat,args.timeout,args.idle,args.poll,
+			None if args.quiet else runner.printProgress,args.persistent))
+	elif args.command == 'reap':
+		for name in reap(args.queue,args.lease):
+			print('requeued',name)
+	else:
+		printStatus(status(args.queue))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,300 @@
+import itertools
+import os
+import threading
+import numpy as np
+from . import collisions
+from . import pid
+from . import scan
+
+# Live PID analysis of simulations that are still running. Sim(...,live=LiveAnalysis(...)) has every job's output followed while TRIM
+# writes it: every few seconds the lines added since the last look are read, each ion that has been completed is binned into the
+# collection regions and summed into partitions as pid.py does for finished outputs, and only running sums and histograms are kept, so
+# the centroids, widths and separation of every isotope are known a few seconds behind TRIM and cost nothing to ask for at any time.
+#
+# With a target, jobs are stopped as soon as the statistics are good enough rather than when they reach the number of ions they asked
+# for. separation is the worst separation (see scan.py) wanted between any two of the isotopes being simulated: once every isotope has at
+# least minions ions and every pair is this far apart, all of the jobs are stopped. uncertainty (MeV) is the standard error wanted on the
+# centroid of an isotope in every partition: a job is stopped once its isotope has at least minions ions and is known that well. Either
+# target, when given, is enough to stop a job. Separation can only stop jobs once every isotope has started, so it saves the most when
+# there are as many workers as isotopes. Stopped outputs are cut back to their last complete ion and saved as usual (see runner.runTRIM).
+# A job that is tried again (see Sim's retries) first has everything its earlier attempt added taken back out, so no ion counts twice.
+#
+# runner.runTRIM reads and bins each job's output in a worker thread so that its event loop is never held up by a large read, and
+# the jobs of several workers may be followed at the same moment, so monitor, summary and histograms take turns through a lock.
+
+class _Tail:
+	# Follows a file that is being written, handing back the lines completed since the last read
+	def __init__(self,path):
+		self.path = path
+		self.offset = 0
+		self.rest = b''
+	def read(self):
+		try:
+			with open(self.path,'rb') as f:
+				f.seek(self.offset)
+				data = f.read()
+		except OSError:
+			# TRIM hasn't made the file yet
+			return []
+		self.offset += len(data)
+		lines = (self.rest+data).split(b'\n')
+		self.rest = lines.pop()
+		return lines
+	def rewound(self):
+		# whether the file is shorter than what has been read of it, i.e. it has been started again
+		try:
+			return os.path.getsize(self.path) < self.offset
+		except OSError:
+			return self.offset > 0
+	def flush(self):
+		lines = self.read()
+		if self.rest:
+			lines.append(self.rest)
+			self.rest = b''
+		return lines
+
+def _parse(lines):
+	# ion numbers, energies and positions of the collision (or EXYZ) lines among lines, in the columns CollisionReader reads them from
+	ions = []
+	energies = []
+	xs = []
+	zs = []
+	for line in lines:
+		if line[:1].isdigit():
+			fields = line.split()
+			if len(fields) > 4:
+				ions.append(fields[0])
+				energies.append(fields[1])
+				xs.append(fields[2])
+				zs.append(fields[4])
+		elif line[1:2].isdigit():
+			fields = line.split(line[0:1],6)
+			if len(fields) > 5 and fields[1].isdigit():
+				ions.append(fields[1])
+				energies.append(fields[2])
+				xs.append(fields[3])
+				zs.append(fields[5])
+	return collisions._chunk([0]*len(ions),ions,energies,xs,zs)
+
+class LiveAnalysis:
+	def __init__(self,geometry=None,scheme=None,separation=None,uncertainty=None,minions=20,Xrange=0,Yrange=0,Xbins=50,Ybins=50,poll=2,verbose=True):
+		# geometry and scheme are as for PIDData. separation, uncertainty (MeV) and minions set when jobs are stopped (see above); with
+		# neither target the jobs run to the end and are only followed. Histograms have Xbins (Ybins) bins from 0 to Xrange (Yrange) MeV
+		# as in hist.histogram2d, except that a range of 0 is taken as the energy of the most energetic beam, since the bins of a histogram
+		# that is filled as ions come in can't be changed later. Outputs are read every poll seconds. With verbose, a line is printed
+		# whenever a target is met.
+		if separation is not None and separation <= 0:
+			raise ValueError('Separation target must be a positive number')
+		if uncertainty is not None and uncertainty <= 0:
+			raise ValueError('Uncertainty target must be a positive number of MeV')
+		if isinstance(minions,int) is False or minions < 2:
+			raise ValueError('Minimum number of ions must be an integer of at least 2')
+		if any(isinstance(arg,int) is False for arg in [Xbins,Ybins,Xrange,Yrange]) or Xbins <= 0 or Ybins <= 0:
+			raise ValueError('Histogram arguments (bins, ranges) must be integers')
+		if poll <= 0:
+			raise ValueError('Poll interval must be a positive number of seconds')
+		self.geometry = geometry
+		self.scheme = pid.SCHEME if scheme is None else scheme
+		self.separation = separation
+		self.uncertainty = uncertainty
+		self.minions = minions
+		self.Xrange = Xrange
+		self.Yrange = Yrange
+		self.Xbins = Xbins
+		self.Ybins = Ybins
+		self.poll = poll
+		self.verbose = verbose
+		self.labels = []
+		self.energies = []
+		self.jobs = {}
+		nparts = len(self.scheme)
+		self.count = np.zeros(0)
+		self.total = np.zeros((0,nparts))
+		self.products = np.zeros((0,nparts,nparts))
+		self.pairs = [(i,j) for i in range(nparts) for j in range(i+1,nparts)]
+		self.counts = {}
+		self.edges = None
+		self.met = False
+		self.stopped = set()
+		self.lock = threading.Lock()
+
+	def expect(self,infiles):
+		# Lists the isotopes of input files that are about to be simulated, so that a separation target waits for all of them
+		for infile in infiles:
+			self._job(infile)
+
+	def _label(self,infile):
+		isotope = collisions.inputIsotope(infile)
+		label = scan._label(isotope) if isotope['Name'] else infile
+		if label not in self.labels:
+			self.labels.append(label)
+			self.energies.append(isotope['Energy'] or 0)
+			nparts = len(self.scheme)
+			self.count = np.concatenate([self.count,np.zeros(1)])
+			self.total = np.concatenate([self.total,np.zeros((1,nparts))])
+			self.products = np.concatenate([self.products,np.zeros((1,nparts,nparts))])
+			for pair in self.counts:
+				self.counts[pair] = np.concatenate([self.counts[pair],np.zeros((1,self.Xbins,self.Ybins))])
+		return self.labels.index(label)
+
+	def _job(self,infile):
+		if infile not in self.jobs:
+			nparts = len(self.scheme)
+			# what the job has added to the sums of its isotope is kept as well, so it can be taken out again if the job starts over
+			self.jobs[infile] = {'Isotope': self._label(infile), 'Tail': None, 'Pending': None,
+				'Count': 0, 'Total': np.zeros(nparts), 'Products': np.zeros((nparts,nparts)), 'Counts': {}}
+		return self.jobs[infile]
+
+	def restart(self,infile,output=None):
+		# Forgets the ions a job has added so far, for a job that is about to be (or has been) started again, and follows output afresh
+		job = self._job(infile)
+		k = job['Isotope']
+		if job['Count']:
+			# targets met with the ions being taken out are checked again
+			self.stopped.discard(k)
+			self.met = False
+		self.count[k] -= job['Count']
+		self.total[k] -= job['Total']
+		self.products[k] -= job['Products']
+		for pair, counts in job['Counts'].items():
+			self.counts[pair][k] -= counts
+		job['Count'] = 0
+		job['Total'] = np.zeros_like(job['Total'])
+		job['Products'] = np.zeros_like(job['Products'])
+		job['Counts'] = {}
+		job['Tail'] = _Tail(output) if output is not None else None
+		job['Pending'] = None
+
+	def _histogramEdges(self):
+		# fixed once the first ions come in, from the ranges given or the most energetic beam (keV to MeV)
+		beam = max(max(self.energies,default=0)/1000,1.0)
+		xmax = self.Xrange if self.Xrange > 0 else beam
+		ymax = self.Yrange if self.Yrange > 0 else beam
+		return np.linspace(0,xmax,self.Xbins+1), np.linspace(0,ymax,self.Ybins+1)
+
+	def add(self,job,chunk):
+		# Adds the ions of a chunk (each of them complete) to the running sums of the job's isotope
+		if len(chunk['ion']) == 0:
+			return
+		k = job['Isotope']
+		starts, regions = pid.binCollisions(chunk,self.geometry)
+		parts = pid.partitionSums(regions,self.scheme)
+		total = parts.sum(axis=0)
+		products = parts.T @ parts
+		self.count[k] += len(parts)
+		self.total[k] += total
+		self.products[k] += products
+		job['Count'] += len(parts)
+		job['Total'] += total
+		job['Products'] += products
+		if self.edges is None:
+			self.edges = self._histogramEdges()
+			self.counts = {str(i+1)+str(j+1): np.zeros((len(self.labels),self.Xbins,self.Ybins)) for i, j in self.pairs}
+		xedges, yedges = self.edges
+		for i, j in self.pairs:
+			pair = str(i+1)+str(j+1)
+			counts = np.histogram2d(parts[:,i],parts[:,j],bins=[xedges,yedges])[0]
+			self.counts[pair][k] += counts
+			job['Counts'][pair] = job['Counts'].get(pair,0)+counts
+
+	def update(self,infile,output,final=False):
+		# Reads what TRIM has added to output since the last update and adds the ions it completes; with final, TRIM has finished and
+		# the last ion is complete too
+		job = self._job(infile)
+		if job['Tail'] is None or job['Tail'].path != output or job['Tail'].rewound():
+			# a job followed for the first time, or one that has been started again in a different install or the same one
+			self.restart(infile,output)
+		chunk = _parse(job['Tail'].flush() if final else job['Tail'].read())
+		if job['Pending'] is not None:
+			chunk = {col: np.concatenate([job['Pending'][col],chunk[col]]) for col in collisions.COLUMNS}
+		if len(chunk['ion']) == 0:
+			return
+		if final:
+			job['Pending'] = None
+			self.add(job,chunk)
+			return
+		# the last ion may still be going, so it waits for the next update
+		last = np.flatnonzero(collisions.ionStarts(chunk))[-1]
+		job['Pending'] = {col: chunk[col][last:] for col in collisions.COLUMNS}
+		self.add(job,{col: chunk[col][:last] for col in collisions.COLUMNS})
+
+	def monitor(self,infile,output,state):
+		# Called by runner.runTRIM as a job starts, while it runs and when it has finished; returns True when the job should be stopped.
+		# Every start is a fresh attempt at the job, so anything an earlier attempt added is taken out again.
+		with self.lock:
+			return self._monitor(infile,output,state)
+
+	def _monitor(self,infile,output,state):
+		if state == 'started':
+			self.restart(infile,output)
+			return False
+		self.update(infile,output,state == 'done')
+		if state == 'done':
+			return False
+		return self.done(self.jobs[infile]['Isotope'])
+
+	def _uncertainty(self):
+		n = np.maximum(self.count,1)[:,None]
+		means = self.total/n
+		variances = np.maximum(np.diagonal(self.products,axis1=1,axis2=2)/n-means**2,0)
+		return means, np.sqrt(variances), np.sqrt(variances/n)
+
+	def done(self,k):
+		# whether the jobs of isotope k have met a target
+		if self.met or k in self.stopped:
+			return True
+		if self.count[k] < self.minions:
+			return False
+		if self.uncertainty is not None:
+			means, widths, errors = self._uncertainty()
+			if errors[k].max() <= self.uncertainty:
+				self.stopped.add(k)
+				if self.verbose:
+					print('{}: centroids known to {:.3g} MeV after {:.0f} ions, stopping'.format(self.labels[k],errors[k].max(),self.count[k]))
+				return True
+		if self.separation is not None and len(self.labels) > 1 and self.count.min() >= self.minions:
+			worst = self.worst()
+			if worst >= self.separation:
+				self.met = True
+				if self.verbose:
+					print('Worst separation {:.3g} after {:.0f} ions, stopping'.format(worst,self.count.sum()))
+				return True
+		return False
+
+	def worst(self):
+		sep = scan.separation(self.count,self.total,self.products)
+		return min((float(sep[a,b]) for a, b in itertools.combinations(range(len(self.labels)),2)),default=float('nan'))
+
+	def summary(self):
+		# The analysis so far: for every isotope (keyed e.g. '80Kr') the number of complete 'Ions' seen and the 'Centroid', 'Width'
+		# (standard deviation) and 'Uncertainty' (standard error of the centroid) in every partition (MeV), then the 'Separation' of
+		# every pair of isotopes (keyed e.g. '80Se-80Kr'), the 'Worst' of these and whether a separation target has been 'Met'
+		with self.lock:
+			return self._summary()
+
+	def _summary(self):
+		means, widths, errors = self._uncertainty()
+		sep = scan.separation(self.count,self.total,self.products)
+		pairs = {self.labels[a]+'-'+self.labels[b]: float(sep[a,b]) for a, b in itertools.combinations(range(len(self.labels)),2)}
+		return {
+			'Isotopes': {label: {'Ions': int(self.count[k]), 'Centroid': means[k].tolist(), 'Width': widths[k].tolist(),
+				'Uncertainty': errors[k].tolist()} for k, label in enumerate(self.labels)},
+			'Separation': pairs,
+			'Worst': min(pairs.values()) if pairs else float('nan'),
+			'Met': self.met
+			}
+
+	def histograms(self,isotope=None):
+		# The histograms so far in the form hist.PIDHist returns them (keyed by pair, e.g. '12', holding the counts and bin edges), summed
+		# over every isotope or for the one named (e.g. '80Kr'); they can be drawn with hist.drawPNG
+		with self.lock:
+			return self._histograms(isotope)
+
+	def _histograms(self,isotope):
+		if self.edges is None:
+			return {}
+		xedges, yedges = self.edges
+		if isotope is None:
+			return {pair: (counts.sum(axis=0), xedges, yedges) for pair, counts in self.counts.items()}
+		k = self.labels.index(isotope)
+		return {pair: (counts[k].copy(), xedges, yedges) for pair, counts in self.counts.items()}
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import pickle
+from . import compoundparse
+from . import ionparse
+
+# Parse-once copy of TRIM's atom and compound directories, shared by every Batch object in a process.
+# Parsing ATOMDATA and Compound.dat is slow next to writing an input file, so the parsed dictionaries are also pickled to
+# TRIMDATA/.materials.pickle and reused by later scripts. The cache is keyed on the two data files and on the two parsers (which
+# hold the hand-copied binding energies and any user-defined compounds): a source whose size and modification time are unchanged is
+# trusted, otherwise its contents are hashed and the cache is only thrown away if a hash has actually changed.
+
+_database = None
+
+class Materials:
+	def __init__(self,atoms,compounds):
+		# atoms is keyed by atomic number (as a string) and compounds by name, exactly as returned by ionparse and compoundparse
+		self.atoms = atoms
+		self.compounds = compounds
+		# index chemical symbols so that looking up an atom doesn't mean scanning the whole table
+		self.symbols = {}
+		for atnb, atdata in atoms.items():
+			self.symbols[atdata['Symbol']] = int(atnb)
+	def Z(self,symbol):
+		# returns the atomic number for a chemical symbol, or 0 if TRIM doesn't know the element
+		return self.symbols.get(symbol,0)
+	def atom(self,symbol):
+		return self.atoms[str(self.symbols[symbol])]
+	def compound(self,name):
+		return self.compounds[name]
+
+def _sources(datadir):
+	return [os.path.join(datadir,'ATOMDATA'),
+		os.path.join(datadir,'Compound.dat'),
+		ionparse.__file__,
+		compoundparse.__file__]
+
+def _stat(path):
+	st = os.stat(path)
+	return [st.st_size, st.st_mtime_ns]
+
+def _hash(path):
+	h = hashlib.sha1()
+	with open(path,'rb') as f:
+		for block in iter(lambda: f.read(1<<20), b''):
+			h.update(block)
+	return h.hexdigest()
+
+def cachePath():
+	homedir = os.path.expanduser('~')
+	return os.path.join(homedir,'TRIFIC','TRIMDATA','.materials.pickle')
+
+def load(datadir=None,cache=True):
+	# Returns a fresh Materials object, from the on-disk cache if it is still valid or by parsing the TRIM directories if not.
+	if datadir is None:
+		homedir = os.path.expanduser('~')
+		datadir = os.path.join(homedir,'.wine','drive_c','Program Files (x86)','SRIM-2013','Data')
+	sources = _sources(datadir)
+	stats = [_stat(src) for src in sources]
+
+	stored = None
+	if cache and os.path.isfile(cachePath()):
+		try:
+			with open(cachePath(),'rb') as f:
+				stored = pickle.load(f)
+		except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+			stored = None
+	if stored is not None and stored['Sources'] == sources:
+		if stored['Stats'] == stats:
+			return Materials(stored['Atoms'],stored['Compounds'])
+		hashes = [_hash(src) for src in sources]
+		if stored['Hashes'] == hashes:
+			# sources were touched but not changed; remember the new times so they aren't hashed again next time
+			stored['Stats'] = stats
+			_save(stored)
+			return Materials(stored['Atoms'],stored['Compounds'])
+	else:
+		hashes = [_hash(src) for src in sources]
+
+	atoms = ionparse.ionparse(datadir)
+	compounds = compoundparse.compoundparse(datadir)
+	if cache:
+		_save({'Sources': sources, 'Stats': stats, 'Hashes': hashes, 'Atoms': atoms, 'Compounds': compounds})
+	return Materials(atoms,compounds)
+
+def _save(stored):
+	# written under a temporary name and renamed so that scripts running side by side never read a half written cache
+	path = cachePath()
+	try:
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		tmppath = path+'.'+str(os.getpid())
+		with open(tmppath,'wb') as f:
+			pickle.dump(stored,f,protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmppath,path)
+	except OSError:
+		# the cache is only an optimisation; carry on without it if TRIMDATA isn't writable
+		pass
+
+def database():
+	# Returns the process-wide Materials object, loading it on first use
+	global _database
+	if _database is None:
+		_database = load()
+	return _database
@@ -0,0 +1,135 @@
+import os
+import numpy as np
+from . import catalog
+from . import collisions
+from . import compression
+from . import store
+
+# Particle identification from TRIM collision data, the Python counterpart of the summing half of processSRIMData in TRIFICsim.cpp.
+# Energy lost at each collision is binned into the collection regions between TRIFIC's wire grids in a single pass over a file, and
+# any number of partition schemes can then be summed from the binned regions without reading the file again.
+#
+# Collection regions are numbered as in TRIFICsim: region 1 starts at the first wires, and region i lies between wire planes i-1 and i
+# along the beam once the tilt of the grids is accounted for. A signal grid collects two regions, so signal grid k is regions 2k-1 and 2k.
+# Regions 0 and Grids+1 catch collisions pushed just outside the grids by the tilt.
+#
+# Energy losses are not taken quite as TRIFICsim takes them. processSRIMData gathers collisions until the next line that isn't one, and
+# gives collision i the loss E[i-1]-E[i] within what it gathered, so the first collision reads E[-1], outside its array, and a run of
+# recoil cascade lines part way through an ion starts the rest of the ion over with the same off-by-one. Here (see collisions.energyLoss)
+# the first collision of each ion, taken from TRIM's ion numbers, is given no loss and the loss across cascade lines is kept. The two
+# agree to the two decimals TRIFICsim prints when no ion is interrupted and every first collision lies before the wires, which is what
+# 'python -m TRIMbatch.benchmark --trificsim ./TRIFICsim' checks on a synthetic file (see trificsimCheck in benchmark.py).
+
+# TRIFIC as mounted, matching the constants at the top of TRIFICsim.cpp. Distances are in mm and the grid tilt is in degrees.
+GEOMETRY = {
+	'Grids':		21,	# number of grids installed
+	'Spacing':		12.77,	# distance between wire grids
+	'Window To Wires':	23.78,	# distance from window to first wires
+	'Tilt':			60	# angle of the grids to the beam axis; collisions are shifted by Z/tan(Tilt) = Z/sqrt(3)
+	}
+
+def partition(*grids):
+	# Builds a partition scheme from the number of consecutive signal grids in each partition, e.g. partition(3,3,4) for the usual 3-3-4 scheme.
+	# A scheme is a list holding the collection regions summed for each partition, and may equally be written out by hand.
+	scheme = []
+	first = 1
+	for n in grids:
+		scheme.append(list(range(2*first-1,2*(first+n)-1)))
+		first += n
+	return scheme
+
+# the 3-3-4 partition hard-coded in TRIFICsim's printValues: regions 1-6, 7-12 and 13-20
+SCHEME = partition(3,3,4)
+
+def _geometry(geometry):
+	if geometry is None:
+		return GEOMETRY
+	return dict(GEOMETRY,**geometry)
+
+def binCollisions(chunk,geometry=None):
+	# Sums the energy lost (MeV) in each collection region for every ion in a chunk from collisions.CollisionReader.
+	# Returns the first-collision index of each ion in the chunk and an (ions x Grids+2) array of region energies.
+	prepared = prepareChunk(chunk)
+	return prepared['Starts'], binPrepared(prepared,geometry)
+
+def prepareChunk(chunk):
+	# the parts of binning that don't depend on the geometry, so that a chunk can be binned for several geometries (see scan.py)
+	starts = collisions.ionStarts(chunk)
+	ionindex = np.cumsum(starts)-1
+	# convert Angstrom to mm and keV to MeV
+	return {
+		'Starts':	np.flatnonzero(starts),
+		'Ion Index':	ionindex,
+		'Ions':		int(ionindex[-1])+1 if len(ionindex) else 0,
+		'Depth':	chunk['x']*1e-7,
+		'Vertical':	chunk['z']*1e-7,
+		'Loss':		collisions.energyLoss(chunk)/1000
+		}
+
+def binPrepared(prepared,geometry=None):
+	geo = _geometry(geometry)
+	nregions = geo['Grids']+2
+	nions = prepared['Ions']
+	depth = prepared['Depth']
+	ionindex = prepared['Ion Index']
+	# only collisions between the first and last grid are collected
+	inside = (depth > geo['Window To Wires']) & (depth < geo['Window To Wires']+geo['Spacing']*geo['Grids'])
+	region = np.floor(((depth-geo['Window To Wires'])+prepared['Vertical']/np.tan(np.radians(geo['Tilt'])))/geo['Spacing']).astype(np.int64)+1
+	inside &= (region >= 0) & (region < nregions)
+
+	regions = np.bincount(ionindex[inside]*nregions+region[inside], weights=prepared['Loss'][inside], minlength=nions*nregions)
+	return regions.reshape(nions,nregions)
+
+def collectionRegions(sources,geometry=None,chunksize=262144):
+	# Reads collision data once and bins every ion. sources is a collision file, a CollisionStore (see store.py), or a list of either.
+	# Returns a dictionary with the isotopes found in the file headers ('Isotopes'), and per-ion arrays of the isotope index ('isotope'),
+	# TRIM's ion number ('ion') and energies collected in each region ('regions', one column per region).
+	if not isinstance(sources,list):
+		sources = [sources]
+	isotopes = []
+	isotope = []
+	ion = []
+	regions = [np.zeros((0,_geometry(geometry)['Grids']+2))]
+	for source in sources:
+		if isinstance(source,str):
+			source = collisions.reader(source,chunksize=chunksize)
+		for chunk in source:
+			starts, binned = binCollisions(chunk,geometry)
+			isotope.append(chunk['isotope'][starts]+len(isotopes))
+			ion.append(chunk['ion'][starts])
+			regions.append(binned)
+		isotopes.extend(source.isotopes)
+	return {'Isotopes': isotopes, 'isotope': np.concatenate(isotope+[np.zeros(0,dtype=np.int32)]),
+		'ion': np.concatenate(ion+[np.zeros(0,dtype=np.int32)]), 'regions': np.concatenate(regions)}
+
+def partitionSums(regions,scheme=None):
+	# Sums region energies into partitions for every ion at once; returns an (ions x partitions) array.
+	if scheme is None:
+		scheme = SCHEME
+	select = np.zeros((regions.shape[1],len(scheme)))
+	for p, part in enumerate(scheme):
+		for r in part:
+			if r < 0 or r >= regions.shape[1]:
+				raise ValueError('Partition scheme refers to a collection region that does not exist')
+			select[r,p] = 1
+	return regions @ select
+
+def PIDData(saveto,fs,geometry=None,scheme=None,cache=True):
+	# Bins the given output files of a simulation directory and sums them into partitions ('parts') as well as regions.
+	# With cache, outputs are read from (and on first use converted to) their columnar stores rather than parsed as text each time.
+	# Converting writes the stores to TRIFIC/TRIMDATA/<saveto>/COLUMNS (see store.cached), so a directory that is read-only or shared
+	# with others is best read with cache=False, which parses the text and writes nothing to it (only the catalog notes the analysis).
+	homedir = os.path.expanduser('~')
+	if saveto not in os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA')):
+		raise ValueError('Given directory not found')
+	outfiles = compression.listOutputs(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT'))
+	if any(f not in outfiles for f in fs):
+		raise ValueError('File not found in given directory')
+	if cache:
+		sources = [store.cached(saveto,f) for f in fs]
+	else:
+		sources = [os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT',f) for f in fs]
+	data = collectionRegions(sources,geometry)
+	data['parts'] = partitionSums(data['regions'],scheme)
+	catalog.recordAnalysis(saveto,fs)
+	return data
@@ -0,0 +1,257 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from . import batch
+from . import compression
+from . import hist
+from . import instrument
+from . import jobqueue
+from . import pid
+from . import store
+
+# Experiments written down as a spec rather than a script, and run make-style: python -m TRIMbatch experiment.json
+# A spec is a JSON file (see examplespec.json) giving the simulation directory, the beams, the target layers and how to simulate and
+# analyse them. It is run as a chain of stages, each redone only if what it depends on has changed since it last ran:
+#	inputs		renders an input file for every beam (Batch.makeBatch); depends on the beams, layers and output profile
+#	simulate	runs TRIM on every input without an output (Sim), or queues them for workers (jobqueue.py); depends on the input files,
+#			which are named after their contents, so changing one beam only simulates that beam again
+#	parse		converts the outputs to columnar stores (store.py); depends on the outputs
+#	histogram	makes the PID histograms of every analysis (hist.PIDHist); depends on the outputs and the analysis settings, so
+#			changing a binning or partition scheme redoes only this stage, in seconds
+# What each stage last ran with is stamped in TRIMDATA/<directory>/STAMPS: a hash of its inputs ('Key'), and whatever later stages need
+# to know about what it made. A stage is out of date if its key has changed, if one of its outputs is missing, or if it is forced.
+
+# the keys of each part of a spec that must be given, and the defaults of those that needn't be; the beam and layer keys are the
+# arguments of Batch.nextIon and Batch.addTargetLayer, and the simulation keys those of Sim (with Queue to queue the inputs instead)
+SPEC = (['Directory','Beams','Layers'], {'Profile': 'full', 'Increment': 100000, 'Simulation': {}, 'Analysis': []})
+BEAM = (['Ion','Mass','Energy','Number'], {'Angle': 0, 'Corr': 0, 'Shards': 1})
+LAYER = (['Name','Gas'], {'Width': 0, 'Unit': 'Ang', 'Density': 0, 'Pressure': 0, 'Corr': 1, 'Compound': True})
+SIMULATION = ([], {'Workers': 1, 'Timeout': None, 'Retries': 0, 'Interval': 30, 'Persistent': False, 'Compress': None, 'Queue': False})
+ANALYSIS = ([], {'Name': 'PID', 'Beams': None, 'Geometry': None, 'Scheme': None, 'Xbins': 50, 'Ybins': 50, 'Xrange': 0, 'Yrange': 0, 'PNG': False})
+
+def _fill(given,keys,what):
+	# the given dictionary with defaults filled in, checking that no key is unknown and that the required keys are there
+	required, defaults = keys
+	if not isinstance(given,dict):
+		raise ValueError(what+' must be a dictionary')
+	for key in given:
+		if key not in required and key not in defaults:
+			raise ValueError('Unknown key '+key+' in '+what)
+	for key in required:
+		if key not in given:
+			raise ValueError(what+' needs a '+key)
+	return dict(defaults,**given)
+
+def check(spec):
+	# Returns a complete copy of a spec (a dictionary as read from JSON), with every default filled in, or raises ValueError
+	spec = _fill(spec,SPEC,'spec')
+	if not spec['Beams'] or not spec['Layers']:
+		raise ValueError('A spec needs at least one beam and one layer')
+	spec['Beams'] = [_fill(beam,BEAM,'beam') for beam in spec['Beams']]
+	spec['Layers'] = [_fill(layer,LAYER,'layer') for layer in spec['Layers']]
+	spec['Simulation'] = _fill(spec['Simulation'],SIMULATION,'simulation')
+	analyses = spec['Analysis'] if isinstance(spec['Analysis'],list) else [spec['Analysis']]
+	spec['Analysis'] = [_fill(analysis,ANALYSIS,'analysis') for analysis in analyses]
+	names = [analysis['Name'] for analysis in spec['Analysis']]
+	if len(set(names)) < len(names):
+		raise ValueError('Every analysis needs its own name')
+	labels = [label(beam) for beam in spec['Beams']]
+	for analysis in spec['Analysis']:
+		if analysis['Beams'] is not None and any(beam not in labels for beam in analysis['Beams']):
+			raise ValueError('Analysis '+analysis['Name']+' refers to a beam that is not in the spec')
+	return spec
+
+def load(path):
+	with open(path) as f:
+		return check(json.load(f))
+
+def label(beam):
+	# how an analysis refers to a beam: mass and symbol, e.g. '80Ga' (so it takes every beam of that isotope)
+	return '{}{}'.format(beam['Mass'],beam['Ion'])
+
+def _hash(value):
+	return hashlib.sha1(json.dumps(value,sort_keys=True).encode()).hexdigest()
+
+def _signature(paths):
+	# what changes when a file is written again: its name, size and modification time
+	signature = []
+	for path in paths:
+		st = os.stat(compression.resolve(path))
+		signature.append([os.path.basename(path),st.st_size,st.st_mtime_ns])
+	return signature
+
+def _scheme(scheme):
+	# a partition scheme may be given as the number of signal grids in each partition, e.g. [3,3,4], or written out in regions
+	if scheme is None or all(isinstance(part,list) for part in scheme):
+		return scheme
+	return pid.partition(*scheme)
+
+def stampDir(saveto):
+	homedir = os.path.expanduser('~')
+	return os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'STAMPS')
+
+def _readStamp(saveto,name):
+	try:
+		with open(os.path.join(stampDir(saveto),name.replace(':','-')+'.json')) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return None
+
+def _writeStamp(saveto,name,key,state):
+	os.makedirs(stampDir(saveto),exist_ok=True)
+	path = os.path.join(stampDir(saveto),name.replace(':','-')+'.json')
+	with open(path+'.partial','w') as f:
+		json.dump({'Key': key, 'State': state, 'Time': time.time()},f,indent=1,sort_keys=True)
+	os.replace(path+'.partial',path)
+
+def stages(spec):
+	# The stage graph of a checked spec: a list of stages in the order they run, each a dictionary with its 'Name', the stages it comes
+	# 'After', and three functions of the state built up by the stages before it: 'Key' (what the stage depends on), 'Outputs' (the
+	# files it makes) and 'Run' (which does the work and returns what it adds to the state, or None if it couldn't finish).
+	saveto = str(spec['Directory'])
+	homedir = os.path.expanduser('~')
+	savetodir = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto)
+	sim = spec['Simulation']
+
+	def inputsRun(state,force):
+		first = spec['Beams'][0]
+		b = batch.Batch(saveto,first['Ion'],first['Mass'],first['Energy'],first['Number'],profile=spec['Profile'],increment=spec['Increment'])
+		for n, layer in enumerate(spec['Layers']):
+			b.addTargetLayer(n+1,layer['Name'],width=layer['Width'],unit=layer['Unit'],density=layer['Density'],pressure=layer['Pressure'],
+				corr=layer['Corr'],gas=layer['Gas'],compound=layer['Compound'])
+		for beam in spec['Beams']:
+			b.nextIon(beam['Ion'],beam['Mass'],beam['Energy'],beam['Number'],angle=beam['Angle'],corr=beam['Corr'],shards=beam['Shards'])
+		index = batch.getIndex(saveto)
+		files = b.batchFiles()
+		return {'Files': files, 'Labels': [label(beam) for beam in spec['Beams']],
+			'Inputs': [shard for f in files for shard in index[f].get('Shards',[f])]}
+
+	def simulateRun(state,force):
+		if sim['Queue']:
+			if not force and all(compression.exists(path) for path in outputs(state)):
+				# the workers have finished
+				return {}
+			jobqueue.enqueue(saveto,state['Files'],force=force,retries=sim['Retries'],compress=sim['Compress'])
+			print('Inputs queued; run python -m TRIMbatch.jobqueue work to simulate them, then run the spec again')
+			return None
+		batch.Sim(saveto,state['Files'],workers=sim['Workers'],force=force,timeout=sim['Timeout'],retries=sim['Retries'],
+			interval=sim['Interval'],persistent=sim['Persistent'],compress=sim['Compress'])
+		return {}
+
+	def parseRun(state,force):
+		for f in state['Files']:
+			store.cached(saveto,f)
+		return {}
+
+	def outputs(state):
+		return [os.path.join(savetodir,'OUT',f) for f in state['Files']]
+
+	graph = [
+		{'Name': 'inputs', 'After': [],
+			'Key': lambda state: _hash([spec[key] for key in ('Directory','Profile','Increment','Beams','Layers')]),
+			'Outputs': lambda state: [os.path.join(savetodir,'IN',f) for f in state['Inputs']],
+			'Run': inputsRun},
+		{'Name': 'simulate', 'After': ['inputs'],
+			'Key': lambda state: _hash(state['Files']),
+			'Outputs': outputs,
+			'Run': simulateRun},
+		{'Name': 'parse', 'After': ['simulate'],
+			'Key': lambda state: _hash(_signature(outputs(state))),
+			'Outputs': lambda state: [os.path.join(savetodir,'COLUMNS',os.path.splitext(f)[0],'meta.json') for f in state['Files']],
+			'Run': parseRun}
+		]
+
+	for analysis in spec['Analysis']:
+		def selected(state,analysis=analysis):
+			if analysis['Beams'] is None:
+				return state['Files']
+			return [f for f, beamlabel in zip(state['Files'],state['Labels']) if beamlabel in analysis['Beams']]
+
+		def histogramRun(state,force,analysis=analysis,selected=selected):
+			hist.PIDHist(saveto,selected(state),analysis['Xrange'],analysis['Yrange'],analysis['Xbins'],analysis['Ybins'],
+				analysis['Geometry'],_scheme(analysis['Scheme']),name=analysis['Name'],png=analysis['PNG'])
+			return {}
+
+		def histogramOutputs(state,analysis=analysis):
+			paths = [os.path.join(savetodir,'PID',analysis['Name']+'.npz')]
+			if analysis['PNG']:
+				nparts = len(_scheme(analysis['Scheme']) or pid.SCHEME)
+				paths += [os.path.join(savetodir,'PID','{}-{}{}.png'.format(analysis['Name'],i+1,j+1)) for i in range(nparts) for j in range(i+1,nparts)]
+			return paths
+
+		graph.append({'Name': 'histogram:'+analysis['Name'], 'After': ['parse'],
+			'Key': lambda state, analysis=analysis, selected=selected: _hash([analysis,_signature([os.path.join(savetodir,'OUT',f) for f in selected(state)])]),
+			'Outputs': histogramOutputs,
+			'Run': histogramRun})
+	return graph
+
+def run(spec,dry=False,force=(),until=None):
+	# Runs the stages of a spec (a dictionary, or the path of a JSON file) that are out of date, in order, and returns the state of each:
+	# 'up to date', 'ran', 'would run' (with dry), 'waiting' (for queued simulations, or because an earlier stage didn't finish) or
+	# 'incomplete' (it ran but some of its outputs are missing, e.g. a simulation failed). force is a list of stages to run whether or
+	# not they are out of date ('all' for every stage); forcing simulate simulates every input again. until stops after the given stage.
+	if isinstance(spec,str):
+		spec = load(spec)
+	else:
+		spec = check(spec)
+	saveto = str(spec['Directory'])
+	graph = stages(spec)
+	names = [stage['Name'] for stage in graph]
+	for name in list(force)+([until] if until is not None else []):
+		if name != 'all' and name not in names:
+			raise ValueError('Unknown stage '+name+'; stages are '+', '.join(names))
+	homedir = os.path.expanduser('~')
+	if not dry:
+		os.makedirs(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto),exist_ok=True)
+
+	state = {}
+	status = {}
+	for stage in graph:
+		name = stage['Name']
+		if any(status[after] in ('waiting','incomplete') for after in stage['After']):
+			status[name] = 'waiting'
+		elif any(status[after] == 'would run' for after in stage['After']):
+			# what an earlier stage will make isn't known until it has run
+			status[name] = 'would run'
+		else:
+			forced = 'all' in force or name in force
+			key = stage['Key'](state)
+			stamp = _readStamp(saveto,name)
+			current = stamp is not None and stamp['Key'] == key and not forced
+			if current:
+				current = all(compression.exists(path) for path in stage['Outputs'](dict(state,**stamp['State'])))
+			if current:
+				state.update(stamp['State'])
+				status[name] = 'up to date'
+			elif dry:
+				status[name] = 'would run'
+			else:
+				with instrument.stage('Pipeline.'+name.split(':')[0],Saveto=saveto,Name=name):
+					added = stage['Run'](state,forced)
+				if added is None:
+					status[name] = 'waiting'
+				else:
+					state.update(added)
+					if all(compression.exists(path) for path in stage['Outputs'](state)):
+						_writeStamp(saveto,name,key,added)
+						status[name] = 'ran'
+					else:
+						status[name] = 'incomplete'
+		print('{:<24} {}'.format(name,status[name]))
+		if name == until:
+			break
+	return status
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Run the out of date stages of a TRIMbatch experiment spec')
+	parser.add_argument('spec',help='JSON experiment spec')
+	parser.add_argument('--dry-run',action='store_true',help="show what would run without running anything")
+	parser.add_argument('--force',nargs='+',default=[],help='stages to run even if they are up to date (or all)')
+	parser.add_argument('--until',default=None,help='stop after this stage')
+	args = parser.parse_args(argv)
+	run(args.spec,dry=args.dry_run,force=args.force,until=args.until)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,241 @@
+import asyncio
+import os
+import shutil
+import signal
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import collisions
+from . import compression
+from . import instrument
+
+# TRIM always reads TRIM.IN from, and writes its outputs to 'SRIM Outputs' within, the directory it is run from. Only one simulation can
+# therefore use an install at a time, so to run several at once every worker is given its own scratch copy of SRIM-2013 to work in.
+# The copies live inside the wine C: drive next to the real install and are kept between batches so the copy is only ever made once.
+
+def srimDir():
+	homedir = os.path.expanduser('~')
+	return os.path.join(homedir,'.wine','drive_c','Program Files (x86)','SRIM-2013')
+
+def workerDir(n):
+	homedir = os.path.expanduser('~')
+	return os.path.join(homedir,'.wine','drive_c','SRIM-workers','worker'+str(n))
+
+def prepareWorker(n):
+	# Makes (if needed) and returns the scratch SRIM install for worker n. The copy is made under a temporary name and renamed into place,
+	# so a copy interrupted part way through is never mistaken for a usable install.
+	wdir = workerDir(n)
+	if not os.path.isfile(os.path.join(wdir,'TRIM.exe')):
+		shutil.rmtree(wdir, ignore_errors=True)
+		tmpdir = wdir+'.partial'
+		shutil.rmtree(tmpdir, ignore_errors=True)
+		shutil.copytree(srimDir(), tmpdir, ignore=shutil.ignore_patterns('SRIM Outputs'))
+		os.mkdir(os.path.join(tmpdir,'SRIM Outputs'))
+		os.rename(tmpdir, wdir)
+	return wdir
+
+def ionsInFile(infile):
+	# number of ions a TRIM input file asks for (fifth value on the third line)
+	with open(infile) as f:
+		for i in range(2):
+			f.readline()
+		return int(f.readline().split()[4])
+
+def outputName(infile):
+	# The output file to collect for a TRIM input file, from its Diskfiles line (the seventh): the collision file if one is written at all,
+	# otherwise the EXYZ file (see the output profiles in batch.py)
+	with open(infile) as f:
+		for i in range(6):
+			f.readline()
+		flags = f.readline().split()
+	if int(flags[4]) > 0:
+		return 'COLLISON.txt'
+	if float(flags[5]) > 0:
+		return 'EXYZ.txt'
+	raise ValueError(os.path.basename(infile)+' asks TRIM for neither a collision nor an EXYZ file')
+
+def _stage(wdir,tocopy):
+	# Any output left over from a previous run is removed first so that a crashed TRIM can't hand back the wrong ion's data.
+	output = os.path.join(wdir,'SRIM Outputs',outputName(tocopy))
+	if os.path.exists(output):
+		os.remove(output)
+	# the input is copied rather than linked, so nothing TRIM does to TRIM.IN can reach the input file it was named after
+	shutil.copyfile(tocopy,os.path.join(wdir,'TRIM.IN'))
+	return output
+
+def _collect(output,tocopy,pasteto,compress=None):
+	# Saves the output to pasteto, or compressed next to it (pasteto.gz or pasteto.zst) with compress, and returns where it went.
+	# Any other form of the output left from an earlier run is removed, so the plain name only ever stands for one file.
+	if not os.path.exists(output):
+		raise RuntimeError('TRIM produced no '+os.path.basename(output)+' for '+os.path.basename(tocopy))
+	if compress is not None:
+		# compressed from the install's copy as a stream, under a temporary name, so only the compressed file is ever written to OUT
+		saved = compression.compressFile(output,pasteto,compress)
+		os.remove(output)
+		compression.remove(pasteto,keep=saved)
+		return saved
+	# The output is moved rather than copied, as the next run in this install would remove it anyway. A rename is atomic, so an output in
+	# the OUT directory is always a complete one; across filesystems it is copied under a temporary name first instead.
+	try:
+		os.replace(output,pasteto)
+	except OSError:
+		shutil.copyfile(output,pasteto+'.partial')
+		os.replace(pasteto+'.partial',pasteto)
+		os.remove(output)
+	compression.remove(pasteto,keep=pasteto)
+	return pasteto
+
+def startWineserver(persist=30):
+	# Starts a wineserver that stays up for persist seconds after the last wine process exits, so that every TRIM in a batch reuses it
+	# instead of starting its own. If one is already running it is used as it is. Returns False if wineserver can't be found.
+	try:
+		subprocess.call(['wineserver','-p'+str(int(persist))],stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+	except OSError:
+		return False
+	return True
+
+def _kill(proc):
+	# wine is started in its own session, so the whole process group (wine, TRIM and any dialog it opened) can be killed together
+	try:
+		os.killpg(proc.pid,signal.SIGKILL)
+	except ProcessLookupError:
+		pass
+
+def printProgress(name,state,ions,total,elapsed):
+	# default progress report: one line whenever a job starts, finishes or (while running) every progress interval
+	if state in ('running','done','stopped'):
+		print('{}: {} (ion {}/{}, {:.0f} s)'.format(name,state,ions,total,elapsed))
+	else:
+		print('{}: {}'.format(name,state))
+
+async def runTRIM(wdir,tocopy,pasteto,timeout=None,progress=None,interval=30,env=None,compress=None,monitor=None,poll=2):
+	# Runs a single TRIM input file in the SRIM install wdir and copies the collision output to pasteto (compressed with compress, if given).
+	# TRIM is killed if it hasn't finished after timeout seconds (None waits for ever), raising TimeoutError. While it runs, progress is
+	# called every interval seconds with the job name, state, the last ion written to the collision file, the number of ions asked for
+	# and the time since the job started. env replaces the environment wine is run with.
+	# monitor, if given, is called as monitor(input file, output file, state) with state 'started' just before TRIM is started (so that
+	# anything it kept from an earlier attempt at the job can be dropped), 'running' every poll seconds while TRIM writes its output and
+	# 'done' when TRIM has finished (see live.py). If it returns True while running, TRIM is stopped there and then: the output is cut
+	# back to its last complete ion and collected as usual, and the job is reported as 'stopped' rather than 'done'.
+	# Otherwise the output is only collected if TRIM exited cleanly having written every ion asked for, and RuntimeError is raised if not.
+	# Returns the number of ions in the collected output.
+	name = os.path.basename(tocopy)
+	total = ionsInFile(tocopy)
+	with instrument.stage('Sim.stage',File=name,Worker=wdir):
+		output = _stage(wdir,tocopy)
+	if monitor is not None:
+		monitor(tocopy,output,'started')
+	start = time.monotonic()
+	with instrument.stage('Sim.trim',File=name,Worker=wdir,Ions=total) as record:
+		proc = await asyncio.create_subprocess_exec('wine','TRIM.exe',cwd=wdir,env=env,start_new_session=True)
+		if progress is not None:
+			progress(name,'started',0,total,0)
+
+		async def watch():
+			while True:
+				await asyncio.sleep(interval)
+				if progress is not None:
+					progress(name,'running',collisions.lastIon(output),total,time.monotonic()-start)
+
+		stopped = False
+
+		async def live():
+			nonlocal stopped
+			while True:
+				await asyncio.sleep(poll)
+				# the output is read and binned in a worker thread, however much TRIM has written since the last look
+				if await asyncio.get_running_loop().run_in_executor(None,monitor,tocopy,output,'running') and proc.returncode is None:
+					stopped = True
+					_kill(proc)
+					return
+
+		watcher = asyncio.ensure_future(watch())
+		tail = asyncio.ensure_future(live()) if monitor is not None else None
+		try:
+			await asyncio.wait_for(proc.wait(),timeout)
+		except asyncio.TimeoutError:
+			_kill(proc)
+			await proc.wait()
+			raise TimeoutError('TRIM did not finish within {} s'.format(timeout))
+		except asyncio.CancelledError:
+			_kill(proc)
+			raise
+		finally:
+			watcher.cancel()
+			if tail is not None:
+				tail.cancel()
+		record['Return Code'] = proc.returncode
+		record['Stopped'] = stopped
+	if stopped:
+		last = collisions.dropLastIon(output) if os.path.exists(output) else 0
+	else:
+		# A TRIM that crashed (or was closed) part way through leaves an output that can't be told from a finished one up to where it
+		# ended, so it is never collected: the job fails, to be tried again like one that timed out
+		last = collisions.lastIon(output)
+		if proc.returncode != 0:
+			raise RuntimeError('TRIM exited with code {} after ion {} of {}'.format(proc.returncode,last,total))
+		if last < total:
+			raise RuntimeError('TRIM finished after ion {} of {}'.format(last,total))
+		if monitor is not None:
+			await asyncio.get_running_loop().run_in_executor(None,monitor,tocopy,output,'done')
+	with instrument.stage('Sim.collect',File=name,Worker=wdir,Compression=compress) as record:
+		saved = _collect(output,tocopy,pasteto,compress)
+		record['Outputs'] = instrument.outputs([saved])
+	if progress is not None:
+		progress(name,'stopped' if stopped else 'done',last,total,time.monotonic()-start)
+	return last
+
+async def simulate(jobs,workers=1,timeout=None,retries=0,progress=printProgress,interval=30,persistent=False,compress=None,monitor=None,poll=2):
+	# Runs a list of (input file, output file) jobs and returns a list of (job, error) pairs in the order they finished; error is None on
+	# success. With a single worker the main SRIM install is used directly, as it always has been. With more, each worker takes a scratch
+	# install from the pool for the duration of one job so that no two TRIM processes ever share a directory. The install freed last is
+	# handed out first, so consecutive jobs keep reusing the same (already cached) installs when there are more workers than jobs need.
+	# A job that times out, fails or gives no complete output is tried again (in whichever install is free next) up to retries more times;
+	# one that can't be run at all as its input stands (ValueError) fails straight away.
+	# With persistent, one wineserver is kept up for the whole batch rather than one being started (and shut down) for every TRIM, and
+	# wine's debug output is switched off; for short simulations this start up is most of the time a job takes.
+	# compress ('gzip' or 'zstd') saves outputs compressed (see compression.py), and monitor is polled every poll seconds by every job
+	# (see runTRIM) to follow their outputs as they are written and stop them early.
+	env = None
+	if persistent:
+		startWineserver(max(30,interval))
+		env = dict(os.environ,WINEDEBUG='-all')
+	pool = asyncio.LifoQueue()
+	if workers == 1:
+		pool.put_nowait(srimDir())
+	else:
+		for n in range(workers):
+			pool.put_nowait(prepareWorker(n))
+	results = []
+
+	async def work(job):
+		for attempt in range(retries+1):
+			wdir = await pool.get()
+			try:
+				await runTRIM(wdir,*job,timeout=timeout,progress=progress,interval=interval,env=env,compress=compress,monitor=monitor,poll=poll)
+				results.append((job,None))
+				return
+			except (RuntimeError, TimeoutError) as err:
+				error = err
+				if progress is not None and attempt < retries:
+					progress(os.path.basename(job[0]),'retrying after error: '+str(err),0,ionsInFile(job[0]),0)
+			except ValueError as err:
+				# a problem with the input itself (e.g. one asking for no output TRIM can be collected from) would only happen again
+				results.append((job,err))
+				return
+			finally:
+				pool.put_nowait(wdir)
+		results.append((job,error))
+
+	await asyncio.gather(*[work(job) for job in jobs])
+	return results
+
+def runJobs(jobs,workers=1,**kwargs):
+	# Blocking wrapper around simulate() for scripts. From inside a running event loop (e.g. a Jupyter notebook) the jobs are run in a
+	# separate thread with its own loop; code that is already asynchronous can await simulate() directly.
+	try:
+		asyncio.get_running_loop()
+	except RuntimeError:
+		return asyncio.run(simulate(jobs,workers,**kwargs))
+	with ThreadPoolExecutor(max_workers=1) as executor:
+		return executor.submit(asyncio.run,simulate(jobs,workers,**kwargs)).result()
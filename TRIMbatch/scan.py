@@ -0,0 +1,154 @@
+import itertools
+import os
+import numpy as np
+from . import catalog
+from . import collisions
+from . import compression
+from . import pid
+from . import store
+
+# Geometry and partition scans over stored collisions: how well would a cocktail of isotopes separate if TRIFIC had other grid spacings,
+# positions or tilts, or if its signal grids were grouped into partitions differently? Each collision file is read once, every chunk
+# is binned for every geometry, and only running sums per isotope are kept, so scanning hundreds of configurations costs little more
+# memory than one and no TRIM run or C++ edit is needed.
+#
+# Separation is measured in the space of partition sums (the axes of the PID plots). For every pair of isotopes it is the distance
+# between their mean partition sums in units of their spread, sqrt(d^T C^-1 d) with d the difference of the means and C the average of
+# the two covariance matrices (the Mahalanobis distance). A separation of 2 means the isotopes' distributions overlap badly, 5 or more that
+# they are cleanly apart. A configuration is only as good as its worst pair, which is given as 'Worst'.
+
+def geometries(**values):
+	# Every combination of the given geometry values, e.g. geometries(Spacing=[10,12.77,15],Tilt=[45,60]) gives 6 geometries; any key
+	# of pid.GEOMETRY may be scanned and the rest keep their defaults.
+	for key in values:
+		if key not in pid.GEOMETRY:
+			raise ValueError('Unknown geometry parameter '+key)
+	keys = sorted(values)
+	return [dict(zip(keys,combination)) for combination in itertools.product(*[list(values[key]) for key in keys])]
+
+def groupings(parts,grids=10):
+	# Every way of splitting grids consecutive signal grids into parts partitions of at least one grid each, as partition schemes
+	# (see pid.partition); e.g. groupings(3) holds the usual 3-3-4 scheme along with the other 35 ways of grouping TRIFIC's 10 signal grids.
+	if parts < 1 or grids < parts:
+		raise ValueError('Need at least one signal grid per partition')
+	schemes = []
+	for cuts in itertools.combinations(range(1,grids),parts-1):
+		edges = (0,)+cuts+(grids,)
+		schemes.append(pid.partition(*[edges[k+1]-edges[k] for k in range(parts)]))
+	return schemes
+
+def _selection(schemes,nregions):
+	# one matrix summing regions into the partitions of every scheme side by side, and the columns belonging to each scheme
+	columns = []
+	select = np.zeros((nregions,sum(len(scheme) for scheme in schemes)))
+	first = 0
+	for scheme in schemes:
+		for p, part in enumerate(scheme):
+			select[part,first+p] = 1
+		columns.append(slice(first,first+len(scheme)))
+		first += len(scheme)
+	return select, columns
+
+def _label(isotope):
+	return '{:g}{}'.format(isotope['Mass'],isotope['Name'])
+
+def separation(count,total,products):
+	# Separation of every pair of isotopes from their running sums: count (isotopes), total (isotopes x parts) and products (isotopes x
+	# parts x parts, the sums of the outer products of the partition sums). Returns an (isotopes x isotopes) array.
+	n = np.maximum(count,1)[:,None]
+	means = total/n
+	covariances = products/n[:,:,None]-means[:,:,None]*means[:,None,:]
+	niso, nparts = means.shape
+	result = np.zeros((niso,niso))
+	for a, b in itertools.combinations(range(niso),2):
+		pooled = (covariances[a]+covariances[b])/2
+		# a partition no ion deposits anything in has no spread at all; a small ridge keeps the inverse finite
+		pooled += np.eye(nparts)*max(np.trace(pooled)/nparts*1e-9,1e-12)
+		d = means[a]-means[b]
+		result[a,b] = result[b,a] = np.sqrt(max(float(d @ np.linalg.solve(pooled,d)),0))
+	return result
+
+def scanSources(sources,geometries=None,schemes=None,chunksize=262144):
+	# Scans every combination of geometry and partition scheme over collision data. sources is a collision file, a CollisionStore, or a
+	# list of either; geometries is a list of geometry dictionaries (changes from pid.GEOMETRY, see geometries()) and defaults to TRIFIC
+	# as mounted; schemes is a list of partition schemes (see groupings()) and defaults to the usual 3-3-4. Combinations where a scheme
+	# uses regions a geometry doesn't have (e.g. fewer grids) are left out.
+	# Returns one dictionary per combination with the 'Geometry' (in full), the 'Scheme', the 'Separation' of every pair of isotopes
+	# (keyed e.g. '80Se-80Kr') and the 'Worst' of these, in the order of the geometries and then the schemes.
+	if not isinstance(sources,list):
+		sources = [sources]
+	if geometries is None:
+		geometries = [{}]
+	if schemes is None:
+		schemes = [pid.SCHEME]
+	geos = [pid._geometry(geometry) for geometry in geometries]
+	selections = []
+	for geo in geos:
+		nregions = geo['Grids']+2
+		valid = [scheme for scheme in schemes if all(0 <= r < nregions for part in scheme for r in part)]
+		selections.append((valid,)+_selection(valid,nregions))
+
+	labels = []
+	stats = [None]*len(geos)
+
+	def accumulate(k,isotope,parts):
+		niso = len(labels)
+		count, total, products = stats[k] if stats[k] is not None else (np.zeros(0),np.zeros((0,parts.shape[1])),np.zeros((0,parts.shape[1],parts.shape[1])))
+		if len(count) < niso:
+			grow = niso-len(count)
+			count = np.concatenate([count,np.zeros(grow)])
+			total = np.concatenate([total,np.zeros((grow,parts.shape[1]))])
+			products = np.concatenate([products,np.zeros((grow,)+products.shape[1:])])
+		for i in np.unique(isotope):
+			these = parts[isotope == i]
+			count[i] += len(these)
+			total[i] += these.sum(axis=0)
+			products[i] += these.T @ these
+		stats[k] = (count,total,products)
+
+	for source in sources:
+		if isinstance(source,str):
+			source = collisions.reader(source,chunksize=chunksize)
+		index = {}
+		for chunk in source:
+			# isotopes are matched by name and mass, so the same isotope in several files is counted together
+			for i in np.unique(chunk['isotope']):
+				if i not in index:
+					label = _label(source.isotopes[i])
+					if label not in labels:
+						labels.append(label)
+					index[i] = labels.index(label)
+			prepared = pid.prepareChunk(chunk)
+			isotope = np.array([index[i] for i in chunk['isotope'][prepared['Starts']]],dtype=np.int64)
+			for k, geo in enumerate(geos):
+				if selections[k][0]:
+					accumulate(k,isotope,pid.binPrepared(prepared,geo) @ selections[k][1])
+
+	results = []
+	for k, geo in enumerate(geos):
+		valid, select, columns = selections[k]
+		if stats[k] is None:
+			continue
+		count, total, products = stats[k]
+		for scheme, cols in zip(valid,columns):
+			sep = separation(count,total[:,cols],products[:,cols,cols])
+			pairs = {labels[a]+'-'+labels[b]: float(sep[a,b]) for a, b in itertools.combinations(range(len(labels)),2)}
+			results.append({'Geometry': geo, 'Scheme': scheme, 'Separation': pairs,
+				'Worst': min(pairs.values()) if pairs else float('nan')})
+	return results
+
+def scan(saveto,fs,geometries=None,schemes=None,cache=True):
+	# As scanSources, for output files fs of simulation directory saveto; with cache the columnar stores are used (see pid.PIDData)
+	homedir = os.path.expanduser('~')
+	if saveto not in os.listdir(os.path.join(homedir,'TRIFIC','TRIMDATA')):
+		raise ValueError('Given directory not found')
+	outfiles = compression.listOutputs(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT'))
+	if any(f not in outfiles for f in fs):
+		raise ValueError('File not found in given directory')
+	if cache:
+		sources = [store.cached(saveto,f) for f in fs]
+	else:
+		sources = [os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT',f) for f in fs]
+	results = scanSources(sources,geometries,schemes)
+	catalog.recordAnalysis(saveto,fs)
+	return results
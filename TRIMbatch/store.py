@@ -0,0 +1,142 @@
+import json
+import os
+import shutil
+import numpy as np
+from . import collisions
+from . import compression
+
+# Binary, columnar copies of TRIM collision files so that repeated analyses don't have to parse the text again.
+# A converted file is a directory holding one .npy file per column of collision data and a per-ion index:
+#	energy.npy, x.npy, z.npy	one float32 entry per collision, in the order TRIM wrote them (keV, Angstrom, Angstrom)
+#	ions.npy			one entry per ion: isotope index, TRIM's ion number and the start/stop of its collisions in the columns
+#	meta.json			isotope names, masses and energies (from the file headers), the ions belonging to each isotope, and the
+#					size and modification time of the text file it was made from
+# Columns are opened memory-mapped, so jumping to one ion or one isotope only reads that part from disk.
+# Converted outputs of a simulation are kept in TRIMDATA/<saveto>/COLUMNS, in a directory named after the output file.
+
+IONS = np.dtype([('isotope','<i4'),('ion','<i4'),('start','<i8'),('stop','<i8')])
+COLUMNS = {'energy': np.dtype('<f4'), 'x': np.dtype('<f4'), 'z': np.dtype('<f4')}
+
+# a fixed header size lets a column be written in one pass and its length filled in once it is known
+_HEADERSIZE = 256
+
+def _header(dtype,n):
+	text = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({},), }}".format(np.lib.format.dtype_to_descr(dtype),n)
+	text = text.ljust(_HEADERSIZE-10-1)+'\n'
+	return b'\x93NUMPY\x01\x00'+np.uint16(len(text)).tobytes()+text.encode('latin-1')
+
+class _ColumnWriter:
+	def __init__(self,path,dtype):
+		self.dtype = dtype
+		self.n = 0
+		self.f = open(path,'wb')
+		self.f.write(_header(dtype,0))
+	def write(self,values):
+		self.f.write(np.ascontiguousarray(values,dtype=self.dtype).tobytes())
+		self.n += len(values)
+	def close(self):
+		self.f.seek(0)
+		self.f.write(_header(self.dtype,self.n))
+		self.f.close()
+
+def convert(path,directory,chunksize=262144):
+	# Converts the collision (or EXYZ) file at path to a columnar store in directory (replacing any existing one) and returns the directory.
+	# The store is written under a temporary name and renamed into place when complete.
+	st = os.stat(path)
+	tmpdir = directory+'.partial'
+	shutil.rmtree(tmpdir,ignore_errors=True)
+	os.makedirs(tmpdir)
+	writers = {col: _ColumnWriter(os.path.join(tmpdir,col+'.npy'),dtype) for col, dtype in COLUMNS.items()}
+	ionwriter = _ColumnWriter(os.path.join(tmpdir,'ions.npy'),IONS)
+	reader = collisions.reader(path,chunksize=chunksize)
+	offset = 0
+	for chunk in reader:
+		for col in COLUMNS:
+			writers[col].write(chunk[col])
+		starts = np.flatnonzero(collisions.ionStarts(chunk))
+		ions = np.zeros(len(starts),dtype=IONS)
+		ions['isotope'] = chunk['isotope'][starts]
+		ions['ion'] = chunk['ion'][starts]
+		ions['start'] = starts+offset
+		ions['stop'][:-1] = starts[1:]+offset
+		ions['stop'][-1] = len(chunk['ion'])+offset
+		ionwriter.write(ions)
+		offset += len(chunk['ion'])
+	for writer in writers.values():
+		writer.close()
+	ionwriter.close()
+
+	# record which ions belong to each isotope; the file is read in order, so they are always consecutive
+	ions = np.load(os.path.join(tmpdir,'ions.npy'),mmap_mode='r')
+	bounds = np.searchsorted(ions['isotope'],np.arange(len(reader.isotopes)+1))
+	isotopes = []
+	for i, iso in enumerate(reader.isotopes):
+		isotopes.append(dict(iso,Ions=[int(bounds[i]),int(bounds[i+1])]))
+	meta = {'Source': os.path.basename(path), 'Size': st.st_size, 'Mtime': st.st_mtime_ns, 'Collisions': offset, 'Isotopes': isotopes}
+	with open(os.path.join(tmpdir,'meta.json'),'w') as f:
+		json.dump(meta,f,indent=1)
+	del ions
+
+	shutil.rmtree(directory,ignore_errors=True)
+	os.rename(tmpdir,directory)
+	return directory
+
+class CollisionStore:
+	def __init__(self,directory,chunksize=262144):
+		self.directory = directory
+		self.chunksize = chunksize
+		with open(os.path.join(directory,'meta.json')) as f:
+			self.meta = json.load(f)
+		self.isotopes = [{'Name': iso['Name'], 'Mass': iso['Mass'], 'Energy': iso['Energy']} for iso in self.meta['Isotopes']]
+		self.ions = np.load(os.path.join(directory,'ions.npy'),mmap_mode='r')
+		self.columns = {col: np.load(os.path.join(directory,col+'.npy'),mmap_mode='r') for col in COLUMNS}
+	def __len__(self):
+		# number of ions in the store
+		return len(self.ions)
+	def __iter__(self):
+		return self.chunks()
+	def _slice(self,first,last):
+		# chunk in the same format as collisions.CollisionReader for ions first to last-1 (positions in the ion index)
+		ions = self.ions[first:last]
+		if len(ions) == 0:
+			return {col: np.zeros(0,dtype=np.int32 if col in ('isotope','ion') else np.float64) for col in collisions.COLUMNS}
+		start, stop = int(ions['start'][0]), int(ions['stop'][-1])
+		counts = ions['stop']-ions['start']
+		chunk = {
+			'isotope':	np.repeat(ions['isotope'],counts),
+			'ion':		np.repeat(ions['ion'],counts)
+			}
+		for col in COLUMNS:
+			chunk[col] = self.columns[col][start:stop].astype(np.float64)
+		return chunk
+	def ion(self,n):
+		# collisions of the n-th ion in the store (counting from 0 over all isotopes)
+		return self._slice(n,n+1)
+	def isotope(self,i):
+		# collisions of every ion of isotope i
+		first, last = self.meta['Isotopes'][i]['Ions']
+		return self._slice(first,last)
+	def chunks(self):
+		# iterate over the whole store in chunks of roughly chunksize collisions, never splitting an ion
+		first = 0
+		while first < len(self.ions):
+			target = self.ions['start'][first]+self.chunksize
+			last = max(int(np.searchsorted(self.ions['stop'],target,side='right')),first+1)
+			yield self._slice(first,last)
+			first = last
+
+def cached(saveto,f):
+	# Returns a CollisionStore for output file f of simulation directory saveto, converting it first if there is no store yet or the
+	# output has changed since it was converted. A compressed output is converted straight from its compressed file.
+	homedir = os.path.expanduser('~')
+	path = compression.resolve(os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'OUT',f))
+	directory = os.path.join(homedir,'TRIFIC','TRIMDATA',saveto,'COLUMNS',os.path.splitext(f)[0])
+	st = os.stat(path)
+	try:
+		store = CollisionStore(directory)
+		if store.meta['Size'] == st.st_size and store.meta['Mtime'] == st.st_mtime_ns:
+			return store
+	except (OSError, ValueError, KeyError):
+		pass
+	os.makedirs(os.path.dirname(directory),exist_ok=True)
+	return CollisionStore(convert(path,directory))
@@ -0,0 +1,110 @@
+import os
+import numpy as np
+
+# Synthetic stand-ins for the files TRIM reads and writes, so that the interface and analysis can be exercised (and benchmarked) on
+# machines without wine or SRIM. Nothing here is physics: the point is files with the exact layout of the real ones and numbers that
+# behave sensibly, i.e. ions that slow down and stop somewhere along the TRIFIC grids at a depth that depends on the isotope.
+
+SYMBOLS = ['H','He','Li','Be','B','C','N','O','F','Ne','Na','Mg','Al','Si','P','S','Cl','Ar','K','Ca','Sc','Ti','V','Cr','Mn','Fe',
+	'Co','Ni','Cu','Zn','Ga','Ge','As','Se','Br','Kr','Rb','Sr','Y','Zr','Nb','Mo','Tc','Ru','Rh','Pd','Ag','Cd','In','Sn','Sb','Te',
+	'I','Xe','Cs','Ba','La','Ce','Pr','Nd','Pm','Sm','Eu','Gd','Tb','Dy','Ho','Er','Tm','Yb','Lu','Hf','Ta','W','Re','Os','Ir','Pt',
+	'Au','Hg','Tl','Pb','Bi','Po','At','Rn','Fr','Ra','Ac','Th','Pa','U']
+
+# TRIM separates the columns of its collision tables with the code page 437 box drawing character, byte 0xB3
+SEP = b'\xb3'
+
+def writeDatabase(datadir):
+	# Writes an ATOMDATA and a Compound.dat in the layout ionparse and compoundparse read, with every element and a few compounds.
+	os.makedirs(datadir,exist_ok=True)
+	with open(os.path.join(datadir,'ATOMDATA'),'w') as f:
+		f.write('Synthetic atom data\n')
+		f.write('Z Symbol Name MAI-Mass MAI-Weight Natural-Weight Density Atomic-Density Fermi-Vel Heat-Subl GasDens Gas-Density\n')
+		for Z, symbol in enumerate(SYMBOLS,1):
+			weight = 2.0*Z+0.5
+			f.write('{} {} Element{} {} {:.3f} {:.3f} {:.3f} {:.3e} {:.3f} {:.3f} {:.5f} {:.3e}\n'.format(
+				Z,symbol,Z,2*Z,weight,weight,1.0+Z/50,5.0e22,1.0,2.0,9.0e-4*Z,2.7e19))
+	with open(os.path.join(datadir,'Compound.dat'),'w',encoding='iso-8859-1') as f:
+		f.write('Synthetic compound data\n')
+		f.write('"Name",Density,Number of elements,Z,Atoms,...\n')
+		f.write('"Mylar",1.397,3,1,4,6,5,8,2\n')
+		f.write('"Water_Liquid" 1.0,2,1,2,8,1\n')
+		f.write('"%Air",0.00120,2,7,4,8,1\n')
+		f.write('"Carbon Dioxide",0.00184,2,6,1,8,2\n')
+
+def _header(name,mass,energy):
+	# the isotope details are read from fixed columns by processSRIMData (and collisions.CollisionReader), so they are written to match
+	lines = [
+		b'=' * 75,
+		SEP+b'     Ion Name =       '+name.encode().ljust(2)+b' '*10+SEP,
+		SEP+b'     Ion Mass =      '+'{:7.3f}'.format(mass).encode()+b' amu'+SEP,
+		SEP+b'     Ion Energy ='+'{:11.1f}'.format(energy).encode()[:11]+b' keV'+SEP,
+		SEP+b' Ion    Energy   Depth(X)   Lateral-Distance    Atom   Recoil   Target   '+SEP,
+		SEP+b' Numb   (keV)   (Angstrom)  Y-axis    Z-axis   Hit   Energy(eV)  DISP.   '+SEP
+		]
+	return b'\r\n'.join(lines)+b'\r\n'
+
+def _number(fmt,width,value):
+	return fmt.format(value).encode()[:width].rjust(width)
+
+def writeCollisions(path,isotopes,ions,collisions=50,recoils=0,seed=0):
+	# Writes a collision file in TRIM's Ion+Recoils layout holding 'ions' ions of each isotope, one after the other.
+	# isotopes is a list of (symbol, mass, energy in keV) tuples, and every ion has 'collisions' collisions followed by a ruled line, which
+	# is where processSRIMData in TRIFICsim.cpp takes the ion to end. With recoils, a recoil cascade summary line also follows a collision
+	# with that probability, interrupting the ion's collisions; the Python readers skip these lines, but TRIFICsim ends an ion at any line
+	# that isn't a collision and so splits such ions in pieces, which is why there are none by default.
+	# Ions lose energy on a smooth range-energy curve, with a range that falls with the atomic number of the isotope, so that different
+	# isotopes separate in a PID plot. The first collision of every ion is in the entrance window, well before the grids. Ions are written
+	# in blocks so that memory use doesn't grow with the number of ions.
+	rng = np.random.default_rng(seed)
+	block = max(1,100000//collisions)
+	# the rule crosses the column separators of the collision lines
+	rule = b'\xc3'+b'\xc5'.join(b'\xc4'*width for width in (5,9,10,10,10,4,9,7))+b'\xb4'
+	with open(path,'wb') as f:
+		for symbol, mass, energy in isotopes:
+			Z = SYMBOLS.index(symbol)+1
+			f.write(_header(symbol,mass,energy))
+			# mean range in Angstrom: around 250 mm for A=80, Z=34 at 5.5 MeV/u
+			meanrange = 2.5e9*(energy/mass/5500.0)**1.5*(34.0/Z)**1.2*(mass/80.0)**0.5
+			for first in range(1,ions+1,block):
+				n = min(block,ions+1-first)
+				ranges = meanrange*(1+0.01*rng.standard_normal(n))
+				depth = np.sort(rng.random((n,collisions)),axis=1)*ranges[:,None]
+				depth[:,0] *= 1e-4
+				energies = energy*(1-depth/ranges[:,None])**(2/3)*(1-0.002*rng.random((n,collisions)))
+				vertical = np.cumsum(rng.standard_normal((n,collisions)),axis=1)*2e4
+				lateral = np.cumsum(rng.standard_normal((n,collisions)),axis=1)*2e4
+				cascade = rng.random((n,collisions)) < recoils
+				lines = []
+				for i in range(n):
+					ion = b'%05d' % (first+i)
+					for c in range(collisions):
+						lines.append(SEP+ion+SEP+_number('{:9.3E}',9,energies[i,c])+SEP+_number('{:10.4E}',10,depth[i,c])+SEP
+							+_number('{:10.3E}',10,lateral[i,c])+SEP+_number('{:10.3E}',10,vertical[i,c])+SEP+b' F  '+SEP
+							+b' 2.50E+01'+SEP+b'    1  '+SEP)
+						if cascade[i,c]:
+							lines.append(SEP+b' <== Recoil cascade: 1 atom displaced'+b' '*36+SEP)
+					lines.append(rule)
+				f.write(b'\r\n'.join(lines)+b'\r\n')
+
+def writeEXYZ(path,isotopes,ions,steps=50,seed=0):
+	# Writes an EXYZ.txt file (the lean output profile) for the same kind of ions as writeCollisions, with steps entries per ion. Real EXYZ
+	# files hold one isotope each; several may be given here to match the collision files, and are simply written one after the other.
+	rng = np.random.default_rng(seed)
+	block = max(1,100000//steps)
+	with open(path,'wb') as f:
+		f.write(b' '+b'='*70+b'\r\n Special EXYZ output file\r\n'+b' Ion     Energy      Depth (X)    Y           Z          Electronic  Energy lost to\r\n'
+			+b'Number   (keV)      (Angstrom)   (Angstrom)  (Angstrom)  Stop.(eV/A) Last Recoil(eV)\r\n'+b'------- '*7+b'\r\n')
+		for symbol, mass, energy in isotopes:
+			Z = SYMBOLS.index(symbol)+1
+			meanrange = 2.5e9*(energy/mass/5500.0)**1.5*(34.0/Z)**1.2*(mass/80.0)**0.5
+			for first in range(1,ions+1,block):
+				n = min(block,ions+1-first)
+				ranges = meanrange*(1+0.01*rng.standard_normal(n))
+				energies = np.linspace(energy,0,steps,endpoint=False)[None,:]*(1-0.002*rng.random((n,steps)))
+				depth = ranges[:,None]*(1-(energies/energy)**1.5)
+				vertical = np.cumsum(rng.standard_normal((n,steps)),axis=1)*2e4
+				lines = []
+				for i in range(n):
+					for s in range(steps):
+						lines.append(b'%07d  %10.4E  %10.4E  %10.4E  %10.4E  %10.4E  %10.4E' % (first+i,energies[i,s],depth[i,s],0.0,vertical[i,s],100.0,0.0))
+				f.write(b'\r\n'.join(lines)+b'\r\n')